@@ -0,0 +1,207 @@
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from database import store_cached_answer, get_cached_answers, invalidate_cached_answers
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Questions that only make sense with the previous turn are never served from the cache
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(and|what about|how about|same|also)\b|\b(it|its|that|those|these|them|they|previous|above)\b",
+    re.IGNORECASE,
+)
+
+
+class AnswerCache:
+    """
+    Semantic answer cache in front of process_question.
+
+    Questions are embedded and compared (cosine similarity) with the answered
+    questions of the same datasource scope that are still within their TTL. A
+    near-duplicate above the similarity threshold returns the stored answer
+    instead of running the assistant.
+
+    The in-memory tier is per replica and bounded by max_entries (oldest first
+    eviction). When shared is enabled, answers are also written to Cosmos DB and
+    misses in memory are looked up there, so replicas reuse each other's answers.
+    """
+
+    def __init__(self, embed, similarity_threshold=0.95, ttl_seconds=3600, max_entries=1000, shared=False):
+        """
+        Args:
+            embed (callable): Maps a question to its embedding (list of floats)
+            similarity_threshold (float): Minimum cosine similarity of a near-duplicate
+            ttl_seconds (int): How long an answer can be reused
+            max_entries (int): Maximum number of answers kept in memory
+            shared (bool): Also use the Cosmos DB tier shared across replicas
+        """
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.shared = shared
+        self._lock = threading.Lock()
+        # (scope, question) -> entry, oldest first
+        self._entries = OrderedDict()
+        self._stats = {
+            "lookups": 0,
+            "memory_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "skipped": 0,
+            "stores": 0,
+            "invalidated": 0,
+        }
+
+    @staticmethod
+    def is_cacheable(question):
+        """Follow-up questions depend on the conversation and are not cached"""
+        return bool(question and question.strip()) and not FOLLOW_UP_PATTERN.search(question)
+
+    def _normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _best_match(self, vector, candidates):
+        """Return (entry, similarity) of the most similar candidate, or (None, 0.0)"""
+        if not candidates:
+            return None, 0.0
+        similarities = np.vstack([entry["vector"] for entry in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        return candidates[best], float(similarities[best])
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def lookup(self, question, scope):
+        """
+        Find the answer of a near-duplicate question asked in the same scope.
+
+        Returns:
+            tuple: (answer or None, embedding of the question or None). The embedding
+            can be passed to store() to avoid embedding the question twice.
+        """
+        if not self.is_cacheable(question):
+            self._count("skipped")
+            return None, None
+
+        try:
+            embedding = self.embed(question)
+        except Exception as e:
+            logger.warning(f"Could not embed question for the answer cache: {str(e)}")
+            self._count("skipped")
+            return None, None
+        vector = self._normalize(embedding)
+        now = time.time()
+
+        with self._lock:
+            self._stats["lookups"] += 1
+            for key, entry in list(self._entries.items()):
+                if entry["expires_at"] <= now:
+                    del self._entries[key]
+            candidates = [entry for entry in self._entries.values() if entry["scope"] == scope]
+        entry, similarity = self._best_match(vector, candidates)
+        if entry and similarity >= self.similarity_threshold:
+            self._count("memory_hits")
+            logger.info(f"Answer cache hit in memory for scope {scope} (similarity {similarity:.3f})")
+            return entry["answer"], embedding
+
+        if self.shared:
+            documents = get_cached_answers(scope)
+            candidates = [
+                {**document, "vector": self._normalize(document["embedding"])}
+                for document in documents
+                if document.get("embedding")
+            ]
+            entry, similarity = self._best_match(vector, candidates)
+            if entry and similarity >= self.similarity_threshold:
+                self._count("shared_hits")
+                logger.info(f"Answer cache hit in Cosmos DB for scope {scope} (similarity {similarity:.3f})")
+                # Keep it in memory until it expires in the shared tier
+                self._remember(scope, entry["question"], entry["vector"], entry["answer"],
+                               entry.get("datasources", []), entry["expires_at"])
+                return entry["answer"], embedding
+
+        self._count("misses")
+        return None, embedding
+
+    def _remember(self, scope, question, vector, answer, datasources, expires_at):
+        with self._lock:
+            key = (scope, question)
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "scope": scope,
+                "question": question,
+                "vector": vector,
+                "answer": answer,
+                "datasources": list(datasources or []),
+                "expires_at": expires_at,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def store(self, question, scope, answer, datasources=None, embedding=None):
+        """
+        Cache the answer of a question.
+
+        Args:
+            question (str): The original question
+            scope (str): The datasource scope the question was asked in
+            answer (str): The answer
+            datasources (list): Datasources the answer was computed from, for invalidation
+            embedding (list): The question embedding returned by lookup(), if any
+        """
+        if not self.is_cacheable(question):
+            return
+        try:
+            embedding = embedding if embedding is not None else self.embed(question)
+        except Exception as e:
+            logger.warning(f"Could not embed question for the answer cache: {str(e)}")
+            return
+
+        self._remember(scope, question, self._normalize(embedding), answer, datasources,
+                       time.time() + self.ttl_seconds)
+        self._count("stores")
+        if self.shared:
+            store_cached_answer(scope, question, list(embedding), answer, datasources, self.ttl_seconds)
+
+    def invalidate(self, scope=None, datasource=None, include_shared=True):
+        """
+        Drop cached answers of a scope and/or computed from a datasource, or all of them if
+        neither is given. The shared tier is invalidated too unless include_shared is False
+        (another replica already did).
+
+        Returns:
+            int: Number of answers dropped from memory
+        """
+        with self._lock:
+            keys = [
+                key for key, entry in self._entries.items()
+                if (not scope or entry["scope"] == scope)
+                and (not datasource or entry["scope"] == datasource or datasource in entry["datasources"])
+            ]
+            for key in keys:
+                del self._entries[key]
+            self._stats["invalidated"] += len(keys)
+
+        if self.shared and include_shared:
+            invalidate_cached_answers(scope=scope, datasource=datasource)
+        logger.info(f"Invalidated {len(keys)} cached answers (scope={scope}, datasource={datasource})")
+        return len(keys)
+
+    def get_stats(self):
+        """Get lookup counts and hit rates of both tiers"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        hits = stats["memory_hits"] + stats["shared_hits"]
+        stats["hit_rate"] = round(hits / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats["memory_hit_rate"] = round(stats["memory_hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        return stats
@@ -34,12 +34,35 @@ CLEANUP_DAYS = int(os.getenv("CLEANUP_DAYS", "7"))
 CLEANUP_INTERVAL_HOURS = int(os.getenv("CLEANUP_INTERVAL_HOURS", "1"))
 
 # Assistant settings
+# Time budget of a request: failed runs are not retried and running runs are cancelled past it
+REQUEST_DEADLINE_SECONDS = int(os.getenv("REQUEST_DEADLINE_SECONDS", "300"))
 ASSISTANT_POOL_SIZE = int(os.getenv("ASSISTANT_POOL_SIZE", "5"))
 THREAD_LIFETIME_HOURS = int(os.getenv("THREAD_LIFETIME_HOURS", "24"))
 
 # Database type for the assistant
 DATABASE_TYPE = os.getenv("DATABASE_TYPE", "fabric")
 
+# Engine answering questions: "assistants" (Assistants API with the assistant pool)
+# or "chat_completions" (stateless tool loop, no pool and no code interpreter)
+ASSISTANT_ENGINES = ("assistants", "chat_completions")
+ASSISTANT_ENGINE = os.getenv("ASSISTANT_ENGINE", "assistants")
+
+# Question routing: classify questions as chit-chat, simple lookup or analytical and
+# send chit-chat to ROUTER_MODEL, simple lookups to the chat completions engine on
+# SIMPLE_LOOKUP_MODEL and analytical questions to ASSISTANT_ENGINE
+QUESTION_ROUTING_ENABLED = os.getenv("QUESTION_ROUTING_ENABLED", "false").lower() == "true"
+ROUTER_MODEL = os.getenv("ROUTER_MODEL", os.getenv("AZURE_OPENAI_MODEL_GPTMINI", "gpt-4o-mini"))
+SIMPLE_LOOKUP_MODEL = os.getenv("SIMPLE_LOOKUP_MODEL", os.getenv("AZURE_OPENAI_API_DEPLOYMENT"))
+
+# Semantic answer cache: reuse the answer of a near-duplicate question asked in the
+# same datasource scope within the TTL. ANSWER_CACHE_SHARED adds a Cosmos DB tier
+# shared across replicas on top of the in-memory one.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_SHARED = os.getenv("ANSWER_CACHE_SHARED", "false").lower() == "true"
+
 # Validate required settings
 def validate_config():
     """Validate that all required configuration settings are present."""
@@ -61,6 +84,9 @@ def validate_config():
     if missing_vars:
         raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
     
+    if ASSISTANT_ENGINE not in ASSISTANT_ENGINES:
+        raise ValueError(f"Invalid ASSISTANT_ENGINE {ASSISTANT_ENGINE!r}, expected one of: {', '.join(ASSISTANT_ENGINES)}")
+    
     return True
 
 # Path configurations
@@ -7,6 +7,9 @@ from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, OperationFailure
 from datetime import datetime, timedelta
 import backoff
+from contextlib import nullcontext
+import copy
+import functools
 from config import (
     MONGODB_CONNECTION_STRING,
     MONGODB_DATABASE_NAME,
@@ -16,6 +19,48 @@ from config import (
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def is_cosmos_failure(error):
+    """Connectivity failures count against Cosmos DB; rejected operations don't"""
+    return isinstance(error, (ConnectionFailure, ServerSelectionTimeoutError))
+
+# Circuit breaker guarding Cosmos DB operations and the error it raises while open, injected by the processor
+_circuit_breaker = None
+_circuit_open_error = ()
+
+def set_circuit_breaker(breaker, open_error=()):
+    """
+    Guard every database operation with a circuit breaker
+    
+    Args:
+        breaker: Object whose guard(is_failure) context manager wraps one call, or None
+        open_error: Exception class guard() raises instead of calling Cosmos DB while the breaker is open
+    """
+    global _circuit_breaker, _circuit_open_error
+    _circuit_breaker = breaker
+    _circuit_open_error = open_error
+
+def best_effort(fallback):
+    """
+    Decorator for database operations whose callers carry on without them (health logs,
+    pool bookkeeping, caches, rollups): return fallback instead of raising while Cosmos DB
+    is unreachable or its circuit breaker is open.
+    
+    The decorated function must re-raise connection failures (is_cosmos_failure) so the
+    breaker counts them.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not (is_cosmos_failure(e) or isinstance(e, _circuit_open_error)):
+                    raise
+                logger.warning(f"Skipped {func.__name__}, Cosmos DB is unavailable: {str(e)}")
+                return copy.copy(fallback)
+        return wrapper
+    return decorator
+
 # Singleton pattern for database connection with enhanced connection pooling
 class CosmosDBManager:
     _instance = None
@@ -59,6 +104,9 @@ class CosmosDBManager:
             self._conversation_collection = self._db["conversations"]
             self._health_collection = self._db["container_health"]
             self._assistant_pool_collection = self._db["assistant_pool"]
+            self._usage_rollup_collection = self._db["usage_rollups"]
+            self._answer_cache_collection = self._db["answer_cache"]
+            self._cache_generation_collection = self._db["cache_generations"]
             
             # Create indexes if needed for requests collection
             self._collection.create_index("request_id", unique=True)
@@ -93,6 +141,23 @@ class CosmosDBManager:
 
             self._assistant_pool_collection.create_index("assistant_id", unique=True)
 
+            # Create indexes for usage rollups (one document per scope/key/day)
+            self._usage_rollup_collection.create_index([
+                ("scope", pymongo.ASCENDING),
+                ("key", pymongo.ASCENDING),
+                ("day", pymongo.ASCENDING)
+            ], unique=True)
+
+            # Create indexes for the shared answer cache
+            self._answer_cache_collection.create_index([
+                ("scope", pymongo.ASCENDING),
+                ("expires_at", pymongo.DESCENDING)
+            ])
+            self._answer_cache_collection.create_index("datasources")
+
+            # One generation counter per datasource ("*" for all of them)
+            self._cache_generation_collection.create_index("datasource", unique=True)
+
             logger.info(f"MongoDB connection initialized successfully to database: {MONGODB_DATABASE_NAME}")
             
         except ConnectionFailure as e:
@@ -124,6 +189,18 @@ class CosmosDBManager:
         """Get the MongoDB collection for assistant pool"""
         return self._assistant_pool_collection
 
+    def get_usage_rollup_collection(self):
+        """Get the MongoDB collection for per-user and per-datasource usage rollups"""
+        return self._usage_rollup_collection
+
+    def get_answer_cache_collection(self):
+        """Get the MongoDB collection for the answer cache shared across replicas"""
+        return self._answer_cache_collection
+
+    def get_cache_generation_collection(self):
+        """Get the MongoDB collection for the cache generations shared across replicas"""
+        return self._cache_generation_collection
+
 # Retry decorator for database operations with exponential backoff
 @backoff.on_exception(
     backoff.expo,
@@ -135,10 +212,13 @@ class CosmosDBManager:
     )
 )
 def db_operation_with_retry(func):
-    """Decorator for database operations with retry logic"""
+    """Decorator for database operations with retry logic, behind the Cosmos DB circuit breaker"""
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         try:
-            return func(*args, **kwargs)
+            breaker = _circuit_breaker
+            with breaker.guard(is_cosmos_failure) if breaker is not None else nullcontext():
+                return func(*args, **kwargs)
         except (ConnectionFailure, ServerSelectionTimeoutError) as e:
             logger.error(f"Database connectivity error in {func.__name__}: {str(e)}")
             raise
@@ -151,6 +231,7 @@ def db_operation_with_retry(func):
     return wrapper
 
 # New function for container health logging
+@best_effort(False)
 @db_operation_with_retry
 def log_container_health_issue(error_type, details):
     """
@@ -179,6 +260,8 @@ def log_container_health_issue(error_type, details):
         return True
         
     except Exception as e:
+        if is_cosmos_failure(e):
+            raise
         # Log to console/file if we can't log to DB
         logger.error(f"Failed to log container health issue to Cosmos DB: {str(e)}")
         return False
@@ -244,6 +327,8 @@ def update_request_status(request_id, status, result=None):
             update_data["assistant_id"] = result["assistant_id"]
         if "thread_id" in result:
             update_data["thread_id"] = result["thread_id"]
+        if "usage" in result:
+            update_data["usage"] = result["usage"]
     
     # Update the document
     collection.update_one(
@@ -497,6 +582,7 @@ def get_container_health_history(container_id=None, error_type=None, limit=50):
         
     return documents
 
+@best_effort([])
 @db_operation_with_retry
 def get_pool_assistants():
     """Get assistants from the pool stored in Cosmos DB"""
@@ -510,12 +596,15 @@ def get_pool_assistants():
             
         return assistants
     except Exception as e:
+        if is_cosmos_failure(e):
+            raise
         logger.error(f"Failed to get pool assistants from Cosmos DB: {str(e)}")
         return []
 
+@best_effort(False)
 @db_operation_with_retry
-def store_pool_assistant(assistant_id):
-    """Store an assistant ID in the pool in Cosmos DB"""
+def store_pool_assistant(assistant_id, fingerprint=None):
+    """Store an assistant ID in the pool in Cosmos DB, with the fingerprint of its configuration"""
     try:
         collection = CosmosDBManager.get_instance().get_assistant_pool_collection()
         
@@ -523,6 +612,7 @@ def store_pool_assistant(assistant_id):
         now = int(time.time())
         document = {
             "assistant_id": assistant_id,
+            "fingerprint": fingerprint,
             "created_at": now,
             "updated_at": now
         }
@@ -537,9 +627,50 @@ def store_pool_assistant(assistant_id):
         logger.debug(f"Stored assistant {assistant_id} in pool")
         return True
     except Exception as e:
+        if is_cosmos_failure(e):
+            raise
         logger.error(f"Failed to store pool assistant in Cosmos DB: {str(e)}")
         return False
 
+@best_effort({})
+@db_operation_with_retry
+def get_pool_assistant_fingerprints():
+    """
+    Get the configuration fingerprint of every assistant in the pool
+    
+    Returns:
+        dict: Maps assistant_id -> fingerprint (None for assistants stored without one)
+    """
+    try:
+        collection = CosmosDBManager.get_instance().get_assistant_pool_collection()
+        cursor = collection.find({}, {"assistant_id": 1, "fingerprint": 1})
+        return {doc["assistant_id"]: doc.get("fingerprint") for doc in cursor}
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to get pool assistant fingerprints from Cosmos DB: {str(e)}")
+        return {}
+
+@best_effort(False)
+@db_operation_with_retry
+def update_pool_assistant_fingerprint(assistant_id, fingerprint):
+    """Record the configuration fingerprint of a pool assistant after an in-place update"""
+    try:
+        collection = CosmosDBManager.get_instance().get_assistant_pool_collection()
+        collection.update_one(
+            {"assistant_id": assistant_id},
+            {"$set": {"fingerprint": fingerprint, "updated_at": int(time.time())}}
+        )
+        
+        logger.debug(f"Updated fingerprint of pool assistant {assistant_id}")
+        return True
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to update pool assistant fingerprint in Cosmos DB: {str(e)}")
+        return False
+
+@best_effort(False)
 @db_operation_with_retry
 def remove_pool_assistant(assistant_id):
     """Remove an assistant ID from the pool in Cosmos DB"""
@@ -550,5 +681,190 @@ def remove_pool_assistant(assistant_id):
         logger.debug(f"Removed assistant {assistant_id} from pool")
         return True
     except Exception as e:
+        if is_cosmos_failure(e):
+            raise
         logger.error(f"Failed to remove pool assistant from Cosmos DB: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+@best_effort(False)
+@db_operation_with_retry
+def record_usage_rollups(user_email, datasources, usage):
+    """
+    Add the token usage of a request to the daily per-user and per-datasource rollups
+    
+    Args:
+        user_email (str): The user who made the request
+        datasources (list): Datasources touched by the request; each one is credited with the full usage
+        usage (dict): Totals from the request's usage ledger
+    """
+    try:
+        collection = CosmosDBManager.get_instance().get_usage_rollup_collection()
+        day = datetime.utcnow().strftime("%Y-%m-%d")
+        increments = {
+            "requests": 1,
+            "calls": usage.get("calls", 0),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0)
+        }
+        for kind, kind_usage in usage.get("by_kind", {}).items():
+            increments[f"by_kind.{kind}.calls"] = kind_usage["calls"]
+            increments[f"by_kind.{kind}.prompt_tokens"] = kind_usage["prompt_tokens"]
+            increments[f"by_kind.{kind}.completion_tokens"] = kind_usage["completion_tokens"]
+        
+        scopes = [("user", user_email or "unknown")]
+        scopes += [("datasource", datasource) for datasource in (datasources or ["none"])]
+        for scope, key in scopes:
+            collection.update_one(
+                {"scope": scope, "key": key, "day": day},
+                {"$inc": increments, "$set": {"updated_at": int(time.time())}},
+                upsert=True
+            )
+        
+        logger.debug(f"Recorded usage rollups for {len(scopes)} scopes")
+        return True
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to record usage rollups in Cosmos DB: {str(e)}")
+        return False
+
+# Shared answer cache functions
+@best_effort(False)
+@db_operation_with_retry
+def store_cached_answer(scope, question, embedding, answer, datasources, ttl_seconds):
+    """
+    Store an answer in the answer cache shared across replicas
+    
+    Args:
+        scope (str): The datasource scope the question was asked in
+        question (str): The original question
+        embedding (list): The question embedding
+        answer (str): The answer to reuse for near-duplicate questions
+        datasources (list): Datasources the answer was computed from, for invalidation
+        ttl_seconds (int): How long the answer stays valid
+    """
+    try:
+        collection = CosmosDBManager.get_instance().get_answer_cache_collection()
+        now = int(time.time())
+        collection.insert_one({
+            "scope": scope,
+            "question": question,
+            "embedding": embedding,
+            "answer": answer,
+            "datasources": datasources or [],
+            "created_at": now,
+            "expires_at": now + ttl_seconds
+        })
+        
+        logger.debug(f"Stored cached answer for scope {scope}")
+        return True
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to store cached answer in Cosmos DB: {str(e)}")
+        return False
+
+@best_effort([])
+@db_operation_with_retry
+def get_cached_answers(scope, limit=200):
+    """
+    Get the unexpired cached answers of a scope, newest first
+    
+    Returns:
+        list: Answer cache documents, or an empty list if the lookup fails
+    """
+    try:
+        collection = CosmosDBManager.get_instance().get_answer_cache_collection()
+        cursor = collection.find(
+            {"scope": scope, "expires_at": {"$gt": int(time.time())}},
+            {"_id": 0}
+        ).sort("expires_at", pymongo.DESCENDING).limit(limit)
+        return list(cursor)
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to get cached answers from Cosmos DB: {str(e)}")
+        return []
+
+@best_effort(0)
+@db_operation_with_retry
+def invalidate_cached_answers(scope=None, datasource=None):
+    """
+    Delete shared cached answers of a scope and/or computed from a datasource (all of them if neither is given)
+    
+    Returns:
+        int: Number of deleted answers
+    """
+    try:
+        collection = CosmosDBManager.get_instance().get_answer_cache_collection()
+        filter_dict = {}
+        if scope:
+            filter_dict["scope"] = scope
+        if datasource:
+            filter_dict["$or"] = [{"scope": datasource}, {"datasources": datasource}]
+        result = collection.delete_many(filter_dict)
+        
+        logger.info(f"Invalidated {result.deleted_count} shared cached answers")
+        return result.deleted_count
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to invalidate cached answers in Cosmos DB: {str(e)}")
+        return 0
+
+@db_operation_with_retry
+def cleanup_expired_cached_answers():
+    """Delete expired answers from the shared answer cache"""
+    collection = CosmosDBManager.get_instance().get_answer_cache_collection()
+    result = collection.delete_many({"expires_at": {"$lt": int(time.time())}})
+    
+    logger.info(f"Cleaned up {result.deleted_count} expired cached answers")
+    return result.deleted_count
+
+# Cache generations shared across replicas
+@best_effort(None)
+@db_operation_with_retry
+def bump_cache_generation(datasource=None):
+    """
+    Increment the cache generation of a datasource (of all datasources without one), so every
+    replica drops its caches of it on its next generation check
+    
+    Returns:
+        int: The new generation, or None if it could not be stored
+    """
+    try:
+        collection = CosmosDBManager.get_instance().get_cache_generation_collection()
+        document = collection.find_one_and_update(
+            {"datasource": datasource or "*"},
+            {"$inc": {"generation": 1}, "$set": {"updated_at": int(time.time())}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        
+        logger.info(f"Cache generation of {datasource or 'all datasources'} is now {document['generation']}")
+        return document["generation"]
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to bump the cache generation in Cosmos DB: {str(e)}")
+        return None
+
+@best_effort(None)
+@db_operation_with_retry
+def get_cache_generations():
+    """
+    Get the shared cache generations
+    
+    Returns:
+        dict: Datasource ("*" for all of them) -> generation, or None if the lookup fails
+    """
+    try:
+        collection = CosmosDBManager.get_instance().get_cache_generation_collection()
+        return {document["datasource"]: document["generation"] for document in collection.find({}, {"_id": 0})}
+    except Exception as e:
+        if is_cosmos_failure(e):
+            raise
+        logger.error(f"Failed to get cache generations from Cosmos DB: {str(e)}")
+        return None
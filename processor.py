@@ -8,6 +8,7 @@ import threading
 from concurrent.futures import ThreadPoolExecutor, wait
 from azure.servicebus import ServiceBusClient, ServiceBusMessage, ServiceBusReceiveMode
 from azure.servicebus.exceptions import ServiceBusConnectionError, ServiceBusError
+from azure.servicebus.management import ServiceBusAdministrationClient
 import importlib.util
 from pathlib import Path
 from openai import AzureOpenAI
@@ -25,6 +26,17 @@ from config import (
     CLEANUP_INTERVAL_HOURS,
     LOGS_DIR,
     DATABASE_TYPE,
+    ASSISTANT_ENGINE,
+    QUESTION_ROUTING_ENABLED,
+    ROUTER_MODEL,
+    SIMPLE_LOOKUP_MODEL,
+    AZURE_OPENAI_EMBEDDING_MODEL_NAME,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SHARED,
+    REQUEST_DEADLINE_SECONDS,
     validate_config
 )
 
@@ -42,8 +54,16 @@ from database import (
     # New functions for assistant pool persistence
     get_pool_assistants,
     store_pool_assistant,
-    remove_pool_assistant
+    remove_pool_assistant,
+    get_pool_assistant_fingerprints,
+    update_pool_assistant_fingerprint,
+    record_usage_rollups,
+    cleanup_expired_cached_answers,
+    set_circuit_breaker,
+    bump_cache_generation,
+    get_cache_generations
 )
+from answer_cache import AnswerCache
 
 # Import logging utils
 from logging_utils import setup_logging, verify_logging_paths, init_logging
@@ -55,9 +75,30 @@ if os.path.exists(main_path):
     main_module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(main_module)
     initialize_assistant = main_module.initialize_assistant
+    initialize_chat_engine = main_module.initialize_chat_engine
+    initialize_question_router = main_module.initialize_question_router
+    get_tool_registry = main_module.get_tool_registry
 else:
     raise ImportError("Could not find src/main.py which contains initialize_assistant")
 
+# src/ is on sys.path once main.py is loaded; import lib modules under the same names it uses
+from lib.usage import start_usage_ledger, record_usage
+from lib.rate_limiter import estimate_tokens, get_rate_limiter_stats
+from lib.load_balancer import get_load_balancer
+from lib.circuit_breaker import CircuitOpenError, get_circuit_breaker, get_circuit_breaker_states, get_circuit_wait_time
+from lib.router import ROUTE_CHIT_CHAT, ROUTE_SIMPLE_LOOKUP, ROUTE_ANALYTICAL
+from lib.sql_verifier import get_verification_cache
+from lib.connection_pool import get_connection_pool_stats
+from lib.token_provider import get_token_provider_stats
+from lib.result_cache import get_result_cache
+from lib.distinct_values import get_distinct_value_store
+from lib.value_index import get_value_index
+from lib.tools_fabric import start_value_stores
+from lib.schema_catalog import get_schema_catalog
+
+# Cosmos DB operations share the breaker registry of the other dependencies
+set_circuit_breaker(get_circuit_breaker("cosmos"), CircuitOpenError)
+
 # Set up logging
 logger = init_logging()
 logger.info("NL2SQL Queue Processor starting up")
@@ -66,9 +107,22 @@ logger.info("NL2SQL Queue Processor starting up")
 validate_config()
 
 # Assistant Pool Configuration
-ASSISTANT_POOL_SIZE = int(os.getenv("ASSISTANT_POOL_SIZE", "5"))
+ASSISTANT_POOL_SIZE = int(os.getenv("ASSISTANT_POOL_SIZE", "5"))  # Initial target size
+ASSISTANT_POOL_MIN_SIZE = int(os.getenv("ASSISTANT_POOL_MIN_SIZE", "2"))
+ASSISTANT_POOL_MAX_SIZE = int(os.getenv("ASSISTANT_POOL_MAX_SIZE", str(max(ASSISTANT_POOL_SIZE, MAX_WORKERS))))
+ASSISTANT_POOL_HEADROOM = int(os.getenv("ASSISTANT_POOL_HEADROOM", "1"))  # Spare assistants above demand
+ASSISTANT_POOL_IDLE_SECONDS = int(os.getenv("ASSISTANT_POOL_IDLE_SECONDS", "1800"))  # Idle time before retiring
+ASSISTANT_POOL_SCALE_INTERVAL = int(os.getenv("ASSISTANT_POOL_SCALE_INTERVAL", "60"))  # Seconds between scaling decisions
+ASSISTANT_PROVISION_CONCURRENCY = int(os.getenv("ASSISTANT_PROVISION_CONCURRENCY", "5"))
+ASSISTANT_VERIFY_CONCURRENCY = int(os.getenv("ASSISTANT_VERIFY_CONCURRENCY", "8"))  # Parallel retrieve calls when verifying
+ASSISTANT_VERIFIED_TTL_SECONDS = int(os.getenv("ASSISTANT_VERIFIED_TTL_SECONDS", "3600"))  # Skip re-verifying within this window
 THREAD_LIFETIME_HOURS = int(os.getenv("THREAD_LIFETIME_HOURS", "24"))
 THREAD_LIFETIME_SECONDS = THREAD_LIFETIME_HOURS * 3600
+# How often the cache generations shared in Cosmos DB are checked for refreshes handled by other replicas
+CACHE_GENERATION_CHECK_SECONDS = float(os.getenv("CACHE_GENERATION_CHECK_SECONDS", "30"))
+
+# The assistant pool is only needed by the Assistants API engine
+USE_ASSISTANT_POOL = ASSISTANT_ENGINE == "assistants"
 
 # Thread safety mechanisms
 active_requests = {}
@@ -81,6 +135,27 @@ assistant_assignments = {}  # Maps assistant_id -> {user_email, thread_id, last_
 thread_cache = {}  # Maps user_email -> {assistant_id, thread_id, created_at}
 thread_cache_lock = threading.RLock()
 
+# Pool autoscaling state (guarded by assistant_pool_lock)
+pool_target_size = min(max(ASSISTANT_POOL_SIZE, ASSISTANT_POOL_MIN_SIZE), ASSISTANT_POOL_MAX_SIZE)
+pool_peak_in_use = 0  # Highest number of assistants in use since the last scaling decision
+last_batch_size = 0  # Size of the last batch received from Service Bus (queue depth fallback)
+pool_provisioning_lock = threading.Lock()  # Serializes provisioning, never held with assistant_pool_lock
+assistant_verified_at = {}  # Maps assistant_id -> last time it was retrieved or used successfully (guarded by assistant_pool_lock)
+assistant_added_at = {}  # Maps assistant_id -> time it entered the pool, the idle baseline until it is used (guarded by assistant_pool_lock)
+
+# Shared Azure OpenAI client for pool management calls
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+# Prompt caching statistics per deployment: {deployment: {requests, prompt_tokens, cached_tokens}}
+prompt_cache_stats = {}
+prompt_cache_stats_lock = threading.Lock()
+
+# Cache generations of the datasources this replica's caches are up to date with (None until the first check)
+seen_cache_generations = None
+cache_generations_checked_at = 0
+cache_generations_lock = threading.Lock()
+
 # Message batch tracking for bulk operations
 pending_conversations = []
 pending_conversations_lock = threading.RLock()
@@ -112,31 +187,21 @@ def initialize_assistant_pool():
     if existing_assistants:
         logger.info(f"Found {len(existing_assistants)} existing assistants in Cosmos DB")
         
-        # Verify each assistant exists in OpenAI
-        valid_assistants = []
-        for assistant_id in existing_assistants:
-            try:
-                # Try to retrieve the assistant to verify it exists
-                client = AzureOpenAI(
-                    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-                    azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
-                )
-                client.beta.assistants.retrieve(assistant_id)
-                
-                # If successful, add to our valid assistants
-                valid_assistants.append(assistant_id)
-                logger.info(f"Verified existing assistant: {assistant_id}")
-                
-            except Exception as e:
-                logger.warning(f"Assistant {assistant_id} from DB no longer exists in OpenAI: {e}")
-                # Remove from Cosmos DB since it's no longer valid
-                remove_pool_assistant(assistant_id)
+        # Verify the assistants exist in OpenAI concurrently
+        valid_assistants, invalid_assistants = verify_assistants(existing_assistants)
+        for assistant_id in invalid_assistants:
+            # Remove from Cosmos DB since it's no longer valid
+            remove_pool_assistant(assistant_id)
+        logger.info(f"Verified {len(valid_assistants)}/{len(existing_assistants)} existing assistants")
+        
+        # Bring assistants created with an older configuration up to date in place
+        reconcile_assistant_configs(valid_assistants)
         
         # Add valid assistants to our pool
         with assistant_pool_lock:
             assistant_pool = valid_assistants
             for assistant_id in assistant_pool:
+                assistant_added_at[assistant_id] = time.time()
                 assistant_assignments[assistant_id] = {
                     "user_email": None,
                     "thread_id": None,
@@ -144,41 +209,337 @@ def initialize_assistant_pool():
                     "in_use": False
                 }
     
-    # Check if we need to create additional assistants to reach the target size
-    assistants_to_create = max(0, ASSISTANT_POOL_SIZE - len(assistant_pool))
+    # Create additional assistants in parallel to reach the target size
+    with assistant_pool_lock:
+        assistants_to_create = max(0, pool_target_size - len(assistant_pool))
     
     if assistants_to_create > 0:
         logger.info(f"Creating {assistants_to_create} new assistants to reach target pool size")
+        provision_assistants(assistants_to_create)
+    
+    # Log final pool status
+    with assistant_pool_lock:
+        logger.info(f"Assistant pool initialized with {len(assistant_pool)}/{pool_target_size} assistants")
+    
+    return len(assistant_pool) > 0
+
+def get_openai_client():
+    """Get the shared Azure OpenAI client used for pool management"""
+    global _openai_client
+    with _openai_client_lock:
+        if _openai_client is None:
+            _openai_client = AzureOpenAI(
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+                azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
+            )
+        return _openai_client
+
+def embed_question(question):
+    """Embed a question for the answer cache"""
+    response = get_load_balancer().call(
+        AZURE_OPENAI_EMBEDDING_MODEL_NAME,
+        lambda client, deployment: client.embeddings.create(input=question, model=deployment),
+        estimated_tokens=estimate_tokens(question)
+    )
+    record_usage("embedding", AZURE_OPENAI_EMBEDDING_MODEL_NAME, response.usage)
+    return response.data[0].embedding
+
+# Semantic cache of answers, in front of process_question
+answer_cache = AnswerCache(
+    embed_question,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    shared=ANSWER_CACHE_SHARED
+)
+
+def verify_assistants(assistant_ids):
+    """
+    Verify that assistants still exist in OpenAI with a bounded number of concurrent retrieve calls.
+    Must be called without holding assistant_pool_lock.
+    
+    Args:
+        assistant_ids: The assistant IDs to verify
         
-        created_count = 0
-        for i in range(assistants_to_create):
-            try:
-                assistant = initialize_assistant(DATABASE_TYPE)
-                assistant_id = assistant.assistant.assistant_id
-                
-                # Store in Cosmos DB for persistence
-                store_pool_assistant(assistant_id)
+    Returns:
+        tuple: (valid_ids, invalid_ids). Assistants that could not be checked because of
+        transient errors are treated as valid and simply not marked as verified.
+    """
+    if not assistant_ids:
+        return [], []
+    
+    def verify(assistant_id):
+        try:
+            get_openai_client().beta.assistants.retrieve(assistant_id)
+            return True
+        except openai.NotFoundError as e:
+            logger.warning(f"Assistant {assistant_id} no longer exists in OpenAI: {e}")
+            return False
+        except Exception as e:
+            logger.warning(f"Could not verify assistant {assistant_id}, keeping it: {e}")
+            return None
+    
+    with ThreadPoolExecutor(max_workers=min(len(assistant_ids), ASSISTANT_VERIFY_CONCURRENCY)) as verifier:
+        results = list(verifier.map(verify, assistant_ids))
+    
+    valid_ids = [a for a, ok in zip(assistant_ids, results) if ok is not False]
+    invalid_ids = [a for a, ok in zip(assistant_ids, results) if ok is False]
+    for assistant_id, ok in zip(assistant_ids, results):
+        if ok:
+            mark_assistant_verified(assistant_id)
+    return valid_ids, invalid_ids
+
+def reconcile_assistant_configs(assistant_ids):
+    """
+    Update, in parallel, pool assistants whose stored configuration fingerprint differs from
+    the current one (model, instructions, tools, temperature). Stale assistants are updated
+    with assistants.update and never recreated.
+    
+    Args:
+        assistant_ids: The pool assistant IDs to check
+        
+    Returns:
+        int: Number of assistants updated
+    """
+    if not assistant_ids:
+        return 0
+    
+    assistant_manager = initialize_assistant(DATABASE_TYPE, load_assistant=False)
+    current_fingerprint = assistant_manager.fingerprint
+    stored_fingerprints = get_pool_assistant_fingerprints()
+    stale_assistants = [
+        assistant_id for assistant_id in assistant_ids
+        if stored_fingerprints.get(assistant_id) != current_fingerprint
+    ]
+    if not stale_assistants:
+        logger.info(f"All {len(assistant_ids)} pool assistants match configuration {current_fingerprint[:12]}")
+        return 0
+    
+    logger.info(f"Updating {len(stale_assistants)} pool assistants to configuration {current_fingerprint[:12]}")
+    
+    def update(assistant_id):
+        try:
+            assistant_manager.update_assistant(assistant_id)
+            update_pool_assistant_fingerprint(assistant_id, current_fingerprint)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to update assistant {assistant_id}: {str(e)}")
+            return False
+    
+    with ThreadPoolExecutor(max_workers=min(len(stale_assistants), ASSISTANT_VERIFY_CONCURRENCY)) as updater:
+        updated_count = sum(updater.map(update, stale_assistants))
+    
+    logger.info(f"Updated {updated_count}/{len(stale_assistants)} stale pool assistants in place")
+    return updated_count
+
+def mark_assistant_verified(assistant_id):
+    """Record that an assistant was just retrieved or used successfully"""
+    with assistant_pool_lock:
+        assistant_verified_at[assistant_id] = time.time()
+
+def get_assistants_to_verify():
+    """Get the pool assistants that haven't been verified within ASSISTANT_VERIFIED_TTL_SECONDS"""
+    now = time.time()
+    with assistant_pool_lock:
+        return [
+            assistant_id for assistant_id in assistant_pool
+            if now - assistant_verified_at.get(assistant_id, 0) > ASSISTANT_VERIFIED_TTL_SECONDS
+        ]
+
+def remove_assistants_from_pool(assistant_ids):
+    """Remove assistants from the in-memory pool and from Cosmos DB"""
+    with assistant_pool_lock:
+        for assistant_id in assistant_ids:
+            if assistant_id in assistant_pool:
+                assistant_pool.remove(assistant_id)
+            assistant_assignments.pop(assistant_id, None)
+            assistant_verified_at.pop(assistant_id, None)
+            assistant_added_at.pop(assistant_id, None)
+    
+    for assistant_id in assistant_ids:
+        remove_pool_assistant(assistant_id)
+
+def create_pool_assistant():
+    """
+    Create a new assistant and persist it in Cosmos DB. Runs without holding any pool lock.
+    
+    Returns:
+        str: The new assistant ID
+    """
+    assistant = initialize_assistant(DATABASE_TYPE)
+    assistant_id = assistant.assistant.assistant_id
+    
+    # Store in Cosmos DB for persistence, with the fingerprint of the configuration it was created with
+    store_pool_assistant(assistant_id, fingerprint=assistant.fingerprint)
+    mark_assistant_verified(assistant_id)
+    return assistant_id
+
+def provision_assistants(count):
+    """
+    Create up to `count` assistants in parallel outside the pool lock and add them to the pool,
+    without growing the pool beyond its current target size
+    
+    Args:
+        count: Number of assistants to create
+        
+    Returns:
+        int: Number of assistants actually added
+    """
+    if count <= 0:
+        return 0
+    
+    added_count = 0
+    with pool_provisioning_lock:
+        # Another caller may have provisioned while we waited, never overshoot the target
+        with assistant_pool_lock:
+            count = min(count, pool_target_size - len(assistant_pool))
+        if count <= 0:
+            return 0
+        
+        with ThreadPoolExecutor(max_workers=min(count, ASSISTANT_PROVISION_CONCURRENCY)) as provisioner:
+            futures = [provisioner.submit(create_pool_assistant) for _ in range(count)]
+            for future in futures:
+                try:
+                    assistant_id = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to create assistant for pool: {str(e)}", exc_info=True)
+                    continue
                 
+                # Only the in-memory update happens under the lock
                 with assistant_pool_lock:
                     assistant_pool.append(assistant_id)
+                    assistant_added_at[assistant_id] = time.time()
                     assistant_assignments[assistant_id] = {
                         "user_email": None,
                         "thread_id": None,
                         "last_used": None,
                         "in_use": False
                     }
-                    
-                created_count += 1
-                logger.info(f"Created and stored new assistant {i+1}/{assistants_to_create} with ID: {assistant_id}")
-                
-            except Exception as e:
-                logger.error(f"Failed to create assistant {i+1}/{assistants_to_create}: {str(e)}", exc_info=True)
+                added_count += 1
+                logger.info(f"Added new assistant to pool: {assistant_id}")
     
-    # Log final pool status
+    logger.info(f"Provisioned {added_count}/{count} assistants. Pool size: {len(assistant_pool)}")
+    return added_count
+
+def retire_idle_assistants(count):
+    """
+    Remove up to `count` idle assistants from the pool and delete them.
+    An assistant is idle when it is not in use and hasn't been used for ASSISTANT_POOL_IDLE_SECONDS
+    (counted from when it entered the pool if it was never used).
+    
+    Args:
+        count: Maximum number of assistants to retire
+        
+    Returns:
+        int: Number of assistants retired
+    """
+    now = time.time()
+    retired = []
     with assistant_pool_lock:
-        logger.info(f"Assistant pool initialized with {len(assistant_pool)}/{ASSISTANT_POOL_SIZE} assistants")
+        def idle_since(assistant_id):
+            return assistant_assignments[assistant_id]["last_used"] or assistant_added_at.get(assistant_id, now)
+        
+        candidates = [
+            assistant_id for assistant_id in assistant_pool
+            if not assistant_assignments[assistant_id]["in_use"]
+            and now - idle_since(assistant_id) > ASSISTANT_POOL_IDLE_SECONDS
+        ]
+        # Retire the least recently used assistants first, never going below the minimum size
+        candidates.sort(key=idle_since)
+        count = min(count, len(assistant_pool) - ASSISTANT_POOL_MIN_SIZE)
+        for assistant_id in candidates[:max(0, count)]:
+            assistant_pool.remove(assistant_id)
+            del assistant_assignments[assistant_id]
+            assistant_verified_at.pop(assistant_id, None)
+            assistant_added_at.pop(assistant_id, None)
+            retired.append(assistant_id)
     
-    return len(assistant_pool) > 0
+    # Network and database calls happen outside the lock
+    for assistant_id in retired:
+        remove_pool_assistant(assistant_id)
+        try:
+            get_openai_client().beta.assistants.delete(assistant_id=assistant_id)
+        except Exception as e:
+            logger.warning(f"Could not delete retired assistant {assistant_id}: {str(e)}")
+        logger.info(f"Retired idle assistant {assistant_id}")
+    
+    return len(retired)
+
+def get_queue_depth():
+    """
+    Get the number of messages waiting in the queue.
+    Falls back to the size of the last received batch if the management API is unavailable.
+    """
+    try:
+        admin_client = ServiceBusAdministrationClient.from_connection_string(
+            AZURE_SERVICE_BUS_CONNECTION_STRING
+        )
+        with admin_client:
+            properties = admin_client.get_queue_runtime_properties(AZURE_SERVICE_BUS_QUEUE_NAME)
+        return properties.active_message_count
+    except Exception as e:
+        logger.debug(f"Could not read queue runtime properties, using last batch size: {str(e)}")
+        return last_batch_size
+
+def get_pool_metrics():
+    """
+    Get a snapshot of the assistant pool utilisation
+    
+    Returns:
+        dict: Pool size, target, bounds, assistants in use and utilisation ratio
+    """
+    with assistant_pool_lock:
+        pool_size = len(assistant_pool)
+        in_use = sum(1 for a in assistant_assignments.values() if a["in_use"])
+        return {
+            "pool_size": pool_size,
+            "pool_target": pool_target_size,
+            "pool_min": ASSISTANT_POOL_MIN_SIZE,
+            "pool_max": ASSISTANT_POOL_MAX_SIZE,
+            "in_use": in_use,
+            "peak_in_use": pool_peak_in_use,
+            "utilization": round(in_use / pool_size, 2) if pool_size else 0.0
+        }
+
+def autoscale_assistant_pool():
+    """
+    Resize the assistant pool from observed concurrency and queue depth, within the configured bounds.
+    Workers only handle MAX_WORKERS requests at a time, so queued demand is capped at that.
+    """
+    global pool_target_size, pool_peak_in_use
+    
+    queue_depth = get_queue_depth()
+    with assistant_pool_lock:
+        in_use = sum(1 for a in assistant_assignments.values() if a["in_use"])
+        demand = min(max(pool_peak_in_use, in_use) + queue_depth, MAX_WORKERS)
+        desired = min(max(demand + ASSISTANT_POOL_HEADROOM, ASSISTANT_POOL_MIN_SIZE), ASSISTANT_POOL_MAX_SIZE)
+        previous_target = pool_target_size
+        pool_target_size = desired
+        pool_peak_in_use = in_use
+        current_size = len(assistant_pool)
+    
+    if desired != previous_target:
+        logger.info(f"Assistant pool target changed from {previous_target} to {desired} "
+                    f"(in use: {in_use}, queue depth: {queue_depth})")
+    
+    if desired > current_size:
+        provision_assistants(desired - current_size)
+    elif desired < current_size:
+        retired = retire_idle_assistants(current_size - desired)
+        if retired:
+            logger.info(f"Retired {retired} idle assistants, pool size: {len(assistant_pool)}")
+
+def pool_autoscaler_loop():
+    """Background loop that periodically resizes the assistant pool"""
+    while True:
+        time.sleep(ASSISTANT_POOL_SCALE_INTERVAL)
+        try:
+            autoscale_assistant_pool()
+            metrics = get_pool_metrics()
+            logger.info(f"Assistant pool utilisation: {json.dumps(metrics)}")
+        except Exception as e:
+            logger.error(f"Error during assistant pool autoscaling: {str(e)}", exc_info=True)
 
 def get_available_assistant(user_email):
     """
@@ -190,6 +551,8 @@ def get_available_assistant(user_email):
     Returns:
         tuple: (assistant_id, thread_id, is_new_thread)
     """
+    global pool_peak_in_use
+    
     # First check if the user already has a thread in the cache
     with thread_cache_lock:
         if user_email in thread_cache:
@@ -226,9 +589,14 @@ def get_available_assistant(user_email):
                     "last_used": time.time(),
                     "in_use": True
                 }
+                in_use = sum(1 for a in assistant_assignments.values() if a["in_use"])
+                pool_peak_in_use = max(pool_peak_in_use, in_use)
                 logger.info(f"Assigned available assistant {assistant_id} to user {user_email}")
                 return assistant_id, None, True
         
+        # All assistants are busy, so demand exceeds the pool size
+        pool_peak_in_use = max(pool_peak_in_use, len(assistant_pool) + 1)
+        
         # If all assistants are in use, find the least recently used
         least_recent_time = float('inf')
         least_recent_assistant = None
@@ -373,12 +741,23 @@ def check_container_health():
         
         # Check assistant pool health
         with assistant_pool_lock:
-            if len(assistant_pool) < ASSISTANT_POOL_SIZE * 0.5:
-                logger.warning(f"Assistant pool size is critically low: {len(assistant_pool)}/{ASSISTANT_POOL_SIZE}")
-                log_container_health_issue("assistant_pool_depleted", 
-                                          f"Only {len(assistant_pool)}/{ASSISTANT_POOL_SIZE} assistants in pool")
-                # Try to replenish the pool
-                replenish_assistant_pool()
+            pool_size = len(assistant_pool)
+            target_size = pool_target_size
+        if USE_ASSISTANT_POOL and pool_size < target_size * 0.5:
+            logger.warning(f"Assistant pool size is critically low: {pool_size}/{target_size}")
+            log_container_health_issue("assistant_pool_depleted", 
+                                      f"Only {pool_size}/{target_size} assistants in pool")
+            # Try to replenish the pool (outside the lock)
+            replenish_assistant_pool()
+        
+        # Report open circuit breakers: a dependency is failing, but restarting the
+        # container would not help, so they don't fail the health check
+        breaker_states = get_circuit_breaker_states()
+        open_breakers = [name for name, state in breaker_states.items() if state["state"] == "open"]
+        if open_breakers:
+            logger.warning(f"Circuit breakers open: {open_breakers}")
+            if "cosmos" not in open_breakers:
+                log_container_health_issue("circuit_breaker_open", json.dumps(breaker_states))
         
         # All checks passed
         consecutive_connection_errors = 0
@@ -393,39 +772,17 @@ def check_container_health():
 
 def replenish_assistant_pool():
     """
-    Check and replenish the assistant pool if needed
+    Check and replenish the assistant pool up to its current target size.
+    Assistants are provisioned in parallel without holding assistant_pool_lock.
     """
     with assistant_pool_lock:
         current_pool_size = len(assistant_pool)
-        assistants_to_add = max(0, ASSISTANT_POOL_SIZE - current_pool_size)
-        
-        if assistants_to_add > 0:
-            logger.info(f"Replenishing assistant pool, adding {assistants_to_add} assistants")
-            
-            added_count = 0
-            for i in range(assistants_to_add):
-                try:
-                    assistant = initialize_assistant(DATABASE_TYPE)
-                    assistant_id = assistant.assistant.assistant_id
-                    
-                    # Store in Cosmos DB for persistence
-                    store_pool_assistant(assistant_id)
-                    
-                    assistant_pool.append(assistant_id)
-                    assistant_assignments[assistant_id] = {
-                        "user_email": None,
-                        "thread_id": None,
-                        "last_used": None,
-                        "in_use": False
-                    }
-                    
-                    added_count += 1
-                    logger.info(f"Added new assistant to pool: {assistant_id}")
-                    
-                except Exception as e:
-                    logger.error(f"Failed to add assistant to pool: {str(e)}", exc_info=True)
-            
-            logger.info(f"Added {added_count}/{assistants_to_add} assistants to pool. New size: {current_pool_size + added_count}")
+        assistants_to_add = max(0, pool_target_size - current_pool_size)
+    
+    if assistants_to_add > 0:
+        logger.info(f"Replenishing assistant pool, adding {assistants_to_add} assistants")
+        added_count = provision_assistants(assistants_to_add)
+        logger.info(f"Added {added_count}/{assistants_to_add} assistants to pool. New size: {current_pool_size + added_count}")
 
 def restart_processing():
     """
@@ -567,19 +924,19 @@ def maybe_flush_conversation_batch(force=False):
                 except Exception as inner_e:
                     logger.error(f"Failed to store individual conversation: {str(inner_e)}")
 
-def get_conversation_context(user_email, request_type="nl2sql_chat"):
+def get_conversation_turns(user_email, request_type="nl2sql_chat"):
     """
-    Retrieve recent conversation history from Cosmos DB and format it
+    Retrieve recent conversation turns from Cosmos DB
     
     Args:
         user_email: The user's email to look up conversation history
         request_type: The type of request to filter by
         
     Returns:
-        str: A formatted history of previous conversations, or empty string if none
+        list: {"question", "answer"} dicts, oldest first, or an empty list if none
     """
     if not user_email:
-        return ""
+        return []
     
     cursor = None
     try:
@@ -595,51 +952,213 @@ def get_conversation_context(user_email, request_type="nl2sql_chat"):
         # Convert to list (this exhausts the cursor)
         recent_conversations = list(cursor)
         
-        # Process conversations to remove ObjectId and convert to dict
-        processed_conversations = []
-        for doc in recent_conversations:
-            doc_dict = dict(doc)
-            if "_id" in doc_dict:
-                doc_dict["_id"] = str(doc_dict["_id"])
-            processed_conversations.append(doc_dict)
-        
-        # If no history, return empty context
-        if not processed_conversations or len(processed_conversations) == 0:
-            return ""
-        
-        # Format conversations - show in reverse chronological order (oldest first)
-        # This makes the conversation flow naturally
-        convo_text = "Previous conversation:\n"
-        for convo in reversed(processed_conversations):
-            convo_text += f"User: {convo.get('question', '')}\n"
-            convo_text += f"Assistant: {convo.get('answer', '')}\n"
-        
-        return convo_text
+        # Show in reverse chronological order (oldest first) so the conversation flows naturally
+        return [
+            {"question": convo.get("question", ""), "answer": convo.get("answer", "")}
+            for convo in reversed(recent_conversations)
+        ]
             
     except Exception as e:
         logger.error(f"Error retrieving conversation history: {str(e)}", exc_info=True)
-        return ""  # Return empty context if retrieval fails
+        return []  # Return empty history if retrieval fails
     
     finally:
         # Ensure cursor is closed even if an exception occurs
         if cursor:
             cursor.close()
 
+def format_conversation_context(turns):
+    """
+    Format conversation turns as a text block to prepend to a question
+    
+    Returns:
+        str: A formatted history of previous conversations, or empty string if none
+    """
+    if not turns:
+        return ""
+    
+    convo_text = "Previous conversation:\n"
+    for convo in turns:
+        convo_text += f"User: {convo['question']}\n"
+        convo_text += f"Assistant: {convo['answer']}\n"
+    return convo_text
+
+def get_conversation_context(user_email, request_type="nl2sql_chat"):
+    """
+    Retrieve recent conversation history from Cosmos DB and format it
+    
+    Args:
+        user_email: The user's email to look up conversation history
+        request_type: The type of request to filter by
+        
+    Returns:
+        str: A formatted history of previous conversations, or empty string if none
+    """
+    return format_conversation_context(get_conversation_turns(user_email, request_type))
+
+def record_prompt_cache_usage(request_id, deployment, tokens):
+    """
+    Record prompt caching results of a request for the deployment that answered it
+    
+    Args:
+        request_id: The request the tokens belong to
+        deployment: The deployment the engine or assistant ran on (the "model" it returned)
+        tokens: The total_tokens dict returned by the engine
+    """
+    prompt_tokens = tokens.get("prompt_tokens", 0) or 0
+    cached_tokens = tokens.get("cached_tokens", 0) or 0
+    deployment = deployment or os.getenv("AZURE_OPENAI_API_DEPLOYMENT", "default")
+    with prompt_cache_stats_lock:
+        stats = prompt_cache_stats.setdefault(deployment, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        stats["requests"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+    
+    hit_ratio = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+    logger.info(f"Prompt cache for request_id={request_id}: {cached_tokens}/{prompt_tokens} tokens cached ({hit_ratio:.0%})")
+
+def get_prompt_cache_metrics():
+    """Get per-deployment prompt cache hit ratios"""
+    with prompt_cache_stats_lock:
+        return {
+            deployment: {
+                **stats,
+                "hit_ratio": round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0
+            }
+            for deployment, stats in prompt_cache_stats.items()
+        }
+
+def answer_with_chat_engine(request_id, question, history, user_email, request_type, report_name, start_time,
+                            model=None, allow_escalation=False, store=True):
+    """
+    Answer a question with the stateless chat completions engine (no assistant, thread or run)
+    
+    With allow_escalation the model may decline the question: the result then has
+    "escalated": True and nothing is stored. With store=False the caller stores the
+    conversation once it decided to keep the answer.
+    
+    Returns:
+        dict: The same result shape as process_question, plus "escalated"
+    """
+    try:
+        engine = initialize_chat_engine(DATABASE_TYPE, model=model, allow_escalation=allow_escalation)
+        # History goes in separate messages after the static prompt prefix
+        response_dict = engine.create_response(question=question, history=history)
+        record_prompt_cache_usage(request_id, response_dict.get("model"), response_dict.get("total_tokens", {}))
+        
+        tool_latencies = response_dict.get("tool_latencies", [])
+        if tool_latencies:
+            logger.info(f"Tool latencies for request_id={request_id}: {json.dumps(tool_latencies)}")
+        
+        if response_dict.get("escalated"):
+            logger.info(f"Chat completions engine escalated request_id={request_id}: {response_dict.get('escalation_reason')}")
+            return {
+                "status": "success",
+                "response": None,
+                "escalated": True
+            }
+        
+        answer = response_dict.get("answer", "No answer was generated")
+        
+        # Store in Cosmos DB
+        if store:
+            store_conversation(
+                request_id=request_id,
+                question=question,  # Store original question, not enhanced
+                answer=answer,
+                user_email=user_email,
+                report_name=report_name,
+                request_type=request_type
+            )
+        
+        total_duration = time.time() - start_time
+        logger.info(f"Completed processing question with chat completions engine in {total_duration:.2f}s")
+        
+        return {
+            "status": "success",
+            "response": answer,
+            "escalated": False
+        }
+    except Exception as e:
+        logger.error(f"Error calling chat completions engine: {str(e)}", exc_info=True)
+        return {
+            "status": "error",
+            "message": f"Error processing question: {str(e)}",
+            "retryable": isinstance(e, CircuitOpenError)
+        }
+
+# Fallback answers the instructions prescribe when the data doesn't answer the question;
+# they are not worth caching
+UNCACHEABLE_ANSWERS = ("I don't know", "Sorry, I can't access the data right now.")
+
+def answer_routed_question(request_id, route, question, history, user_email, request_type, report_name, start_time):
+    """
+    Answer a question classified as chit-chat or simple lookup on its cheap route
+    
+    Returns:
+        dict: The process_question result, or None if the question must be escalated to the full path
+    """
+    if route == ROUTE_CHIT_CHAT:
+        try:
+            router = initialize_question_router(DATABASE_TYPE, ROUTER_MODEL)
+            answer = router.answer_chit_chat(question, history)["answer"]
+        except Exception as e:
+            logger.warning(f"Chit-chat answer failed for request_id={request_id}, escalating: {str(e)}")
+            return None
+        
+        store_conversation(
+            request_id=request_id,
+            question=question,
+            answer=answer,
+            user_email=user_email,
+            report_name=report_name,
+            request_type=request_type
+        )
+        logger.info(f"Answered chit-chat with {ROUTER_MODEL} in {time.time() - start_time:.2f}s")
+        return {
+            "status": "success",
+            "response": answer
+        }
+    
+    if route == ROUTE_SIMPLE_LOOKUP:
+        result = answer_with_chat_engine(request_id, question, history, user_email, request_type, report_name,
+                                         start_time, model=SIMPLE_LOOKUP_MODEL, allow_escalation=True, store=False)
+        if result["status"] != "success" or result.get("escalated"):
+            logger.info(f"Simple lookup could not answer request_id={request_id}, escalating")
+            return None
+        # Only stored now that the answer is kept, so an escalated request stores one conversation
+        store_conversation(
+            request_id=request_id,
+            question=question,
+            answer=result["response"],
+            user_email=user_email,
+            report_name=report_name,
+            request_type=request_type
+        )
+        return result
+    
+    return None
 
-async def process_question(request_id, question, assistant_id=None, thread_id=None, user_email=None, request_type=None, report_name=None):
+async def process_question(request_id, question, assistant_id=None, thread_id=None, user_email=None, request_type=None, report_name=None, routing=None):
     """
     Process a user question using the NL2SQL assistant.
     Creates a new thread for each request, adding context from previous conversations if available.
+    
+    When question routing is enabled, the question is classified first and chit-chat and simple
+    lookups are answered on cheaper routes. The route taken is written to the routing dict if given.
     """
+    if routing is None:
+        routing = {}
+    routing.setdefault("route", ROUTE_ANALYTICAL)
+    routing.setdefault("escalated", False)
     start_time = time.time()
     
     try:
         logger.info(f"Processing question for request_id={request_id}, user_email={user_email}")
         
         # Get conversation context from Cosmos DB if user_email is provided
-        context = ""
-        if user_email:
-            context = get_conversation_context(user_email)
+        history = get_conversation_turns(user_email) if user_email else []
+        context = format_conversation_context(history)
         
         # Add context to question if available
         # print original question
@@ -650,6 +1169,23 @@ async def process_question(request_id, question, assistant_id=None, thread_id=No
 
         logger.info(f"Enhanced question: {enhanced_question}")
         
+        if QUESTION_ROUTING_ENABLED:
+            router = initialize_question_router(DATABASE_TYPE, ROUTER_MODEL)
+            route, classifier_ms, by_rules = router.classify(question, history)
+            routing["route"] = route
+            logger.info(f"Routed request_id={request_id} to {route} in {classifier_ms:.0f}ms"
+                        f"{' (rules)' if by_rules else ''}")
+            if route != ROUTE_ANALYTICAL:
+                result = answer_routed_question(request_id, route, question, history, user_email,
+                                                request_type, report_name, start_time)
+                if result is not None:
+                    return result
+                # Fall through to the full path and count the misroute
+                routing["escalated"] = True
+        
+        if not USE_ASSISTANT_POOL:
+            return answer_with_chat_engine(request_id, question, history, user_email,
+                                           request_type, report_name, start_time)
         
         # Get an available assistant from the pool
         assistant_id, _, _ = get_available_assistant(user_email)
@@ -661,14 +1197,8 @@ async def process_question(request_id, question, assistant_id=None, thread_id=No
         except openai.NotFoundError:
             logger.error(f"Assistant not found: {assistant_id}")
             
-            # Remove from pool and DB since it no longer exists
-            with assistant_pool_lock:
-                if assistant_id in assistant_pool:
-                    assistant_pool.remove(assistant_id)
-                    del assistant_assignments[assistant_id]
-            
-            # Remove from Cosmos DB
-            remove_pool_assistant(assistant_id)
+            # Remove from pool and Cosmos DB since it no longer exists
+            remove_assistants_from_pool([assistant_id])
             
             # Try to get a different assistant from the pool
             assistant_id, _, _ = get_available_assistant(user_email)
@@ -684,14 +1214,15 @@ async def process_question(request_id, question, assistant_id=None, thread_id=No
         
         # Process the question
         try:
-            # Use a timer to implement a timeout since we can't use asyncio.wait_for
+            # The deadline covers the whole request: no retry starts and no run keeps going past it
             start_processing_time = time.time()
-            timeout = 120  # 2 minute timeout
+            timeout = REQUEST_DEADLINE_SECONDS
             
             # Call create_response with the enhanced question
             response_dict = sql_assistant.assistant.create_response(
                 question=enhanced_question,
-                thread_id=thread_id
+                thread_id=thread_id,
+                deadline=start_time + REQUEST_DEADLINE_SECONDS
             )
             
             # Check if we timed out during processing
@@ -699,6 +1230,14 @@ async def process_question(request_id, question, assistant_id=None, thread_id=No
             if processing_duration > timeout:
                 logger.warning(f"Request processing took longer than timeout: {processing_duration}s > {timeout}s")
             
+            tool_latencies = response_dict.get("tool_latencies", [])
+            if tool_latencies:
+                logger.info(f"Tool latencies for request_id={request_id}: {json.dumps(tool_latencies)}")
+
+            # A successful run proves the assistant exists, so the hourly sweep can skip it
+            mark_assistant_verified(assistant_id)
+            record_prompt_cache_usage(request_id, response_dict.get("model"), response_dict.get("total_tokens", {}))
+            
             # Extract answer
             answer = response_dict.get("answer", "No answer was generated")
             
@@ -762,7 +1301,8 @@ async def process_question(request_id, question, assistant_id=None, thread_id=No
             
             return {
                 "status": "error",
-                "message": f"Error processing question: {str(e)}"
+                "message": f"Error processing question: {str(e)}",
+                "retryable": isinstance(e, CircuitOpenError)
             }
     
     except Exception as e:
@@ -776,9 +1316,70 @@ async def process_question(request_id, question, assistant_id=None, thread_id=No
         
         return {
             "status": "error",
-            "message": f"Error processing question: {str(e)}"
+            "message": f"Error processing question: {str(e)}",
+            "retryable": isinstance(e, CircuitOpenError)
         }
       
+def invalidate_datasource_caches(datasource=None, include_shared=True):
+    """
+    Drop this replica's cached query results and answers of a datasource (all of them without
+    one) and refresh its distinct values and value indexes
+    """
+    get_result_cache().invalidate(datasource)
+    get_distinct_value_store().request_refresh(datasource)
+    get_value_index().request_refresh(datasource)
+    answer_cache.invalidate(scope=None, datasource=datasource, include_shared=include_shared)
+
+def sync_cache_generations(force=False):
+    """
+    Invalidate the caches of datasources refreshed through another replica.
+    
+    datasource_refresh messages go to a single replica, which bumps the datasource's
+    generation in Cosmos DB; every replica compares the shared generations with the ones
+    its caches are up to date with at most every CACHE_GENERATION_CHECK_SECONDS.
+    """
+    global seen_cache_generations, cache_generations_checked_at
+    with cache_generations_lock:
+        if not force and time.time() - cache_generations_checked_at < CACHE_GENERATION_CHECK_SECONDS:
+            return
+        cache_generations_checked_at = time.time()
+        generations = get_cache_generations()
+        if generations is None:
+            return
+        if seen_cache_generations is None:
+            # Caches start empty, so they are up to date with the current generations
+            seen_cache_generations = generations
+            return
+        stale = [
+            datasource for datasource, generation in generations.items()
+            if generation > seen_cache_generations.get(datasource, 0)
+        ]
+        seen_cache_generations = generations
+    for datasource in stale:
+        logger.info(f"Datasource {datasource} was refreshed by another replica, invalidating its caches")
+        invalidate_datasource_caches(None if datasource == "*" else datasource, include_shared=False)
+
+def get_answer_cache_scope(body, request_type, report_name):
+    """
+    Get the scope the answers of a request are cached in, and the datasources an answer
+    may be computed from to be cached in it.
+    
+    The scope is the datasource the message names, the report it comes from, or else the
+    request type together with the datasources the schema catalog offers for it.
+    
+    Returns:
+        tuple: (scope, allowed datasources or None for any), or (None, None) when no scope
+        can be derived and the answer cache is skipped
+    """
+    if body.get("datasource"):
+        return body["datasource"], {body["datasource"]}
+    if report_name:
+        return report_name, None
+    datasources = sorted({table["datasource"] for table in get_schema_catalog().get_tables() if table.get("datasource")})
+    if not datasources:
+        return None, None
+    return f"{request_type}:{','.join(datasources)}", set(datasources)
+
 def process_message(message, action_queue):
     """
     Process a single message from the queue with improved thread safety
@@ -807,6 +1408,23 @@ def process_message(message, action_queue):
         request_type = body.get("request_type", "nl2sql_chat")
         report_name = body.get("report_name")
         
+        # Explicit invalidation of the answer cache, e.g. after a datasource was reloaded
+        if request_type == "answer_cache_invalidate":
+            answer_cache.invalidate(scope=body.get("scope"), datasource=body.get("datasource"))
+            return "complete"
+        
+        # The data of a datasource was refreshed: cached query results, answers, distinct
+        # values and value indexes are stale. Only this replica receives the message, so the
+        # shared generation tells the others
+        if request_type == "datasource_refresh":
+            datasource = body.get("datasource")
+            generation = bump_cache_generation(datasource)
+            with cache_generations_lock:
+                if generation is not None and seen_cache_generations is not None:
+                    seen_cache_generations[datasource or "*"] = generation
+            invalidate_datasource_caches(datasource)
+            return "complete"
+        
         if not request_id or not question:
             logger.error(f"Message missing required fields: {body.keys()}")
             return "complete"  # Skip invalid messages
@@ -837,16 +1455,74 @@ def process_message(message, action_queue):
         # Update the request status to processing
         update_request_status(request_id, "processing")
         
-        # Process the question
-        result = run_async_in_thread(process_question,
-            request_id=request_id,
-            question=question,
-            assistant_id=assistant_id,
-            thread_id=thread_id,
-            user_email=user_email,
-            request_type=request_type,
-            report_name=report_name
-        )
+        # Record every model call made while handling this request
+        usage_ledger = start_usage_ledger()
+        
+        # Pick up datasource refreshes handled by other replicas before using any cache
+        sync_cache_generations()
+        
+        # Answers are cached per datasource scope, never in one shared across datasources
+        cache_scope, cache_datasources = get_answer_cache_scope(body, request_type, report_name)
+        cached_answer, question_embedding = None, None
+        if ANSWER_CACHE_ENABLED and cache_scope is not None:
+            cached_answer, question_embedding = answer_cache.lookup(question, cache_scope)
+        
+        if cached_answer is not None:
+            # Keep the conversation history complete for follow-up questions
+            store_conversation(
+                request_id=request_id,
+                question=question,
+                answer=cached_answer,
+                user_email=user_email,
+                report_name=report_name,
+                request_type=request_type
+            )
+            result = {
+                "status": "success",
+                "response": cached_answer,
+                "cached": True
+            }
+        else:
+            # Process the question
+            routing = {}
+            question_start_time = time.time()
+            result = run_async_in_thread(process_question,
+                request_id=request_id,
+                question=question,
+                assistant_id=assistant_id,
+                thread_id=thread_id,
+                user_email=user_email,
+                request_type=request_type,
+                report_name=report_name,
+                routing=routing
+            )
+        
+        if cached_answer is None and QUESTION_ROUTING_ENABLED:
+            result.update(routing)
+            initialize_question_router(DATABASE_TYPE, ROUTER_MODEL).record_outcome(
+                routing["route"], (time.time() - question_start_time) * 1000, escalated=routing["escalated"]
+            )
+        
+        # Attach the usage totals to the request document and the per-user/datasource rollups
+        usage = usage_ledger.totals()
+        result["usage"] = usage
+        logger.info(f"Usage for request {request_id}: {usage['total_tokens']} tokens in {usage['calls']} model calls")
+        
+        # Only answers computed from the datasources of their scope are cached in it
+        if (ANSWER_CACHE_ENABLED and cache_scope is not None and cached_answer is None
+                and result.get("status") == "success"
+                and (result.get("response") or "").strip() not in UNCACHEABLE_ANSWERS
+                and usage["datasources"]
+                and (cache_datasources is None or set(usage["datasources"]) <= cache_datasources)):
+            answer_cache.store(question, cache_scope, result["response"],
+                               datasources=usage["datasources"], embedding=question_embedding)
+        record_usage_rollups(user_email, usage["datasources"], usage)
+        
+        # A dependency is down (circuit breaker open): put the message back for a later retry
+        if result.get("retryable"):
+            logger.warning(f"Request {request_id} failed on an unavailable dependency, returning it to the queue: {result.get('message')}")
+            update_request_status(request_id, "retrying", result)
+            return "abandon"
         
         # Update the status based on the result
         status = "completed" if result.get("status") == "success" else "error"
@@ -861,8 +1537,8 @@ def process_message(message, action_queue):
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}", exc_info=True)
         
-        # Update status if we have a request_id
-        if request_id:
+        # Update status if we have a request_id (not possible while the Cosmos DB breaker is open)
+        if request_id and not isinstance(e, CircuitOpenError):
             error_result = {
                 "status": "error",
                 "error": str(e),
@@ -927,6 +1603,9 @@ def cleanup_task():
             deleted_conversations = cleanup_old_conversations(30)
             logger.info(f"Cleaned up {deleted_conversations} old conversations")
             
+            if ANSWER_CACHE_SHARED:
+                cleanup_expired_cached_answers()
+            
             # Clean up old log files (keep for 15 days)
             from logging_utils import cleanup_old_logs
             deleted_logs = cleanup_old_logs(LOGS_DIR, max_days=15)
@@ -952,27 +1631,16 @@ def cleanup_task():
                     logger.info(f"Cleaned up {expired_count} expired threads from cache")
             
             # Ensure assistant pool is at full capacity
-            replenish_assistant_pool()
+            if USE_ASSISTANT_POOL:
+                replenish_assistant_pool()
             
-            # Verify each assistant in the pool still exists
-            with assistant_pool_lock:
-                for assistant_id in list(assistant_pool):
-                    try:
-                        # Try to retrieve the assistant to verify it exists
-                        client = AzureOpenAI(
-                            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-                            azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
-                        )
-                        client.beta.assistants.retrieve(assistant_id)
-                    except Exception as e:
-                        logger.warning(f"Assistant {assistant_id} no longer exists: {e}")
-                        # Remove from pool
-                        assistant_pool.remove(assistant_id)
-                        if assistant_id in assistant_assignments:
-                            del assistant_assignments[assistant_id]
-                        # Remove from Cosmos DB
-                        remove_pool_assistant(assistant_id)
+            # Verify pool assistants that weren't recently used successfully, without holding the pool lock
+            assistants_to_verify = get_assistants_to_verify() if USE_ASSISTANT_POOL else []
+            if assistants_to_verify:
+                _, invalid_assistants = verify_assistants(assistants_to_verify)
+                if invalid_assistants:
+                    remove_assistants_from_pool(invalid_assistants)
+                    logger.info(f"Removed {len(invalid_assistants)} missing assistants from pool")
             
         except Exception as e:
             logger.error(f"Error during cleanup task: {str(e)}", exc_info=True)
@@ -981,7 +1649,7 @@ def main():
     """
     Main function to process messages from the queue with enhanced health monitoring
     """
-    global last_cleanup_time, last_health_check, last_message_received, consecutive_connection_errors
+    global last_cleanup_time, last_health_check, last_message_received, consecutive_connection_errors, last_batch_size
     
     if not AZURE_SERVICE_BUS_CONNECTION_STRING:
         logger.error("Azure Service Bus connection string is not set!")
@@ -994,11 +1662,22 @@ def main():
     
     logger.info(f"Starting message processing with {MAX_WORKERS} workers")
     
-    # Initialize the assistant pool
-    pool_initialized = initialize_assistant_pool()
-    if not pool_initialized:
-        logger.error("Failed to initialize assistant pool, exiting")
-        return
+    if USE_ASSISTANT_POOL:
+        # Initialize the assistant pool
+        pool_initialized = initialize_assistant_pool()
+        if not pool_initialized:
+            logger.error("Failed to initialize assistant pool, exiting")
+            return
+        
+        # Start the pool autoscaler in the background
+        autoscaler_thread = threading.Thread(target=pool_autoscaler_loop, name="pool-autoscaler", daemon=True)
+        autoscaler_thread.start()
+    else:
+        logger.info(f"Using the {ASSISTANT_ENGINE} engine, no assistant pool needed")
+    
+    # Distinct values and value indexes of the Fabric views are built in the background
+    if DATABASE_TYPE == "fabric":
+        start_value_stores()
     
     # Initialize time tracking variables
     last_cleanup_time = time.time()
@@ -1009,7 +1688,7 @@ def main():
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         try:
             # Log startup event to Cosmos DB
-            log_container_health_issue("container_startup", f"Container started with {MAX_WORKERS} workers, {len(assistant_pool)}/{ASSISTANT_POOL_SIZE} assistants in pool")
+            log_container_health_issue("container_startup", f"Container started with {MAX_WORKERS} workers, {len(assistant_pool)}/{pool_target_size} assistants in pool")
             
             # Perform initial health check
             if not check_container_health():
@@ -1029,6 +1708,9 @@ def main():
                 # Run cleanup task
                 cleanup_task()
                 
+                # Pick up datasource refreshes handled by other replicas while idle
+                sync_cache_generations()
+                
                 # Perform periodic health check
                 if current_time - last_health_check > HEALTH_CHECK_INTERVAL:
                     health_check_result = check_container_health()
@@ -1047,6 +1729,15 @@ def main():
                 # Monitor thread health
                 monitor_thread_health(executor)
                 
+                # Don't receive messages that would fail fast while a dependency's breaker is open
+                circuit_wait = get_circuit_wait_time()
+                if circuit_wait > 0:
+                    logger.warning(f"Circuit breaker open, pausing message processing for {circuit_wait:.0f}s")
+                    time.sleep(min(circuit_wait, 5))
+                    # Not receiving is deliberate while paused, so it must not trigger the no-message restart
+                    last_message_received = time.time()
+                    continue
+                
                 try:
                     # Use context manager for proper connection handling
                     servicebus_client = ServiceBusClient.from_connection_string(
@@ -1065,6 +1756,8 @@ def main():
                                 max_wait_time=MAX_WAIT_TIME
                             )
                             
+                            last_batch_size = len(messages)
+                            
                             if messages:
                                 # Reset connection error counter on successful message receipt
                                 consecutive_connection_errors = 0
@@ -1111,8 +1804,8 @@ def main():
                         uptime = current_time - start_time
                         
                         # Count active assistants
-                        with assistant_pool_lock:
-                            active_assistants = sum(1 for a in assistant_assignments.values() if a["in_use"])
+                        pool_metrics = get_pool_metrics()
+                        active_assistants = pool_metrics["in_use"]
                         
                         # Count active threads
                         with thread_cache_lock:
@@ -1122,8 +1815,9 @@ def main():
                             f"Processor metrics - Uptime: {uptime/3600:.2f}h, "
                             f"Messages: {message_count}, Errors: {error_count}, "
                             f"Active requests: {len(active_requests)}, "
-                            f"Pool: {len(assistant_pool)}/{ASSISTANT_POOL_SIZE}, "
+                            f"Pool: {pool_metrics['pool_size']}/{pool_metrics['pool_target']}, "
                             f"Active assistants: {active_assistants}, "
+                            f"Pool utilisation: {pool_metrics['utilization']:.0%}, "
                             f"Active threads: {active_threads}"
                         )
                         
@@ -1133,11 +1827,26 @@ def main():
                             "messages_processed": message_count,
                             "errors": error_count,
                             "active_requests": len(active_requests),
-                            "assistant_pool_size": len(assistant_pool),
-                            "assistant_pool_capacity": ASSISTANT_POOL_SIZE,
+                            "assistant_pool_size": pool_metrics["pool_size"],
+                            "assistant_pool_capacity": pool_metrics["pool_target"],
+                            "assistant_pool_utilization": pool_metrics["utilization"],
                             "active_assistants": active_assistants,
                             "active_threads": active_threads,
-                            "connection_errors": consecutive_connection_errors
+                            "connection_errors": consecutive_connection_errors,
+                            "tools": get_tool_registry(DATABASE_TYPE).get_stats(),
+                            "prompt_cache": get_prompt_cache_metrics(),
+                            "routing": initialize_question_router(DATABASE_TYPE, ROUTER_MODEL).get_stats()
+                            if QUESTION_ROUTING_ENABLED else None,
+                            "answer_cache": answer_cache.get_stats() if ANSWER_CACHE_ENABLED else None,
+                            "rate_limits": get_rate_limiter_stats(),
+                            "openai_backends": get_load_balancer().get_stats(),
+                            "circuit_breakers": get_circuit_breaker_states(),
+                            "sql_verification_cache": get_verification_cache().get_stats(),
+                            "db_connection_pools": get_connection_pool_stats(),
+                            "aad_tokens": get_token_provider_stats(),
+                            "query_result_cache": get_result_cache().get_stats(),
+                            "distinct_values": get_distinct_value_store().get_stats(),
+                            "value_index": get_value_index().get_stats()
                         }))
                         
                         # Reset counters but keep start_time for uptime calculation
@@ -2,12 +2,205 @@ from openai import AzureOpenAI
 import openai
 from openai.types.beta import Thread
 from openai.types.beta.threads import Run, Message
-from .function import Function, FunctionCall
+from .function import Function
+from .tool_registry import ToolRegistry, ToolArgumentError
 from openai.types.beta.threads.run_create_params import TruncationStrategy
+from .usage import record_usage, note_datasource
+from .rate_limiter import get_rate_limiter, estimate_tokens
+from .load_balancer import prefer_endpoint, reset_preferred_endpoint, is_openai_failure, get_load_balancer
+from .circuit_breaker import get_circuit_breaker
+from .retry_policy import (
+    RetryPolicy,
+    DeadlineExceededError,
+    classify_api_error,
+    classify_run_error,
+    RETRYABLE_RUN_ERROR_CODES,
+)
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
+import contextvars
 import json
+import os
+import threading
 import time
 
 
+# Tool calls requested in a single run step are executed concurrently on a shared,
+# bounded executor. Per-tool limits protect downstream systems (e.g. Fabric) from
+# being hit by too many calls of the same tool at once.
+TOOL_EXECUTOR_MAX_WORKERS = int(os.getenv("TOOL_EXECUTOR_MAX_WORKERS", "8"))
+DEFAULT_TOOL_CONCURRENCY = int(os.getenv("DEFAULT_TOOL_CONCURRENCY", "4"))
+
+
+def parse_concurrency_limits(value: str) -> dict:
+    """Parse the JSON tool name -> limit mapping, ignoring it (with an error) if malformed"""
+    try:
+        limits = json.loads(value or "{}")
+        if not isinstance(limits, dict):
+            raise ValueError("expected a JSON object")
+        return {str(name): int(limit) for name, limit in limits.items()}
+    except (TypeError, ValueError) as e:
+        print(f"Ignoring invalid TOOL_CONCURRENCY_LIMITS {value!r}: {e}")
+        return {}
+
+
+# JSON mapping of tool name -> max concurrent calls, e.g. '{"run_sql_query": 2}'
+TOOL_CONCURRENCY_LIMITS = parse_concurrency_limits(os.getenv("TOOL_CONCURRENCY_LIMITS"))
+
+# Sampling temperature of the assistants created by this module
+ASSISTANT_TEMPERATURE = 0.01
+# Tokens a run is assumed to use on top of its instructions and question (tool specs,
+# history, tool outputs, answer) until its actual usage is known
+RUN_TOKEN_ESTIMATE = int(os.getenv("RUN_TOKEN_ESTIMATE", "4000"))
+
+_tool_executor = ThreadPoolExecutor(
+    max_workers=TOOL_EXECUTOR_MAX_WORKERS, thread_name_prefix="tool-call"
+)
+_tool_semaphores = {}
+_tool_semaphores_lock = threading.Lock()
+
+# Files generated by the code interpreter are saved here in the background; answers
+# reference the saved path instead of waiting for the download
+GENERATED_FILES_DIR = os.getenv("GENERATED_FILES_DIR", "generated_files")
+FILE_DOWNLOAD_MAX_WORKERS = int(os.getenv("FILE_DOWNLOAD_MAX_WORKERS", "2"))
+
+_file_lookup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="file-lookup")
+_file_download_executor = ThreadPoolExecutor(
+    max_workers=FILE_DOWNLOAD_MAX_WORKERS, thread_name_prefix="file-download"
+)
+# File metadata never changes, so file_id -> FileObject is cached for the process lifetime
+_file_metadata_cache = LRUCache(maxsize=1024)
+_file_metadata_lock = threading.Lock()
+
+
+def get_tool_semaphore(function_name: str) -> threading.BoundedSemaphore:
+    """Get (or lazily create) the semaphore limiting concurrent calls of a tool"""
+    with _tool_semaphores_lock:
+        if function_name not in _tool_semaphores:
+            limit = int(TOOL_CONCURRENCY_LIMITS.get(function_name, DEFAULT_TOOL_CONCURRENCY))
+            _tool_semaphores[function_name] = threading.BoundedSemaphore(max(1, limit))
+        return _tool_semaphores[function_name]
+
+
+def run_tool_call(registry: ToolRegistry, function_name: str, arguments: dict, semaphore: threading.BoundedSemaphore):
+    """Run a single tool call, releasing the per-tool slot the caller acquired for it.
+
+    Returns a tuple of (response, latency_ms).
+    """
+    try:
+        note_datasource(arguments.get("datasource"))
+        return registry.invoke(function_name, arguments)
+    finally:
+        semaphore.release()
+
+
+def submit_tool_call(registry: ToolRegistry, function_name: str, arguments: dict, semaphore: threading.BoundedSemaphore):
+    try:
+        # Run in a copy of the caller's context so tools see the request's usage ledger
+        return _tool_executor.submit(
+            contextvars.copy_context().run, run_tool_call, registry, function_name, arguments, semaphore
+        )
+    except Exception:
+        semaphore.release()
+        raise
+
+
+def execute_tool_calls(registry: ToolRegistry, tool_calls: list, verbose: bool = False):
+    """
+    Execute the tool calls requested in one model step concurrently.
+
+    Works with both Assistants run tool calls and chat completion tool calls, which
+    share the same shape (id, function.name, function.arguments).
+
+    Returns:
+        tuple: (tool_outputs, arguments) with outputs in the order the model requested them
+    """
+    # Submit every tool call of this step first, then collect the results in
+    # the order the model requested them
+    pending = []
+    waiting = []
+    for tool in tool_calls:
+        function_name = tool.function.name
+        call_id = tool.id
+        if function_name not in registry:
+            pending.append((call_id, function_name, {}, None, f"Function {function_name} not found"))
+            continue
+        try:
+            function_arguments = registry.parse_arguments(function_name, tool.function.arguments)
+        except ToolArgumentError as e:
+            registry.record(function_name, 0.0, error=True)
+            pending.append((call_id, function_name, {}, None, str(e)))
+            continue
+        if verbose:
+            print(
+                f"\n{function_name} function has called by assistant with the following arguments: {function_arguments}"
+            )
+        pending.append([call_id, function_name, function_arguments, None, None])
+        semaphore = get_tool_semaphore(function_name)
+        # The slot is taken before submitting, so calls waiting on a saturated tool hold no
+        # executor thread and can't starve calls of other tools
+        if semaphore.acquire(blocking=False):
+            pending[-1][3] = submit_tool_call(registry, function_name, function_arguments, semaphore)
+        else:
+            waiting.append(pending[-1])
+    for call in waiting:
+        semaphore = get_tool_semaphore(call[1])
+        semaphore.acquire()
+        call[3] = submit_tool_call(registry, call[1], call[2], semaphore)
+
+    tool_outputs = []
+    arguments = []
+    for call_id, function_name, function_arguments, future, error in pending:
+        if future is None:
+            if verbose:
+                print(f"Function {function_name} could not be called: {error}")
+            tool_outputs.append(
+                {
+                    "tool_call_id": call_id,
+                    "output": error,
+                }
+            )
+            continue
+
+        response, latency_ms = future.result()
+        if verbose:
+            print(f"Function {function_name} responded in {latency_ms:.0f}ms: {response}")
+        tool_outputs.append(
+            {
+                "tool_call_id": call_id,
+                "output": response,
+            }
+        )
+        arguments.append(
+            {
+                "tool_call_name": function_name,
+                "arguments": function_arguments,
+                "latency_ms": round(latency_ms, 1),
+            }
+        )
+    return tool_outputs, arguments
+
+
+def get_cached_tokens(usage) -> int:
+    """Get the number of prompt tokens served from the provider's prompt cache"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", 0) or 0) if details else 0
+
+
+def extract_query(arguments: list[dict]) -> str:
+    """Extract the last SQL query from the arguments"""
+    queries = []
+    for argument in arguments:
+        if argument["tool_call_name"] == "run_sql_query":
+            queries.append(f"{argument['arguments']['query']}")
+        else:
+            queries.append(argument["tool_call_name"])
+    if not queries:
+        return ""
+    else:
+        return queries[-1]
+
+
 class AIAssistant:
     def __init__(
         self,
@@ -21,11 +214,14 @@ class AIAssistant:
         functions: list[Function] = None,
         auto_delete: bool = True,
         assistant_id: str = None,  # Added parameter to support loading existing assistant
+        registry: ToolRegistry = None,
     ):
         self.client = client
         self.verbose = verbose
         self.threads = []
-        self.functions = functions or []
+        # A registry shared across runs can be passed in; otherwise build one
+        self.registry = registry or ToolRegistry(functions or [])
+        self.functions = self.registry.functions
         self.name = name
         self.description = description
         self.instructions = instructions
@@ -54,7 +250,7 @@ class AIAssistant:
                     model=self.model,
                     tools=self.tools,
                     tool_resources={"code_interpreter": {"file_ids": []}},
-                    temperature=0.01
+                    temperature=ASSISTANT_TEMPERATURE
                 )
                 # Store the newly created assistant ID
                 self.assistant_id = self.assistant.id
@@ -76,62 +272,51 @@ class AIAssistant:
         return function_names
 
     def create_tool_outputs(self, run: Run, functions: list[Function] = None) -> list[dict]:
-        # Use provided functions or fall back to instance functions
-        functions_to_use = functions or self.functions
-        
-        tool_outputs = []
-        arguments = []
-        for tool in run.required_action.submit_tool_outputs.tool_calls:
-            tool_found = False
-            function_name = tool.function.name
-            if tool.function.arguments:
-                function_arguments = json.loads(tool.function.arguments)
-            else:
-                function_arguments = {}
-            call_id = tool.id
-            function_call = FunctionCall(
-                call_id=call_id, name=function_name, arguments=function_arguments
-            )
-            for function in functions_to_use:
-                if function.name == function_name:
-                    tool_found = True
-                    if self.verbose:
-                        print(
-                            f"\n{function_name} function has called by assistant with the following arguments: {function_arguments}"
-                        )
-                    response = function.run_catch_exceptions(
-                        function_call=function_call
-                    )
-                    if self.verbose:
-                        print(f"Function {function_name} responded: {response}")
-                    tool_outputs.append(
-                        {
-                            "tool_call_id": call_id,
-                            "output": response,
-                        }
-                    )
-                    arguments.append(
-                        {
-                            "tool_call_name": function_name,
-                            "arguments": function_arguments,
-                        }
-                    )
+        # Use provided functions or fall back to the instance registry
+        registry = ToolRegistry(functions) if functions else self.registry
+        return execute_tool_calls(
+            registry,
+            run.required_action.submit_tool_outputs.tool_calls,
+            verbose=self.verbose,
+        )
 
-            if not tool_found:
-                if self.verbose:
-                    print(f"Function {function_name} called by assistant not found")
-                tool_outputs.append(
-                    {
-                        "tool_call_id": call_id,
-                        "output": f"Function {function_name} not found",
-                    }
-                )
-        return tool_outputs, arguments
+    def get_file_path(self, filename: str, file_id: str) -> str:
+        """Get where a generated file is (or will be) saved in GENERATED_FILES_DIR"""
+        return os.path.join(GENERATED_FILES_DIR, f"{file_id}_{filename.split('/')[-1]}")
 
-    def create_file(self, filename: str, file_id: str):
-        content = self.client.files.retrieve_content(file_id)
-        with open(filename.split("/")[-1], "w") as file:
-            file.write(content)
+    def create_file(self, filename: str, file_id: str) -> str:
+        """Stream a generated file to GENERATED_FILES_DIR and return its path"""
+        path = self.get_file_path(filename, file_id)
+        os.makedirs(GENERATED_FILES_DIR, exist_ok=True)
+        # Write to a temporary name so a half-written file is never served
+        with self.client.files.with_streaming_response.content(file_id) as response:
+            with open(path + ".part", "wb") as file:
+                for chunk in response.iter_bytes():
+                    file.write(chunk)
+        os.replace(path + ".part", path)
+        return path
+
+    def create_file_in_background(self, filename: str, file_id: str) -> str:
+        """Start saving a generated file without blocking and return the path it will have"""
+        def download():
+            try:
+                self.create_file(filename=filename, file_id=file_id)
+            except Exception as e:
+                print(f"Error saving generated file {file_id}: {e}")
+
+        _file_download_executor.submit(download)
+        return self.get_file_path(filename, file_id)
+
+    def retrieve_file(self, file_id: str):
+        """Get the metadata of a file, from the cache when possible"""
+        with _file_metadata_lock:
+            cached_file = _file_metadata_cache.get(file_id)
+        if cached_file is not None:
+            return cached_file
+        cached_file = self.client.files.retrieve(file_id)
+        with _file_metadata_lock:
+            _file_metadata_cache[file_id] = cached_file
+        return cached_file
 
     def format_message(self, message: Message) -> str:
         if getattr(message.content[0], "text", None) is not None:
@@ -139,20 +324,29 @@ class AIAssistant:
         else:
             message_content = message.content[0]
         annotations = message_content.annotations
+
+        # Resolve the metadata of every cited file concurrently
+        file_ids = {
+            (getattr(annotation, "file_citation", None) or getattr(annotation, "file_path", None)).file_id
+            for annotation in annotations
+            if getattr(annotation, "file_citation", None) or getattr(annotation, "file_path", None)
+        }
+        files = dict(zip(file_ids, _file_lookup_executor.map(self.retrieve_file, file_ids)))
+
         citations = []
         for index, annotation in enumerate(annotations):
             message_content.value = message_content.value.replace(
                 annotation.text, f" [{index}]"
             )
             if file_citation := getattr(annotation, "file_citation", None):
-                cited_file = self.client.files.retrieve(file_citation.file_id)
+                cited_file = files[file_citation.file_id]
                 citations.append(
                     f"[{index}] {file_citation.quote} from {cited_file.filename}"
                 )
             elif file_path := getattr(annotation, "file_path", None):
-                cited_file = self.client.files.retrieve(file_path.file_id)
-                citations.append(f"[{index}] file: {cited_file.filename} is downloaded")
-                self.create_file(filename=cited_file.filename, file_id=cited_file.id)
+                cited_file = files[file_path.file_id]
+                path = self.create_file_in_background(filename=cited_file.filename, file_id=cited_file.id)
+                citations.append(f"[{index}] file: {cited_file.filename} is saved to {path}")
 
         message_content.value += "\n" + "\n".join(citations)
         return message_content.value
@@ -160,31 +354,25 @@ class AIAssistant:
     def extract_run_message(
         self, run: Run, thread_id: str, output_role: bool = True
     ) -> str:
+        # Only the newest message of the run is needed: constant cost whatever the thread length
         messages = self.client.beta.threads.messages.list(
             thread_id=thread_id,
+            run_id=run.id,
+            order="desc",
+            limit=1,
         ).data
-        for message in messages:
-            if message.run_id == run.id:
-                return (
-                    #f"{message.role}: " + self.format_message(message=message)
-                    self.format_message(message=message)
-                    if output_role
-                    else self.format_message(message=message)
-                )
-        return "No message found"
+        if not messages:
+            return "No message found"
+        return (
+            #f"{messages[0].role}: " + self.format_message(message=messages[0])
+            self.format_message(message=messages[0])
+            if output_role
+            else self.format_message(message=messages[0])
+        )
 
     def extract_query(self, arguments: list[dict]) -> str:
         """Extract the last SQL query from the arguments"""
-        queries = []
-        for argument in arguments:
-            if argument["tool_call_name"] == "run_sql_query":
-                queries.append(f"{argument['arguments']['query']}")
-            else:
-                queries.append(argument["tool_call_name"])
-        if not queries:
-            return ""
-        else:
-            return queries[-1]
+        return extract_query(arguments)
 
     def create_response(
         self,
@@ -192,8 +380,39 @@ class AIAssistant:
         thread_id: str = None,
         run_instructions: str = None,
         max_retries: int = 5,
-        retry_delay: int = 20,
+        retry_delay: float = 2.0,
+        deadline: float = None,
     ) -> dict:
+        """
+        Answer a question with a run on the thread, retrying failed runs.
+
+        Failures are retried according to their cause (see RetryPolicy): rate
+        limits wait as long as the server asks, transient errors back off with
+        jitter and permanent errors fail at once. deadline is a time.time() value
+        after which no new attempt is made and a running run is cancelled.
+
+        Model calls made by the tools during the run prefer the endpoint the
+        assistant lives on.
+        """
+        token = prefer_endpoint(self.client.base_url)
+        try:
+            return self._create_response(
+                question, thread_id, run_instructions, max_retries, retry_delay, deadline
+            )
+        finally:
+            reset_preferred_endpoint(token)
+
+    def _create_response(
+        self,
+        question: str,
+        thread_id: str,
+        run_instructions: str,
+        max_retries: int,
+        retry_delay: float,
+        deadline: float,
+    ) -> dict:
+        policy = RetryPolicy(max_attempts=max_retries, base_delay=retry_delay, deadline=deadline)
+        breaker = get_circuit_breaker("openai")
 
         if thread_id is None:
             thread = self.create_thread()
@@ -203,21 +422,46 @@ class AIAssistant:
             thread_id=thread_id, role="user", content=question
         )
 
-        retries = 0
-
-        while retries < max_retries:
-            run = self.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id,  # Use assistant_id here
-                instructions=run_instructions,
-                truncation_strategy=TruncationStrategy(
-                    type="last_messages", 
-                    last_messages=3,
-                ),
-            )
+        attempt = 0
+        model = self.model or self.assistant.model
+        # Same bucket as the balanced calls to this deployment on the assistant's endpoint
+        limiter_key = get_load_balancer().get_limiter_key(model, self.client.base_url)
+        estimated_tokens = estimate_tokens(
+            self.instructions, run_instructions, question, completion_tokens=RUN_TOKEN_ESTIMATE
+        )
+
+        while True:
+            attempt += 1
+            # Wait for the deployment's RPM/TPM quota; corrected with run.usage when the run ends
+            reservation = get_rate_limiter(limiter_key).acquire(estimated_tokens)
+            try:
+                # Fails fast with CircuitOpenError while Azure OpenAI is known to be down
+                with breaker.guard(is_openai_failure):
+                    run = self.client.beta.threads.runs.create(
+                        thread_id=thread_id,
+                        assistant_id=self.assistant_id,  # Use assistant_id here
+                        instructions=run_instructions,
+                        truncation_strategy=TruncationStrategy(
+                            type="last_messages", 
+                            last_messages=3,
+                        ),
+                    )
+            except openai.OpenAIError as e:
+                reservation.settle(total_tokens=0)
+                code, retryable, retry_after = classify_api_error(e)
+                policy.wait_before_retry(attempt, code, retryable, retry_after)
+                continue
             arguments = []
+            tool_latencies = []
 
-            while run.status not in ["completed", "failed"]:
+            while run.status not in ["completed", "failed", "cancelled", "incomplete"]:
+                if policy.remaining() <= 0:
+                    reservation.settle(run.usage)
+                    try:
+                        self.client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+                    except openai.OpenAIError:
+                        pass
+                    raise DeadlineExceededError(f"Run {run.id} did not finish before the request deadline")
                 run = self.client.beta.threads.runs.retrieve(
                     thread_id=thread_id, run_id=run.id
                 )
@@ -226,8 +470,13 @@ class AIAssistant:
                         f"Run expired when calling {self.get_required_functions_names(run=run)}"
                     )
                 if run.status == "requires_action":
-                    tool_outputs, arguments = self.create_tool_outputs(
-                        run=run, functions=self.functions
+                    tool_outputs, arguments = self.create_tool_outputs(run=run)
+                    tool_latencies.extend(
+                        {
+                            "tool_call_name": argument["tool_call_name"],
+                            "latency_ms": argument["latency_ms"],
+                        }
+                        for argument in arguments
                     )
                     run = self.client.beta.threads.runs.submit_tool_outputs(
                         thread_id=thread_id,
@@ -236,25 +485,29 @@ class AIAssistant:
                     )
                 time.sleep(0.5)
 
-            if run.status == "failed":
-                retries += 1
-                print(
-                    f"Run failed. Retrying in {retry_delay} seconds... (Attempt {retries}/{max_retries})"
-                )
-                time.sleep(retry_delay)
+            # Every run counts, including failed ones that are retried
+            record_usage("assistant_run", model, run.usage)
+            reservation.settle(run.usage)
+
+            if run.status != "completed":
+                code, retryable, retry_after = classify_run_error(run)
+                if code in RETRYABLE_RUN_ERROR_CODES:
+                    breaker.record_failure()
+                policy.wait_before_retry(attempt, code if run.status == "failed" else run.status,
+                                         retryable, retry_after)
             else:
                 tokens = {
                     "prompt_tokens": run.usage.prompt_tokens,
                     "completion_tokens": run.usage.completion_tokens,
+                    "cached_tokens": get_cached_tokens(run.usage),
                 }
                 return {
                     "answer": self.extract_run_message(run=run, thread_id=thread_id),
                     "context": self.extract_query(arguments),
                     "total_tokens": tokens,
+                    "tool_latencies": tool_latencies,
+                    "model": model,
                 }
-        
-        # If we've exhausted all retries
-        raise Exception(f"Failed to get a response after {max_retries} attempts")
 
     def create_response_sync(
         self,
@@ -0,0 +1,201 @@
+from .assistant import ASSISTANT_TEMPERATURE, execute_tool_calls, extract_query, get_cached_tokens
+from .tool_registry import ToolRegistry
+from .usage import record_usage
+from .rate_limiter import estimate_tokens
+from .load_balancer import OpenAILoadBalancer, get_load_balancer
+import json
+
+
+# Appended to the instructions: this engine has no code interpreter tool
+NO_CODE_INTERPRETER_NOTE = (
+    "\n\nNote: the Python environment (code interpreter) is not available. "
+    "Perform calculations with SQL aggregations instead."
+)
+
+# Offered on cheap routes so the model can hand a question it can't answer to the full path
+ESCALATE_TOOL_NAME = "escalate_question"
+ESCALATE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": ESCALATE_TOOL_NAME,
+        "description": "Hand the question over to a more capable assistant. Call it instead of answering "
+                       "when the question can't be answered with a simple lookup or the data doesn't answer it.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "reason": {
+                    "type": "string",
+                    "description": "Why the question can't be answered here",
+                },
+            },
+            "required": ["reason"],
+        },
+    },
+}
+ESCALATION_NOTE = (
+    "\n\nIf you can't answer the question with a simple lookup, or would answer \"I don't know\" "
+    f"or that you can't access the data, call {ESCALATE_TOOL_NAME} instead of answering."
+)
+
+
+class ChatCompletionsEngine:
+    """
+    Stateless alternative to AIAssistant that runs the same tools through a local
+    tool-calling loop on chat completions.
+
+    There is no assistant, thread, run polling or message listing: one request is a
+    handful of chat completion calls. create_response returns the same
+    {"answer", "context", "total_tokens"} contract as AIAssistant.create_response.
+
+    With allow_escalation, the model is also offered an escalate_question tool;
+    calling it ends the request with "escalated": True and no answer.
+
+    Messages are laid out so the static part of the prompt (instructions, optional
+    schema catalog, tool specs) is a byte-identical prefix across requests, which
+    lets Azure OpenAI prompt caching reuse it. Everything that varies (run
+    instructions, conversation history, the question, tool outputs) comes after it.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        instructions: str,
+        registry: ToolRegistry,
+        verbose: bool = False,
+        max_tool_rounds: int = 10,
+        temperature: float = ASSISTANT_TEMPERATURE,
+        static_context: str = None,
+        balancer: OpenAILoadBalancer = None,
+        allow_escalation: bool = False,
+    ):
+        # Calls are spread across the configured Azure OpenAI backends
+        self.balancer = balancer or get_load_balancer()
+        self.model = model
+        self.instructions = instructions + NO_CODE_INTERPRETER_NOTE
+        # Static reference material (e.g. the schema catalog) is part of the cached prefix
+        if static_context:
+            self.instructions += "\n\n" + static_context
+        self.allow_escalation = allow_escalation
+        if allow_escalation:
+            self.instructions += ESCALATION_NOTE
+        self.registry = registry
+        self.tools = registry.tools + [ESCALATE_TOOL] if allow_escalation else registry.tools
+        self.verbose = verbose
+        self.max_tool_rounds = max_tool_rounds
+        self.temperature = temperature
+
+    def create_response(
+        self,
+        question: str,
+        thread_id: str = None,
+        run_instructions: str = None,
+        history: list[dict] = None,
+    ) -> dict:
+        """
+        Answer a question, calling tools until the model returns a final message.
+
+        history is a list of previous {"question", "answer"} turns, oldest first. They are
+        sent as separate messages after the static prefix instead of being pasted into
+        the question. thread_id is accepted for interface compatibility with AIAssistant
+        and ignored.
+        """
+        messages = [{"role": "system", "content": self.instructions}]
+        if run_instructions:
+            messages.append({"role": "system", "content": run_instructions})
+        for turn in history or []:
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["answer"]})
+        messages.append({"role": "user", "content": question})
+
+        tokens = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        arguments = []
+        tool_latencies = []
+
+        for _ in range(self.max_tool_rounds + 1):
+            completion = self.balancer.call(
+                self.model,
+                lambda client, deployment: client.chat.completions.create(
+                    model=deployment,
+                    messages=messages,
+                    tools=self.tools,
+                    temperature=self.temperature,
+                ),
+                estimated_tokens=estimate_tokens(messages, self.tools, completion_tokens=500),
+            )
+            record_usage("chat_completion", self.model, completion.usage)
+            if completion.usage:
+                tokens["prompt_tokens"] += completion.usage.prompt_tokens
+                tokens["completion_tokens"] += completion.usage.completion_tokens
+                tokens["cached_tokens"] += get_cached_tokens(completion.usage)
+
+            message = completion.choices[0].message
+            if not message.tool_calls:
+                return {
+                    "answer": message.content or "No message found",
+                    "context": extract_query(arguments),
+                    "total_tokens": tokens,
+                    "tool_latencies": tool_latencies,
+                    "model": self.model,
+                    "escalated": False,
+                }
+
+            escalation = next(
+                (tool_call for tool_call in message.tool_calls if tool_call.function.name == ESCALATE_TOOL_NAME),
+                None,
+            )
+            if escalation is not None and self.allow_escalation:
+                try:
+                    reason = json.loads(escalation.function.arguments or "{}").get("reason")
+                except json.JSONDecodeError:
+                    reason = None
+                return {
+                    "answer": None,
+                    "context": extract_query(arguments),
+                    "total_tokens": tokens,
+                    "tool_latencies": tool_latencies,
+                    "model": self.model,
+                    "escalated": True,
+                    "escalation_reason": reason,
+                }
+
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": message.content,
+                    "tool_calls": [
+                        {
+                            "id": tool_call.id,
+                            "type": "function",
+                            "function": {
+                                "name": tool_call.function.name,
+                                "arguments": tool_call.function.arguments,
+                            },
+                        }
+                        for tool_call in message.tool_calls
+                    ],
+                }
+            )
+            tool_outputs, step_arguments = execute_tool_calls(
+                self.registry, message.tool_calls, verbose=self.verbose
+            )
+            for output in tool_outputs:
+                content = output["output"]
+                messages.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": output["tool_call_id"],
+                        "content": content if isinstance(content, str) else json.dumps(content, default=str),
+                    }
+                )
+            arguments.extend(step_arguments)
+            tool_latencies.extend(
+                {
+                    "tool_call_name": argument["tool_call_name"],
+                    "latency_ms": argument["latency_ms"],
+                }
+                for argument in step_arguments
+            )
+
+        raise Exception(
+            f"No final answer after {self.max_tool_rounds} rounds of tool calls"
+        )
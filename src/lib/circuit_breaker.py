@@ -0,0 +1,151 @@
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+
+# Consecutive failures that open a breaker, and how long it stays open before a trial call
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "30"))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open. Always retryable."""
+
+    retryable = True
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit breaker for {name} is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker around one downstream dependency.
+
+    Closed: calls go through; failure_threshold consecutive failures open it.
+    Open: calls fail fast with CircuitOpenError for recovery_seconds.
+    Half-open: one trial call goes through; success closes the breaker, failure
+    opens it again.
+
+    Only failures of the dependency itself should be recorded (connection errors,
+    timeouts, 5xx), not errors caused by the request (e.g. invalid SQL).
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_seconds: float = CIRCUIT_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_progress = False
+        self.times_opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check that a call may go through.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half-open with a trial already running
+        """
+        with self._lock:
+            if self.state == STATE_OPEN:
+                remaining = self.opened_at + self.recovery_seconds - time.time()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = STATE_HALF_OPEN
+                self.trial_in_progress = False
+            if self.state == STATE_HALF_OPEN:
+                if self.trial_in_progress:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.recovery_seconds)
+                self.trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                print(f"Circuit breaker for {self.name} closed")
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_progress = False
+            if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    self.times_opened += 1
+                    print(f"Circuit breaker for {self.name} opened after {self.consecutive_failures} failures")
+                self.state = STATE_OPEN
+                self.opened_at = time.time()
+
+    @contextmanager
+    def guard(self, is_failure=lambda error: True):
+        """
+        Run a block as one call through the breaker. Exceptions for which
+        is_failure returns True count as dependency failures; others (e.g. a SQL
+        error) mean the dependency answered, so they count as successes.
+        """
+        self.allow()
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+
+    def get_wait_time(self) -> float:
+        """Seconds until an open breaker lets a trial call through (0 if calls can go now)"""
+        with self._lock:
+            if self.state != STATE_OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.recovery_seconds - time.time())
+
+    def get_state(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Get (or lazily create) the process-wide breaker of a dependency"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def get_circuit_breaker_states() -> dict:
+    """Get the state of every breaker"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.get_state() for breaker in breakers}
+
+
+def get_circuit_wait_time() -> float:
+    """Seconds until every open breaker lets a trial call through"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return max([breaker.get_wait_time() for breaker in breakers] + [0.0])
@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 import json
+import threading
+import time
 load_dotenv(override=True)
 
 
@@ -19,109 +21,147 @@ class PGConfig:
         self.verbose = True
 
         
+# Connection details of the Fabric datasources, a list of {"id", "tenant_id", "client_id", "server", "database"}
+DATASOURCES_FILE = os.path.join(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")), "nl2sql/datasources.json"
+)
+# How often lookups check the file for changes (one stat)
+DATASOURCES_CHECK_SECONDS = float(os.getenv("DATASOURCES_CHECK_SECONDS", "5"))
+
+
 class FabricConfig:
-    def __init__(self, datasource_id):
+    def __init__(self, datasource_id, datasource=None):
         """
-        Loads connection details from `datasources.json` based on the given `datasource_id`.
+        Connection details of `datasource_id`: its entry of `datasources.json`, falling
+        back to the environment when it has none. Without an entry, the datasource
+        registry is looked up.
         """
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
-        print(f"Base directory: {base_dir}")
-        datasources_file = os.path.join(base_dir, "nl2sql/datasources.json")
-
-        if not os.path.exists(datasources_file):
-            print(f"Error: datasources.json not found at {datasources_file}")
-            # Fallback to default values if file doesn't exist
+        self.datasource_id = datasource_id
+        if datasource is None:
+            datasource = get_datasource_registry().get_datasource(datasource_id)
+
+        if datasource:
+            self.tenant_id = datasource["tenant_id"]
+            self.client_id = datasource["client_id"]
+            self.server = datasource["server"]
+            self.database = datasource["database"]
+        else:
             self.tenant_id = os.getenv("AZURE_TENANT_ID")
             self.client_id = os.getenv("AZURE_CLIENT_ID")
             self.server = os.getenv("AZURE_SQL_SERVER")
             self.database = os.getenv("AZURE_SQL_DATABASE")
-            self.client_secret = os.getenv("AZURE_CLIENT_SECRET")
-            
-            # Log values for debugging (mask secrets in production)
-            print(f"Using environment variables for database connection:")
-            print(f"  Tenant ID: {self.tenant_id}")
-            print(f"  Client ID: {self.client_id}")
-            print(f"  Server: {self.server}")
-            print(f"  Database: {self.database}")
-            print(f"  Client Secret: {'*****' if self.client_secret else 'Not set'}")
-            
-            # Construct the connection string with increased timeout values
-            self.connection_string = (
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={self.server};"
-                f"DATABASE={self.database};"
-                f"Authentication=ActiveDirectoryServicePrincipal;"
-                f"UID={self.client_id};"
-                f"PWD={self.client_secret};"
-                f"Authority Id={self.tenant_id};"
-                f"Connection Timeout=60;"  # Extended timeout
-                f"Command Timeout=60;"     # Extended timeout
-            )
-            return
 
-        try:
-            with open(datasources_file, "r", encoding="utf-8") as file:
-                datasources = json.load(file)
+        # Retrieve client secret from environment (assumes secret is stored securely)
+        self.client_secret = os.getenv("AZURE_CLIENT_SECRET")
+
+        # Construct the connection string with increased timeout values
+        self.connection_string = (
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"SERVER={self.server};"
+            f"DATABASE={self.database};"
+            f"Authentication=ActiveDirectoryServicePrincipal;"
+            f"UID={self.client_id};"
+            f"PWD={self.client_secret};"
+            f"Authority Id={self.tenant_id};"
+            f"Connection Timeout=60;"  # Extended timeout
+            f"Command Timeout=60;"     # Extended timeout
+        )
+
+        self.verbose = True
+
+    @property
+    def token_connection_string(self):
+        """
+        Connection string for a connection authenticated with a pre-acquired access
+        token: without Authentication, UID and PWD, which the driver rejects alongside a token.
+        """
+        return (
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"SERVER={self.server};"
+            f"DATABASE={self.database};"
+            f"Connection Timeout=60;"
+            f"Command Timeout=60;"
+        )
 
-            datasource = next((ds for ds in datasources if ds["id"] == datasource_id), None)
 
-            if not datasource:
-                print(f"Error: Datasource '{datasource_id}' not found in datasources.json.")
-                # Fallback to default values
-                self.tenant_id = os.getenv("AZURE_TENANT_ID")
-                self.client_id = os.getenv("AZURE_CLIENT_ID")
-                self.server = os.getenv("AZURE_SQL_SERVER")
-                self.database = os.getenv("AZURE_SQL_DATABASE")
+class DatasourceRegistry:
+    """
+    datasources.json loaded once and indexed by id, with a FabricConfig cached per
+    datasource. The file is re-read only when its mtime changes (checked at most every
+    DATASOURCES_CHECK_SECONDS); problems with it are reported once per change.
+    """
+
+    def __init__(self, datasources_file=DATASOURCES_FILE, check_seconds=DATASOURCES_CHECK_SECONDS):
+        self.datasources_file = datasources_file
+        self.check_seconds = check_seconds
+        self.version = 0
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        # None until loaded, -1 while the file does not exist
+        self._mtime = None
+        self._datasources = {}
+        self._configs = {}
+
+    def refresh(self, force=False):
+        """Reload the file if it changed since the last check"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_seconds:
+            return
+        with self._lock:
+            if not force and now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.datasources_file).st_mtime
+            except FileNotFoundError:
+                mtime = -1
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            if mtime == -1:
+                print(f"datasources.json not found at {self.datasources_file}, using environment variables")
+                self._datasources = {}
             else:
-                # Set values from datasources.json
-                self.tenant_id = datasource["tenant_id"]
-                self.client_id = datasource["client_id"]
-                self.server = datasource["server"]
-                self.database = datasource["database"]
-
-            # Retrieve client secret from environment (assumes secret is stored securely)
-            self.client_secret = os.getenv("AZURE_CLIENT_SECRET")
-            if not self.client_secret:
+                try:
+                    with open(self.datasources_file, "r", encoding="utf-8") as file:
+                        self._datasources = {ds["id"]: ds for ds in json.load(file)}
+                except Exception as e:
+                    # Keep serving the previous version of the file
+                    print(f"Error loading datasources.json: {e}")
+            self._configs = {}
+            self.version += 1
+
+    def get_datasource(self, datasource_id):
+        """Get the datasources.json entry of a datasource, or None"""
+        self.refresh()
+        return self._datasources.get(datasource_id)
+
+    def get_config(self, datasource_id):
+        """Get the (cached) FabricConfig of a datasource"""
+        self.refresh()
+        config = self._configs.get(datasource_id)
+        if config is None:
+            datasource = self._datasources.get(datasource_id)
+            if datasource is None and self._datasources:
+                print(f"Error: Datasource '{datasource_id}' not found in datasources.json, using environment variables")
+            if not os.getenv("AZURE_CLIENT_SECRET"):
                 print("Warning: AZURE_CLIENT_SECRET environment variable is not set")
+            config = FabricConfig(datasource_id, datasource)
+            self._configs[datasource_id] = config
+        return config
 
-            # Construct the connection string with increased timeout values
-            self.connection_string = (
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={self.server};"
-                f"DATABASE={self.database};"
-                f"Authentication=ActiveDirectoryServicePrincipal;"
-                f"UID={self.client_id};"
-                f"PWD={self.client_secret};"
-                f"Authority Id={self.tenant_id};"
-                f"Connection Timeout=60;"  # Extended timeout
-                f"Command Timeout=60;"     # Extended timeout
-            )
-            
-            print(f"Connection string constructed for {self.server}/{self.database}")
-            
-        except Exception as e:
-            print(f"Error loading datasources.json: {e}")
-            # Fallback to environment variables
-            self.tenant_id = os.getenv("AZURE_TENANT_ID")
-            self.client_id = os.getenv("AZURE_CLIENT_ID")
-            self.server = os.getenv("AZURE_SQL_SERVER")
-            self.database = os.getenv("AZURE_SQL_DATABASE")
-            self.client_secret = os.getenv("AZURE_CLIENT_SECRET")
-            
-            # Construct the connection string with increased timeout values
-            self.connection_string = (
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={self.server};"
-                f"DATABASE={self.database};"
-                f"Authentication=ActiveDirectoryServicePrincipal;"
-                f"UID={self.client_id};"
-                f"PWD={self.client_secret};"
-                f"Authority Id={self.tenant_id};"
-                f"Connection Timeout=60;"  # Extended timeout
-                f"Command Timeout=60;"     # Extended timeout
-            )
 
-        self.verbose = True
+_datasource_registry = None
+_datasource_registry_lock = threading.Lock()
+
+
+def get_datasource_registry():
+    """Get the process-wide datasource registry"""
+    global _datasource_registry
+    with _datasource_registry_lock:
+        if _datasource_registry is None:
+            _datasource_registry = DatasourceRegistry()
+        return _datasource_registry
 
 
 class BigQueryConfig:
@@ -0,0 +1,266 @@
+from collections import deque
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+
+# Connections kept per datasource: min_size stay open while idle, max_size at most at once
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Idle connections above min_size are closed after this long
+DB_POOL_IDLE_SECONDS = float(os.getenv("DB_POOL_IDLE_SECONDS", "300"))
+# Connections are closed after this long whatever their use (e.g. before their token expires)
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", "1800"))
+# Connections idle for longer than this are checked with a round trip before being handed out
+DB_POOL_VALIDATE_IDLE_SECONDS = float(os.getenv("DB_POOL_VALIDATE_IDLE_SECONDS", "30"))
+# Longest a borrow waits for a connection when the pool is at max_size
+DB_POOL_BORROW_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_BORROW_TIMEOUT_SECONDS", "30"))
+# How often idle and expired connections are closed and pools topped up to min_size
+DB_POOL_MAINTENANCE_SECONDS = float(os.getenv("DB_POOL_MAINTENANCE_SECONDS", "30"))
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection became available within the borrow timeout"""
+
+
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections of one datasource.
+
+    Borrowed connections are the most recently used idle ones; connections idle for
+    longer than validate_idle_seconds are validated first and replaced if broken.
+    Connections past max_lifetime_seconds are closed instead of being reused, and
+    idle connections above min_size are closed by maintain(). When max_size
+    connections are in use, borrowers wait up to borrow_timeout.
+    """
+
+    def __init__(self, name: str, connect, validate=None, min_size: int = DB_POOL_MIN_SIZE,
+                 max_size: int = DB_POOL_MAX_SIZE, idle_seconds: float = DB_POOL_IDLE_SECONDS,
+                 max_lifetime_seconds: float = DB_POOL_MAX_LIFETIME_SECONDS,
+                 validate_idle_seconds: float = DB_POOL_VALIDATE_IDLE_SECONDS,
+                 borrow_timeout: float = DB_POOL_BORROW_TIMEOUT_SECONDS):
+        self.name = name
+        self.connect = connect
+        self.validate = validate
+        self.max_size = max(1, max_size)
+        self.min_size = min(max(0, min_size), self.max_size)
+        self.idle_seconds = idle_seconds
+        self.max_lifetime_seconds = max_lifetime_seconds
+        self.validate_idle_seconds = validate_idle_seconds
+        self.borrow_timeout = borrow_timeout
+        # Open connections, idle or in use (including those being opened)
+        self._size = 0
+        self._idle = deque()
+        self._condition = threading.Condition()
+        self._stats = {
+            "borrows": 0, "waits": 0, "timeouts": 0, "wait_ms": 0.0, "max_wait_ms": 0.0,
+            "created": 0, "discarded": 0, "evicted": 0, "validation_failures": 0, "peak_in_use": 0,
+        }
+
+    def _is_expired(self, entry: PooledConnection, now: float) -> bool:
+        return now - entry.created_at >= self.max_lifetime_seconds
+
+    def _is_valid(self, entry: PooledConnection) -> bool:
+        if self.validate is None or time.monotonic() - entry.last_used < self.validate_idle_seconds:
+            return True
+        try:
+            self.validate(entry.connection)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(entry: PooledConnection):
+        try:
+            entry.connection.close()
+        except Exception:
+            pass
+
+    def _take(self, start_time: float):
+        """Take an idle connection or a slot for a new one, waiting while the pool is full"""
+        expired = []
+        waited = False
+        try:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        entry = self._idle.pop()
+                        if not self._is_expired(entry, now):
+                            return entry, waited
+                        expired.append(entry)
+                        self._size -= 1
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None, waited
+                    remaining = self.borrow_timeout - (now - start_time)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"No connection to {self.name} available after {self.borrow_timeout:.0f}s "
+                            f"({self.max_size} in use)"
+                        )
+                    waited = True
+                    self._condition.wait(remaining)
+        finally:
+            for entry in expired:
+                self._close(entry)
+
+    def borrow(self) -> PooledConnection:
+        """Get a connection, opening one if none is idle and the pool is not full"""
+        start_time = time.monotonic()
+        waited = False
+        while True:
+            entry, entry_waited = self._take(start_time)
+            waited = waited or entry_waited
+            if entry is None:
+                try:
+                    entry = PooledConnection(self.connect())
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._stats["created"] += 1
+            elif not self._is_valid(entry):
+                with self._condition:
+                    self._stats["validation_failures"] += 1
+                self.release(entry, discard=True)
+                continue
+            wait_ms = (time.monotonic() - start_time) * 1000
+            with self._condition:
+                self._stats["borrows"] += 1
+                self._stats["waits"] += int(waited)
+                self._stats["wait_ms"] += wait_ms
+                self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+                self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._size - len(self._idle))
+            return entry
+
+    def release(self, entry: PooledConnection, discard: bool = False):
+        """Return a borrowed connection, or close it if it is broken or too old"""
+        now = time.monotonic()
+        discard = discard or self._is_expired(entry, now)
+        with self._condition:
+            if discard:
+                self._size -= 1
+                self._stats["discarded"] += 1
+            else:
+                entry.last_used = now
+                self._idle.append(entry)
+            self._condition.notify()
+        if discard:
+            self._close(entry)
+
+    @contextmanager
+    def connection(self, discard_on=lambda error: True):
+        """
+        Borrow a connection for a block. The connection is closed instead of being
+        returned when the block raises an exception for which discard_on returns True.
+        """
+        entry = self.borrow()
+        try:
+            yield entry.connection
+        except Exception as e:
+            self.release(entry, discard=discard_on(e))
+            raise
+        self.release(entry)
+
+    def maintain(self):
+        """Close idle connections above min_size and expired ones, then top up to min_size"""
+        now = time.monotonic()
+        closing = []
+        with self._condition:
+            kept = deque()
+            # Oldest idle connections first
+            for entry in self._idle:
+                idle_too_long = now - entry.last_used >= self.idle_seconds and self._size > self.min_size
+                if self._is_expired(entry, now) or idle_too_long:
+                    closing.append(entry)
+                    self._size -= 1
+                else:
+                    kept.append(entry)
+            self._idle = kept
+            self._stats["evicted"] += len(closing)
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+        for entry in closing:
+            self._close(entry)
+
+        for _ in range(missing):
+            try:
+                entry = PooledConnection(self.connect())
+            except Exception as e:
+                with self._condition:
+                    self._size -= 1
+                print(f"Could not open a connection to {self.name}: {e}")
+                continue
+            with self._condition:
+                self._stats["created"] += 1
+                self._idle.appendleft(entry)
+                self._condition.notify()
+
+    def get_stats(self) -> dict:
+        """
+        Get the pool size, saturation (share of max_size in use now; waits counts the
+        borrows that found the pool full) and borrow wait times
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+        stats["max_size"] = self.max_size
+        stats["saturation"] = round(stats["in_use"] / self.max_size, 2)
+        stats["avg_wait_ms"] = round(stats["wait_ms"] / stats["borrows"], 1) if stats["borrows"] else 0.0
+        stats["wait_ms"] = round(stats["wait_ms"], 1)
+        stats["max_wait_ms"] = round(stats["max_wait_ms"], 1)
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_maintenance_thread = None
+
+
+def maintain_pools():
+    while True:
+        time.sleep(DB_POOL_MAINTENANCE_SECONDS)
+        with _pools_lock:
+            pools = list(_pools.values())
+        for pool in pools:
+            try:
+                pool.maintain()
+            except Exception as e:
+                print(f"Error maintaining connection pool {pool.name}: {e}")
+
+
+def get_connection_pool(name: str, connect, validate=None) -> ConnectionPool:
+    """
+    Get (or lazily create) the process-wide pool of a datasource. connect opens a
+    connection and validate(connection) raises if a connection is broken; both are
+    only used when the pool is created.
+    """
+    global _maintenance_thread
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ConnectionPool(name, connect, validate)
+        if _maintenance_thread is None:
+            _maintenance_thread = threading.Thread(target=maintain_pools, name="db-pool-maintenance", daemon=True)
+            _maintenance_thread.start()
+        return _pools[name]
+
+
+def get_connection_pool_stats() -> dict:
+    """Get the stats of every pool"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.get_stats() for pool in pools}
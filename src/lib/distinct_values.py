@@ -0,0 +1,155 @@
+from .circuit_breaker import CircuitOpenError
+from .schema_catalog import get_schema_catalog
+import os
+import threading
+import time
+
+
+# Most frequent values kept per categorical column (as many as the live query returns)
+DISTINCT_VALUES_TOP_N = int(os.getenv("DISTINCT_VALUES_TOP_N", "100"))
+# How often the values are recomputed; 0 disables the store (every call queries Fabric)
+DISTINCT_VALUES_REFRESH_SECONDS = float(os.getenv("DISTINCT_VALUES_REFRESH_SECONDS", "3600"))
+
+
+def quote_name(name: str) -> str:
+    return "[" + name.replace("]", "]]") + "]"
+
+
+def build_distinct_values_query(view_name: str, column_name: str, top_n: int = DISTINCT_VALUES_TOP_N) -> str:
+    """Query for the top_n most frequent values of a column, with their counts"""
+    column = quote_name(column_name)
+    return (
+        f"SELECT TOP {top_n} {column}, COUNT(*) AS qty "
+        f"FROM [dbo].{quote_name(view_name)} "
+        f"GROUP BY {column} "
+        f"ORDER BY qty DESC"
+    )
+
+
+class DistinctValueStore:
+    """
+    Top-N value frequencies of the columns flagged "categorical": true in
+    nl2sql/tables, kept in memory and recomputed every refresh_seconds by a
+    background thread, so FetchDistinctValues does not scan the view on every call.
+
+    fetch(datasource, query) runs a query and returns (column names, rows). A column
+    whose refresh fails keeps its previous values; request_refresh() triggers an
+    early refresh (e.g. after the data of a datasource was reloaded).
+    """
+
+    name = "distinct values"
+    # Columns of nl2sql/tables with this flag set are kept in the store
+    column_flag = "categorical"
+
+    def __init__(self, top_n: int = DISTINCT_VALUES_TOP_N, refresh_seconds: float = DISTINCT_VALUES_REFRESH_SECONDS):
+        self.top_n = top_n
+        self.refresh_seconds = refresh_seconds
+        self.fetch = None
+        # (datasource, view, column), lowercased -> {"columns": [...], "rows": [...], "refreshed_at": ...}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending_datasources = set()
+        self._thread = None
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0, "last_refresh_ms": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.refresh_seconds > 0
+
+    def start(self, fetch):
+        """Start the background refresh with the given query function (once)"""
+        with self._lock:
+            if self._thread is not None or not self.enabled:
+                return
+            self.fetch = fetch
+            self._thread = threading.Thread(target=self._run, name=f"{self.name.replace(' ', '-')}-refresh", daemon=True)
+            self._thread.start()
+
+    def get_columns(self, datasource: str = None) -> list[tuple]:
+        """Get (datasource, view, column) of every flagged column in the schema catalog"""
+        return [
+            (table["datasource"], table["table"], column["name"])
+            for table in get_schema_catalog().get_tables()
+            if datasource is None or table.get("datasource") == datasource
+            for column in table.get("columns", [])
+            if column.get(self.column_flag)
+        ]
+
+    def load_column(self, datasource: str, view_name: str, column_name: str):
+        """Compute the entry of one column"""
+        columns, rows = self.fetch(datasource, build_distinct_values_query(view_name, column_name, self.top_n))
+        return {"columns": columns, "rows": [tuple(row) for row in rows], "refreshed_at": time.time()}
+
+    def refresh(self, datasource: str = None):
+        """Recompute the entries of every flagged column (of one datasource)"""
+        start_time = time.monotonic()
+        for column_datasource, view_name, column_name in self.get_columns(datasource):
+            try:
+                entry = self.load_column(column_datasource, view_name, column_name)
+            except CircuitOpenError as e:
+                print(f"Skipping the {self.name} refresh: {e}")
+                break
+            except Exception as e:
+                with self._lock:
+                    self._stats["refresh_errors"] += 1
+                print(f"Error refreshing the {self.name} of {view_name}.{column_name}: {e}")
+                continue
+            key = (column_datasource.lower(), view_name.lower(), column_name.lower())
+            with self._lock:
+                self._values[key] = entry
+        with self._lock:
+            self._stats["refreshes"] += 1
+            self._stats["last_refresh_ms"] = round((time.monotonic() - start_time) * 1000, 1)
+
+    def request_refresh(self, datasource: str = None):
+        """Refresh the values of a datasource (all of them without one) as soon as possible"""
+        with self._lock:
+            self._pending_datasources.add(datasource)
+        self._wake.set()
+
+    def _run(self):
+        next_full_refresh = 0.0
+        while True:
+            if time.monotonic() >= next_full_refresh:
+                with self._lock:
+                    self._pending_datasources.clear()
+                self.refresh()
+                next_full_refresh = time.monotonic() + self.refresh_seconds
+            with self._lock:
+                pending = self._pending_datasources
+                self._pending_datasources = set()
+            if None in pending:
+                next_full_refresh = 0.0
+                continue
+            for datasource in pending:
+                self.refresh(datasource)
+            self._wake.wait(max(0.0, next_full_refresh - time.monotonic()))
+            self._wake.clear()
+
+    def get(self, datasource: str, view_name: str, column_name: str):
+        """Get the precomputed entry of a column, or None if it is not (yet) in the store"""
+        key = (datasource.lower(), view_name.lower(), column_name.lower())
+        with self._lock:
+            entry = self._values.get(key)
+            self._stats["hits" if entry is not None else "misses"] += 1
+            return entry
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["columns"] = len(self._values)
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_distinct_value_store() -> DistinctValueStore:
+    """Get the process-wide distinct value store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DistinctValueStore()
+        return _store
@@ -0,0 +1,293 @@
+from openai import AzureOpenAI
+from urllib.parse import urlparse
+from .rate_limiter import rate_limited
+from .retry_policy import RETRYABLE_RUN_ERROR_CODES, RunFailedError, parse_retry_after
+from .circuit_breaker import get_circuit_breaker
+import contextvars
+import json
+import openai
+import os
+import random
+import threading
+import time
+
+
+def parse_backends(value: str) -> list:
+    """Parse the JSON list of backend settings, ignoring it (with an error) if malformed"""
+    try:
+        backends = json.loads(value or "[]")
+        if not isinstance(backends, list) or not all(isinstance(b, dict) and b.get("endpoint") for b in backends):
+            raise ValueError("expected a JSON list of objects with an endpoint")
+        return backends
+    except (TypeError, ValueError) as e:
+        print(f"Ignoring invalid AZURE_OPENAI_BACKENDS: {e}")
+        return []
+
+
+# Endpoints to spread chat, embedding and verification calls across, e.g.
+# '[{"name": "eastus", "endpoint": "https://a.openai.azure.com", "api_key": "...", "weight": 2},
+#   {"name": "local", "endpoint": "http://127.0.0.1:8081", "api_key": "test",
+#    "deployments": {"gpt-4o": "gpt-4o-local"}}]'
+# "deployments" maps the deployment names used in the code to the names on that endpoint
+# (all of them, unchanged, when omitted). Without this setting there is a single backend
+# built from AZURE_OPENAI_API_ENDPOINT / AZURE_OPENAI_API_KEY.
+AZURE_OPENAI_BACKENDS = parse_backends(os.getenv("AZURE_OPENAI_BACKENDS"))
+# How long a backend is skipped after a 429, 5xx or connection error (doubled on
+# consecutive failures, up to the maximum); Retry-After is used when longer
+BACKEND_EJECT_SECONDS = float(os.getenv("BACKEND_EJECT_SECONDS", "30"))
+BACKEND_MAX_EJECT_SECONDS = float(os.getenv("BACKEND_MAX_EJECT_SECONDS", "300"))
+
+EJECT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Endpoint host of the pool assistant handling the current request; calls made for
+# that request (e.g. from its tools) go to the same endpoint while it is healthy
+_preferred_host = contextvars.ContextVar("preferred_openai_host", default=None)
+
+
+def get_host(url) -> str:
+    return urlparse(str(url)).netloc.lower()
+
+
+def prefer_endpoint(url) -> contextvars.Token:
+    """Prefer the endpoint of url for the current request; reset the returned token when done"""
+    return _preferred_host.set(get_host(url) if url else None)
+
+
+def reset_preferred_endpoint(token: contextvars.Token):
+    _preferred_host.reset(token)
+
+
+def is_openai_failure(error: Exception) -> bool:
+    """Overload, 5xx and connection errors (and runs failing for those reasons) count against Azure OpenAI"""
+    if isinstance(error, RunFailedError):
+        return error.code in RETRYABLE_RUN_ERROR_CODES
+    return OpenAILoadBalancer.should_eject(error)
+
+
+class ModelBackend:
+    """One Azure OpenAI endpoint with its weight, deployments and health state"""
+
+    def __init__(self, name: str, endpoint: str, api_key: str, api_version: str = None,
+                 weight: float = 1.0, deployments: dict = None, max_retries: int = 2):
+        self.name = name
+        self.endpoint = endpoint
+        self.host = get_host(endpoint)
+        self.api_key = api_key
+        self.api_version = api_version or os.getenv("AZURE_OPENAI_API_VERSION")
+        self.weight = max(float(weight), 0.01)
+        self.deployments = deployments
+        self.max_retries = max_retries
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.calls = 0
+        self.failures = 0
+        self.ejections = 0
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self) -> AzureOpenAI:
+        with self._client_lock:
+            if self._client is None:
+                self._client = AzureOpenAI(
+                    api_key=self.api_key,
+                    api_version=self.api_version,
+                    azure_endpoint=self.endpoint,
+                    max_retries=self.max_retries,
+                )
+            return self._client
+
+    def supports(self, model: str) -> bool:
+        return self.deployments is None or model in self.deployments
+
+    def get_deployment(self, model: str) -> str:
+        return model if self.deployments is None else self.deployments[model]
+
+    def get_limiter_key(self, model: str) -> str:
+        """Rate limiter key: the deployment name, qualified by the backend when there are several"""
+        deployment = self.get_deployment(model)
+        return deployment if self.name == "default" else f"{self.name}/{deployment}"
+
+
+class OpenAILoadBalancer:
+    """
+    Spreads model calls across backends with weighted least-outstanding-requests.
+
+    A backend that answers 429/5xx (or cannot be reached) is ejected for a while
+    and the call fails over to the next backend. Calls made while a request is
+    served by a pool assistant prefer that assistant's endpoint. Backends are
+    plain URLs, so local stand-in HTTP servers (http://127.0.0.1:PORT) can be
+    configured in place of Azure endpoints.
+    """
+
+    def __init__(self, backends: list[ModelBackend], eject_seconds: float = BACKEND_EJECT_SECONDS,
+                 max_eject_seconds: float = BACKEND_MAX_EJECT_SECONDS):
+        if not backends:
+            raise ValueError("At least one Azure OpenAI backend is required")
+        self.backends = backends
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        if not AZURE_OPENAI_BACKENDS:
+            return cls([
+                ModelBackend(
+                    name="default",
+                    endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT"),
+                    api_key=os.getenv("AZURE_OPENAI_API_KEY") or os.getenv("AZURE_OPENAI_KEY"),
+                )
+            ])
+        # Failing over is faster than letting the client retry the same backend
+        return cls([
+            ModelBackend(
+                name=config.get("name") or get_host(config["endpoint"]),
+                endpoint=config["endpoint"],
+                api_key=config.get("api_key") or os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=config.get("api_version"),
+                weight=config.get("weight", 1.0),
+                deployments=config.get("deployments"),
+                max_retries=0,
+            )
+            for config in AZURE_OPENAI_BACKENDS
+        ])
+
+    def choose(self, model: str, exclude: set = ()) -> ModelBackend:
+        """
+        Pick the backend for a call and count it as outstanding.
+
+        Returns:
+            ModelBackend: The chosen backend, or None if no backend serves the model
+        """
+        preferred_host = _preferred_host.get()
+        with self._lock:
+            now = time.time()
+            candidates = [b for b in self.backends if b.supports(model) and b.name not in exclude]
+            if not candidates:
+                return None
+            healthy = [b for b in candidates if b.ejected_until <= now]
+            if not healthy:
+                # Everything is ejected: try the backend that comes back first
+                backend = min(candidates, key=lambda b: b.ejected_until)
+            else:
+                preferred = [b for b in healthy if b.host == preferred_host]
+                if preferred:
+                    backend = preferred[0]
+                else:
+                    scores = [(b.outstanding + 1) / b.weight for b in healthy]
+                    best = min(scores)
+                    backend = random.choice([b for b, score in zip(healthy, scores) if score == best])
+            backend.outstanding += 1
+            backend.calls += 1
+            return backend
+
+    def release(self, backend: ModelBackend, error: Exception = None):
+        """Finish a call on a backend, ejecting it if the error says it is overloaded or down"""
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None:
+                backend.consecutive_failures = 0
+                return
+            backend.failures += 1
+            if not self.should_eject(error):
+                return
+            backend.consecutive_failures += 1
+            eject_seconds = min(
+                self.max_eject_seconds,
+                self.eject_seconds * 2 ** (backend.consecutive_failures - 1),
+            )
+            if isinstance(error, openai.APIStatusError) and error.response is not None:
+                eject_seconds = max(eject_seconds, parse_retry_after(error.response.headers) or 0)
+            backend.ejected_until = time.time() + eject_seconds
+            backend.ejections += 1
+        print(f"Ejected Azure OpenAI backend {backend.name} for {eject_seconds:.0f}s: {error}")
+
+    def get_limiter_key(self, model: str, url=None) -> str:
+        """
+        Rate limiter key of model on the backend serving url, so calls made outside the
+        balancer (e.g. assistant runs) share the bucket of the balanced calls
+        """
+        host = get_host(url) if url else None
+        for backend in self.backends:
+            if backend.host == host and backend.supports(model):
+                return backend.get_limiter_key(model)
+        return model
+
+    @staticmethod
+    def should_eject(error: Exception) -> bool:
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code in EJECT_STATUS_CODES
+
+    def call(self, model: str, function, estimated_tokens: int = 0, get_usage=None):
+        """
+        Run function(client, deployment) on a backend serving model, under that backend's
+        rate limiter, failing over to other backends on 429/5xx/connection errors.
+
+        Args:
+            model (str): Deployment name as used in the code
+            function (callable): Makes the call with the backend's client and deployment name
+            estimated_tokens (int): Token estimate for the rate limiter
+            get_usage (callable): Extracts the usage object from the result (default: result.usage)
+
+        Returns:
+            The result of function
+        """
+        with get_circuit_breaker("openai").guard(is_openai_failure):
+            return self._call(model, function, estimated_tokens, get_usage)
+
+    def _call(self, model: str, function, estimated_tokens: int, get_usage):
+        tried = set()
+        last_error = None
+        while True:
+            backend = self.choose(model, exclude=tried)
+            if backend is None:
+                if last_error is not None:
+                    # Every backend failed: this counts against the Azure OpenAI breaker
+                    raise last_error
+                raise ValueError(f"No Azure OpenAI backend serves deployment {model}")
+            tried.add(backend.name)
+
+            with rate_limited(backend.get_limiter_key(model), estimated_tokens) as reservation:
+                try:
+                    result = function(backend.client, backend.get_deployment(model))
+                except Exception as e:
+                    self.release(backend, error=e)
+                    if not self.should_eject(e):
+                        raise
+                    last_error = e
+                    continue
+                self.release(backend)
+                usage = get_usage(result) if get_usage else getattr(result, "usage", None)
+                reservation.settle(usage)
+                return result
+
+    def get_stats(self) -> dict:
+        """Get per-backend call, failure and ejection counts"""
+        with self._lock:
+            now = time.time()
+            return {
+                backend.name: {
+                    "calls": backend.calls,
+                    "failures": backend.failures,
+                    "ejections": backend.ejections,
+                    "outstanding": backend.outstanding,
+                    "ejected_for_seconds": round(max(0.0, backend.ejected_until - now), 1),
+                }
+                for backend in self.backends
+            }
+
+
+_load_balancer = None
+_load_balancer_lock = threading.Lock()
+
+
+def get_load_balancer() -> OpenAILoadBalancer:
+    """Get the process-wide load balancer, built from the environment on first use"""
+    global _load_balancer
+    with _load_balancer_lock:
+        if _load_balancer is None:
+            _load_balancer = OpenAILoadBalancer.from_env()
+        return _load_balancer
@@ -0,0 +1,180 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+def parse_rate_limits(value: str) -> dict:
+    """Parse the JSON deployment -> {"rpm", "tpm"} mapping, ignoring it (with an error) if malformed"""
+    try:
+        limits = json.loads(value or "{}")
+        if not isinstance(limits, dict) or not all(isinstance(quota, dict) for quota in limits.values()):
+            raise ValueError("expected a JSON object of objects")
+        return {
+            str(deployment): {key: int(quota[key]) for key in ("rpm", "tpm") if key in quota}
+            for deployment, quota in limits.items()
+        }
+    except (TypeError, ValueError) as e:
+        print(f"Ignoring invalid AZURE_OPENAI_RATE_LIMITS {value!r}: {e}")
+        return {}
+
+
+# Per-deployment quotas, e.g. '{"gpt-4o": {"rpm": 300, "tpm": 50000}}'. Deployments not
+# listed use the defaults; 0 means unlimited.
+RATE_LIMITS = parse_rate_limits(os.getenv("AZURE_OPENAI_RATE_LIMITS"))
+DEFAULT_RPM = int(os.getenv("AZURE_OPENAI_DEFAULT_RPM", "0"))
+DEFAULT_TPM = int(os.getenv("AZURE_OPENAI_DEFAULT_TPM", "0"))
+# Longest a call waits for quota before going out anyway (and possibly getting a 429)
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "60"))
+
+# Rough prompt size: ~4 characters per token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(*texts, completion_tokens: int = 0) -> int:
+    """Estimate the tokens of a call from its prompt texts and expected completion size"""
+    characters = 0
+    for text in texts:
+        if text is None:
+            continue
+        characters += len(text if isinstance(text, str) else json.dumps(text, default=str))
+    return characters // CHARS_PER_TOKEN + completion_tokens
+
+
+class TokenBucket:
+    """Bucket holding up to capacity units, refilled continuously at capacity per minute"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.available = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount units are available (0 if they are)"""
+        missing = amount - self.available
+        return max(0.0, missing * 60 / self.capacity)
+
+
+class Reservation:
+    """Quota taken for one call; settle it with the actual usage once the call returns"""
+
+    def __init__(self, limiter, estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.settled = False
+
+    def settle(self, usage=None, total_tokens: int = None):
+        """Correct the token bucket with the actual usage (a usage object or a token count)"""
+        if self.settled:
+            return
+        if total_tokens is None and usage is not None:
+            total_tokens = getattr(usage, "total_tokens", None)
+            if total_tokens is None:
+                total_tokens = (getattr(usage, "prompt_tokens", 0) or 0) + (getattr(usage, "completion_tokens", 0) or 0)
+        self.settled = True
+        if total_tokens is not None:
+            self.limiter.correct(self.estimated_tokens, total_tokens)
+
+
+class DeploymentRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets of one deployment,
+    shared by every thread of the process. A call first waits until both buckets
+    can cover it (one request and its estimated tokens); the token bucket is then
+    corrected with the tokens the call actually used.
+    """
+
+    def __init__(self, deployment: str, rpm: int = 0, tpm: int = 0):
+        self.deployment = deployment
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "throttled": 0, "wait_ms": 0.0, "estimated_tokens": 0, "actual_tokens": 0}
+
+    def acquire(self, estimated_tokens: int = 0, max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS) -> Reservation:
+        """Wait until the call fits in both quotas (or max_wait elapsed) and take its share"""
+        if self.tokens:
+            # A call larger than the whole bucket could never go through
+            estimated_tokens = min(estimated_tokens, self.tokens.capacity)
+        start_time = time.monotonic()
+        throttled = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = 0.0
+                for bucket, amount in ((self.requests, 1), (self.tokens, estimated_tokens)):
+                    if bucket:
+                        bucket.refill(now)
+                        wait = max(wait, bucket.wait_time(amount))
+                if wait == 0.0 or now - start_time >= max_wait:
+                    if self.requests:
+                        self.requests.available -= 1
+                    if self.tokens:
+                        self.tokens.available -= estimated_tokens
+                    self._stats["calls"] += 1
+                    self._stats["throttled"] += int(throttled)
+                    self._stats["wait_ms"] += (now - start_time) * 1000
+                    self._stats["estimated_tokens"] += estimated_tokens
+                    return Reservation(self, estimated_tokens)
+            throttled = True
+            time.sleep(max(0.01, min(wait, max_wait - (time.monotonic() - start_time), 1.0)))
+
+    def correct(self, estimated_tokens: int, actual_tokens: int):
+        """Give back (or take more of) the token bucket once the actual usage is known"""
+        with self._lock:
+            self._stats["actual_tokens"] += actual_tokens
+            if self.tokens:
+                # The bucket may go negative after an underestimate; later calls then wait longer
+                self.tokens.available = min(self.tokens.capacity, self.tokens.available + estimated_tokens - actual_tokens)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["wait_ms"] = round(stats["wait_ms"], 1)
+        stats["rpm"] = self.requests.capacity if self.requests else None
+        stats["tpm"] = self.tokens.capacity if self.tokens else None
+        return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(deployment: str) -> DeploymentRateLimiter:
+    """Get (or lazily create) the process-wide limiter of a deployment"""
+    deployment = deployment or "unknown"
+    with _limiters_lock:
+        if deployment not in _limiters:
+            limits = RATE_LIMITS.get(deployment, {})
+            _limiters[deployment] = DeploymentRateLimiter(
+                deployment,
+                rpm=int(limits.get("rpm", DEFAULT_RPM)),
+                tpm=int(limits.get("tpm", DEFAULT_TPM)),
+            )
+        return _limiters[deployment]
+
+
+@contextmanager
+def rate_limited(deployment: str, estimated_tokens: int = 0):
+    """
+    Take a deployment's quota for one call. Settle the yielded reservation with the
+    response usage; if the call fails before that, the estimate is given back.
+    """
+    reservation = get_rate_limiter(deployment).acquire(estimated_tokens)
+    try:
+        yield reservation
+    finally:
+        # A failed call consumed no tokens
+        reservation.settle(total_tokens=0)
+
+
+def get_rate_limiter_stats() -> dict:
+    """Get per-deployment call, throttling and token counts"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.deployment: limiter.get_stats() for limiter in limiters}
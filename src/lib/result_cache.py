@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from .sql_verifier import normalize
+import json
+import os
+import threading
+import time
+
+
+def parse_view_ttls(value: str) -> dict:
+    """Parse the JSON view -> TTL (seconds) mapping, ignoring it (with an error) if malformed"""
+    try:
+        ttls = json.loads(value or "{}")
+        if not isinstance(ttls, dict):
+            raise ValueError("expected a JSON object")
+        return {str(view): float(ttl) for view, ttl in ttls.items()}
+    except (TypeError, ValueError) as e:
+        print(f"Ignoring invalid RESULT_CACHE_VIEW_TTLS {value!r}: {e}")
+        return {}
+
+
+# How long query results stay valid, by default and per view, e.g. '{"BudgetingView": 3600}'
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+RESULT_CACHE_VIEW_TTLS = parse_view_ttls(os.getenv("RESULT_CACHE_VIEW_TTLS"))
+# Total size of the cached results (UTF-8 bytes); least recently used results go first
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class ResultCache:
+    """
+    Results of RunSQLQuery shared by every user and request of the process, keyed by
+    datasource and normalized SQL (whitespace, comments and casing normalized,
+    literals kept).
+
+    Entries expire after the TTL of their view and the least recently used ones are
+    evicted once the cache holds more than max_bytes. invalidate() drops the entries
+    of a datasource (e.g. after its data was refreshed); queries that started before
+    the invalidation don't store their now possibly stale results.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, default_ttl: float = RESULT_CACHE_TTL_SECONDS,
+                 view_ttls: dict = RESULT_CACHE_VIEW_TTLS):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.view_ttls = {view.lower(): float(ttl) for view, ttl in view_ttls.items()}
+        # (datasource, normalized query) -> (expires_at, result, size)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Incremented on every invalidation of a datasource (of all datasources)
+        self._generations = {}
+        self._global_generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "evictions": 0, "invalidations": 0}
+
+    def get_ttl(self, view_name: str) -> float:
+        return self.view_ttls.get((view_name or "").lower(), self.default_ttl)
+
+    def get_generation(self, datasource: str) -> tuple:
+        """Get the generation to pass to put() for a query about to run"""
+        with self._lock:
+            return self._global_generation, self._generations.get(datasource, 0)
+
+    def get(self, datasource: str, query: str) -> str:
+        """Get the cached result of a query, or None"""
+        key = (datasource, normalize(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            self._stats["bytes_saved"] += entry[2]
+            return entry[1]
+
+    def put(self, datasource: str, view_name: str, query: str, result: str, generation: tuple):
+        """Store the result of a query that started at generation"""
+        ttl = self.get_ttl(view_name)
+        size = len(result.encode("utf-8"))
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        key = (datasource, normalize(query))
+        with self._lock:
+            if (self._global_generation, self._generations.get(datasource, 0)) != generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, datasource: str = None):
+        """Drop the results of a datasource (all of them without one)"""
+        with self._lock:
+            keys = [key for key in self._entries if datasource is None or key[0] == datasource]
+            for key in keys:
+                self._remove(key)
+            if datasource is None:
+                self._global_generation += 1
+            else:
+                self._generations[datasource] = self._generations.get(datasource, 0) + 1
+            self._stats["invalidations"] += 1
+        print(f"Invalidated {len(keys)} cached query results of {datasource or 'all datasources'}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else None
+        return stats
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Get the process-wide query result cache"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
@@ -0,0 +1,153 @@
+import openai
+import random
+import re
+import time
+
+
+# run.last_error.code values worth retrying; anything else (e.g. invalid_prompt) fails fast
+RETRYABLE_RUN_ERROR_CODES = {"server_error", "rate_limit_exceeded"}
+# HTTP statuses worth retrying when creating a run
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Rate-limited runs carry the wait time in the message, e.g. "Try again in 20 seconds."
+RETRY_IN_PATTERN = re.compile(r"try again in (\d+(?:\.\d+)?) ?(ms|milliseconds|s|sec|seconds)?", re.IGNORECASE)
+
+
+class RunFailedError(Exception):
+    """Raised when a run fails and is not (or no longer) retried"""
+
+    def __init__(self, message: str, code: str = None, retryable: bool = False):
+        super().__init__(message)
+        self.code = code
+        self.retryable = retryable
+
+
+class DeadlineExceededError(RunFailedError):
+    """Raised when the request deadline does not leave time for another attempt"""
+
+    def __init__(self, message: str):
+        super().__init__(message, code="deadline_exceeded", retryable=True)
+
+
+def parse_retry_after(headers) -> float:
+    """Get the wait time (seconds) from Retry-After / retry-after-ms headers, or None"""
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            # HTTP-date values are not sent by Azure OpenAI; fall back to backoff
+            return None
+    return None
+
+
+def parse_retry_in(message: str) -> float:
+    """Get the wait time (seconds) from a "Try again in N seconds" error message, or None"""
+    match = RETRY_IN_PATTERN.search(message or "")
+    if not match:
+        return None
+    value = float(match.group(1))
+    return value / 1000 if (match.group(2) or "").lower() in ("ms", "milliseconds") else value
+
+
+def classify_run_error(run) -> tuple:
+    """
+    Classify the last error of a run that did not complete.
+
+    Incomplete runs (e.g. max tokens reached) and cancelled ones would end the same
+    way again, so only failed runs are retried.
+
+    Returns:
+        tuple: (code, retryable, retry_after_seconds or None)
+    """
+    status = getattr(run, "status", None)
+    if status == "incomplete":
+        reason = getattr(getattr(run, "incomplete_details", None), "reason", None)
+        return reason or "incomplete", False, None
+    last_error = getattr(run, "last_error", None)
+    code = getattr(last_error, "code", None) or "unknown"
+    message = getattr(last_error, "message", None) or ""
+    retry_after = parse_retry_in(message) if code == "rate_limit_exceeded" else None
+    # Failed runs without an error code are treated as transient
+    retryable = code in RETRYABLE_RUN_ERROR_CODES or (code == "unknown" and status == "failed")
+    return code, retryable, retry_after
+
+
+def classify_api_error(error: Exception) -> tuple:
+    """
+    Classify an exception raised by the OpenAI client.
+
+    Returns:
+        tuple: (code, retryable, retry_after_seconds or None)
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return type(error).__name__, True, None
+    if isinstance(error, openai.APIStatusError):
+        retry_after = parse_retry_after(error.response.headers) if error.response is not None else None
+        return str(error.status_code), error.status_code in RETRYABLE_STATUS_CODES, retry_after
+    return type(error).__name__, False, None
+
+
+class RetryPolicy:
+    """
+    Decides whether and how long to wait before retrying a failed run.
+
+    Server-provided wait times (Retry-After headers, "try again in" messages) are
+    honored as given. Otherwise the delay is exponential backoff with full jitter,
+    capped at max_delay. No attempt is started if the wait would end past the
+    deadline.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 2.0, max_delay: float = 30.0,
+                 deadline: float = None):
+        """
+        Args:
+            max_attempts (int): Maximum number of attempts, the first one included
+            base_delay (float): Backoff delay (seconds) after the first failure
+            max_delay (float): Maximum backoff delay (seconds)
+            deadline (float): time.time() after which no new attempt is made, or None
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (infinite without a deadline)"""
+        return float("inf") if self.deadline is None else self.deadline - time.time()
+
+    def get_delay(self, attempt: int, retry_after: float = None) -> float:
+        """Delay before the attempt following the given (1-based) failed attempt"""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def wait_before_retry(self, attempt: int, code: str, retryable: bool, retry_after: float = None):
+        """
+        Sleep before the next attempt, or raise if the failure must not be retried.
+
+        Raises:
+            RunFailedError: If the error is permanent or the attempts are exhausted
+            DeadlineExceededError: If the wait would end past the deadline
+        """
+        if not retryable:
+            raise RunFailedError(f"Run failed with permanent error {code}", code=code)
+        if attempt >= self.max_attempts:
+            raise RunFailedError(
+                f"Run failed with {code} after {attempt} attempts", code=code, retryable=True
+            )
+        delay = self.get_delay(attempt, retry_after)
+        if delay >= self.remaining():
+            raise DeadlineExceededError(
+                f"Run failed with {code}; retrying in {delay:.1f}s would exceed the request deadline"
+            )
+        print(f"Run failed with {code}. Retrying in {delay:.1f} seconds... (Attempt {attempt}/{self.max_attempts})")
+        time.sleep(delay)
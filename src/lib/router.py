@@ -0,0 +1,201 @@
+from .usage import record_usage
+from .rate_limiter import estimate_tokens
+from .load_balancer import OpenAILoadBalancer, get_load_balancer
+import json
+import re
+import threading
+import time
+
+
+ROUTE_CHIT_CHAT = "chit_chat"
+ROUTE_SIMPLE_LOOKUP = "simple_lookup"
+ROUTE_ANALYTICAL = "analytical"
+ROUTES = (ROUTE_CHIT_CHAT, ROUTE_SIMPLE_LOOKUP, ROUTE_ANALYTICAL)
+
+# Obvious cases are decided locally without a model call
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|good (morning|afternoon|evening)|thanks?( you)?|thank you( very much)?|"
+    r"ok(ay)?|bye|goodbye|how are you|who are you|what can you do)\b[\s!.?,]*$",
+    re.IGNORECASE,
+)
+ANALYTICAL_PATTERN = re.compile(
+    r"\b(forecast|predict|projection|trend|correlat|regression|variance|statistic|"
+    r"chart|plot|graph|visuali[sz]e|growth rate|year[- ]over[- ]year|month[- ]over[- ]month|"
+    r"compare|comparison|analy[sz]e|analysis|why)\w*",
+    re.IGNORECASE,
+)
+
+CLASSIFIER_PROMPT = """
+You route business questions to the cheapest assistant that can answer them.
+Classify the user's latest message into exactly one route:
+- "chit_chat": greetings, thanks, small talk or questions about the assistant itself. No data is needed.
+- "simple_lookup": a single fact or short list answerable with one straightforward SQL query
+  (a total, a count, a top N, a value for a named customer, vendor or department).
+- "analytical": multi-step analysis, comparisons across periods or groups, trends, forecasts,
+  statistics, charts, or anything that needs several queries or calculations.
+When unsure, answer "analytical".
+Respond with JSON: {"route": "<route>"}
+"""
+
+
+class QuestionRouter:
+    """
+    Lightweight routing stage in front of the assistant. Questions are classified
+    as chit-chat, simple lookup or analytical so each class can be sent to the
+    cheapest model or engine that can answer it.
+
+    Per-route counts, classifier latency, end-to-end latency and escalations
+    (routed questions that had to be answered by the full assistant) are kept in
+    memory to measure routing accuracy and latency savings.
+    """
+
+    def __init__(self, model: str, instructions: str = None, balancer: OpenAILoadBalancer = None):
+        self.balancer = balancer or get_load_balancer()
+        self.model = model
+        self.instructions = instructions
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            route: {"requests": 0, "classified_by_rules": 0, "classifier_ms": 0.0,
+                    "total_ms": 0.0, "completed": 0, "escalated": 0}
+            for route in ROUTES
+        }
+
+    def classify(self, question: str, history: list[dict] = None) -> tuple:
+        """
+        Classify a question.
+
+        Returns:
+            tuple: (route, classifier_latency_ms, by_rules)
+        """
+        start_time = time.perf_counter()
+        route, by_rules = self._classify_by_rules(question), True
+        if route is None:
+            route, by_rules = self._classify_with_model(question, history), False
+        latency_ms = (time.perf_counter() - start_time) * 1000
+
+        with self._stats_lock:
+            stats = self._stats[route]
+            stats["requests"] += 1
+            stats["classifier_ms"] += latency_ms
+            if by_rules:
+                stats["classified_by_rules"] += 1
+        return route, latency_ms, by_rules
+
+    def _classify_by_rules(self, question: str):
+        if GREETING_PATTERN.match(question):
+            return ROUTE_CHIT_CHAT
+        if ANALYTICAL_PATTERN.search(question):
+            return ROUTE_ANALYTICAL
+        return None
+
+    def _classify_with_model(self, question: str, history: list[dict] = None) -> str:
+        content = question
+        if history:
+            # A follow-up question only makes sense with the previous turn
+            last_turn = history[-1]
+            content = (
+                f"Previous question: {last_turn['question']}\n"
+                f"Previous answer: {last_turn['answer'][:500]}\n"
+                f"Latest message: {question}"
+            )
+        try:
+            completion = self.balancer.call(
+                self.model,
+                lambda client, deployment: client.chat.completions.create(
+                    model=deployment,
+                    messages=[
+                        {"role": "system", "content": CLASSIFIER_PROMPT},
+                        {"role": "user", "content": content},
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=20,
+                    temperature=0,
+                ),
+                estimated_tokens=estimate_tokens(CLASSIFIER_PROMPT, content, completion_tokens=20),
+            )
+            record_usage("router", self.model, completion.usage)
+            route = json.loads(completion.choices[0].message.content).get("route")
+        except Exception as e:
+            print(f"Question classification failed, using the analytical route: {e}")
+            return ROUTE_ANALYTICAL
+        return route if route in ROUTES else ROUTE_ANALYTICAL
+
+    def answer_chit_chat(self, question: str, history: list[dict] = None) -> dict:
+        """
+        Answer a message that needs no data with the router's (cheap) model and no tools.
+
+        Returns:
+            dict: The same {"answer", "context", "total_tokens"} contract as AIAssistant.create_response
+        """
+        messages = []
+        if self.instructions:
+            messages.append({"role": "system", "content": self.instructions})
+        for turn in history or []:
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["answer"]})
+        messages.append({"role": "user", "content": question})
+
+        completion = self.balancer.call(
+            self.model,
+            lambda client, deployment: client.chat.completions.create(
+                model=deployment,
+                messages=messages,
+                max_tokens=300,
+            ),
+            estimated_tokens=estimate_tokens(messages, completion_tokens=300),
+        )
+        record_usage("chat_completion", self.model, completion.usage)
+        return {
+            "answer": completion.choices[0].message.content,
+            "context": "",
+            "total_tokens": {
+                "prompt_tokens": completion.usage.prompt_tokens,
+                "completion_tokens": completion.usage.completion_tokens,
+            },
+        }
+
+    def record_outcome(self, route: str, total_ms: float, escalated: bool = False):
+        """Record how a routed request ended and how long it took end to end"""
+        if route not in self._stats:
+            return
+        with self._stats_lock:
+            stats = self._stats[route]
+            stats["total_ms"] += total_ms
+            if escalated:
+                stats["escalated"] += 1
+            else:
+                stats["completed"] += 1
+
+    def get_stats(self) -> dict:
+        """
+        Get per-route metrics. Accuracy is the share of routed requests answered
+        without escalation; latency savings compare each route's total latency
+        with the analytical (full assistant) average.
+        """
+        with self._stats_lock:
+            stats = {route: dict(values) for route, values in self._stats.items()}
+
+        def average(values, key, count):
+            return round(values[key] / count, 1) if count else 0.0
+
+        analytical = stats[ROUTE_ANALYTICAL]
+        analytical_avg_ms = average(analytical, "total_ms", analytical["completed"] + analytical["escalated"])
+        result = {}
+        for route, values in stats.items():
+            finished = values["completed"] + values["escalated"]
+            avg_ms = average(values, "total_ms", finished)
+            result[route] = {
+                "requests": values["requests"],
+                "classified_by_rules": values["classified_by_rules"],
+                "avg_classifier_ms": average(values, "classifier_ms", values["requests"]),
+                "avg_total_ms": avg_ms,
+                "escalated": values["escalated"],
+                "accuracy": round(values["completed"] / finished, 3) if finished else None,
+            }
+            if route != ROUTE_ANALYTICAL and analytical_avg_ms and finished:
+                # Time saved compared to sending the same requests to the full assistant,
+                # escalated requests included (they cost more than going there directly)
+                result[route]["estimated_savings_ms"] = round(
+                    analytical_avg_ms * finished - values["total_ms"], 1
+                )
+        return result
@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+
+
+# nl2sql/tables holds one JSON file per view
+TABLES_FOLDER = os.path.join(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")), "nl2sql/tables"
+)
+# How often lookups check the files for changes (a directory scan and one stat per file)
+SCHEMA_CATALOG_CHECK_SECONDS = float(os.getenv("SCHEMA_CATALOG_CHECK_SECONDS", "5"))
+
+
+def format_schema(table_data):
+    """
+    Formats the schema content into a structured string.
+    """
+    schema_info = f"Table Name: {table_data['table']}\n"
+    schema_info += f"Description: {table_data['description']}\n"
+    schema_info += f"Datasource: {table_data['datasource']}\n\nColumns:\n"
+
+    for column in table_data.get("columns", []):
+        col_name = column.get("name", "Unknown")
+        col_desc = column.get("description", "No description available.")
+        col_type = column.get("type", "Unknown type")
+        schema_info += f"- {col_name} ({col_type}): {col_desc}\n"
+
+    return schema_info
+
+
+class SchemaCatalog:
+    """
+    View schemas of nl2sql/tables kept in memory, keyed by (datasource, view),
+    with their format_schema strings rendered once.
+
+    Files are re-read only when their mtime changes (or they are added or removed),
+    and that check runs at most every SCHEMA_CATALOG_CHECK_SECONDS, so a lookup is a
+    dict access. version increases on every change, so caches derived from the
+    schemas can be keyed by it.
+    """
+
+    def __init__(self, tables_folder: str = TABLES_FOLDER, check_seconds: float = SCHEMA_CATALOG_CHECK_SECONDS):
+        self.tables_folder = tables_folder
+        self.check_seconds = check_seconds
+        self.version = 0
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        # filename -> (mtime, table_data)
+        self._files = {}
+        # (datasource, view) -> {"table": table_data, "schema": rendered schema}
+        self._entries = {}
+        self._rendered_catalog = None
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.tables_folder)
+
+    def refresh(self, force: bool = False):
+        """Reload the files that changed since the last check"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_seconds:
+            return
+        with self._lock:
+            if not force and now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now
+            if not self.exists():
+                changed = bool(self._files)
+                self._files = {}
+            else:
+                changed = self._reload_changed_files()
+            if changed:
+                self._rebuild()
+
+    def _reload_changed_files(self) -> bool:
+        changed = False
+        seen = set()
+        for entry in os.scandir(self.tables_folder):
+            if not entry.name.endswith(".json"):
+                continue
+            seen.add(entry.name)
+            mtime = entry.stat().st_mtime
+            if entry.name in self._files and self._files[entry.name][0] == mtime:
+                continue
+            try:
+                with open(entry.path, "r", encoding="utf-8") as file:
+                    table_data = json.load(file)
+                self.errors.pop(entry.name, None)
+            except json.JSONDecodeError as e:
+                # Keep serving the previous version of the file, if any
+                self.errors[entry.name] = str(e)
+                table_data = self._files.get(entry.name, (None, None))[1]
+            self._files[entry.name] = (mtime, table_data)
+            changed = True
+        for filename in set(self._files) - seen:
+            del self._files[filename]
+            self.errors.pop(filename, None)
+            changed = True
+        return changed
+
+    def _rebuild(self):
+        entries = {}
+        for _, table_data in self._files.values():
+            if table_data:
+                key = (table_data.get("datasource"), table_data.get("table"))
+                entries[key] = {"table": table_data, "schema": format_schema(table_data)}
+        self._entries = entries
+        self._rendered_catalog = None
+        self.version += 1
+
+    def get_table(self, datasource: str, view_name: str) -> dict:
+        """Get the JSON definition of a view, or None"""
+        self.refresh()
+        entry = self._entries.get((datasource, view_name))
+        return entry["table"] if entry else None
+
+    def get_schema(self, datasource: str, view_name: str) -> str:
+        """Get the rendered schema of a view, or None"""
+        self.refresh()
+        entry = self._entries.get((datasource, view_name))
+        return entry["schema"] if entry else None
+
+    def get_tables(self) -> list[dict]:
+        """Get every view definition, sorted by (datasource, view)"""
+        self.refresh()
+        entries = self._entries
+        return [entries[key]["table"] for key in sorted(entries, key=lambda k: (k[0] or "", k[1] or ""))]
+
+    def render(self) -> str:
+        """
+        Renders every view schema into one string, in a stable order (datasource,
+        then view) so it can be part of a cacheable prompt prefix.
+        """
+        self.refresh()
+        with self._lock:
+            if self._rendered_catalog is None:
+                entries = self._entries
+                if not entries:
+                    self._rendered_catalog = ""
+                else:
+                    keys = sorted(entries, key=lambda k: (k[0] or "", k[1] or ""))
+                    self._rendered_catalog = "Available views:\n\n" + "\n".join(
+                        entries[key]["schema"] for key in keys
+                    )
+            return self._rendered_catalog
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_schema_catalog() -> SchemaCatalog:
+    """Get the process-wide schema catalog"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = SchemaCatalog()
+        return _catalog
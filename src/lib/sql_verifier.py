@@ -0,0 +1,502 @@
+from cachetools import TTLCache
+from dataclasses import dataclass, field, replace
+import os
+import re
+import threading
+
+
+# Row cap applied to every query the model runs
+MAX_ROWS = 50
+# Verification results kept for repeated queries (LRU, each entry expiring after the TTL)
+SQL_VERIFICATION_CACHE_SIZE = int(os.getenv("SQL_VERIFICATION_CACHE_SIZE", "1024"))
+SQL_VERIFICATION_CACHE_TTL_SECONDS = float(os.getenv("SQL_VERIFICATION_CACHE_TTL_SECONDS", "3600"))
+
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<whitespace>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>N?'(?:[^']|'')*')
+    | (?P<bracket>\[(?:[^\]]|\]\])*\])
+    | (?P<quoted>"(?:[^"]|"")*")
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<word>[A-Za-z_@#][\w@#$]*)
+    | (?P<symbol>[^\s])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Keywords that modify data or state, run code or reach outside the view
+FORBIDDEN_KEYWORDS = {
+    "insert", "update", "delete", "merge", "drop", "alter", "create", "truncate",
+    "exec", "execute", "grant", "revoke", "deny", "into", "openrowset", "openquery",
+    "opendatasource", "bulk", "dbcc", "use", "set", "declare", "waitfor", "backup",
+    "restore", "kill", "shutdown", "reconfigure", "checkpoint", "sp_executesql",
+}
+SET_OPERATORS = {"union", "except", "intersect"}
+# Words after which an identifier names a table (or CTE) rather than a column
+TABLE_KEYWORDS = {"from", "join"}
+# Words that can follow a table reference without being its alias
+CLAUSE_KEYWORDS = {
+    "where", "group", "order", "having", "join", "inner", "left", "right", "full", "cross",
+    "outer", "on", "union", "except", "intersect", "option", "with", "as", "apply", "pivot",
+    "unpivot", "offset", "fetch", "for",
+}
+# Words that can directly precede the first column of a select list (or of ORDER/GROUP BY)
+SELECT_LIST_PREFIXES = {"select", "distinct", "all", "top", "percent", "ties", "by", "as"}
+# Words of a SELECT statement that are never column names
+SQL_KEYWORDS = SELECT_LIST_PREFIXES | TABLE_KEYWORDS | CLAUSE_KEYWORDS | {
+    "and", "or", "not", "in", "is", "null", "like", "between", "exists", "case", "when",
+    "then", "else", "end", "asc", "desc", "over", "partition", "rows", "range", "unbounded",
+    "preceding", "following", "current", "row", "next", "first", "only", "escape", "any",
+    "some", "collate", "within", "current_timestamp", "current_user", "session_user",
+    "system_user",
+}
+# Functions whose first argument is a keyword (a date part or a data type), not a column
+KEYWORD_ARGUMENT_FUNCTIONS = {
+    "dateadd", "datediff", "datediff_big", "datepart", "datename", "datetrunc", "date_bucket",
+    "convert", "try_convert",
+}
+# Clauses whose bare identifiers are column references
+COLUMN_CLAUSES = {"select": "select", "where": "where", "on": "where", "having": "where",
+                  "group": "where", "order": "where"}
+# Words that end those clauses (table references, set operations and trailing options follow)
+CLAUSE_ENDS = TABLE_KEYWORDS | SET_OPERATORS | {"apply", "pivot", "unpivot", "offset", "fetch", "option", "for"}
+
+
+@dataclass
+class Token:
+    kind: str
+    value: str
+    start: int
+    end: int
+
+    @property
+    def lower(self) -> str:
+        return self.value.lower()
+
+    @property
+    def name(self) -> str:
+        """Identifier name without brackets or quotes, lowercased (T-SQL names are case-insensitive)"""
+        if self.kind == "bracket":
+            return self.value[1:-1].replace("]]", "]").lower()
+        if self.kind == "quoted":
+            return self.value[1:-1].replace('""', '"').lower()
+        return self.value.lower()
+
+    @property
+    def is_identifier(self) -> bool:
+        return self.kind in ("word", "bracket", "quoted")
+
+
+@dataclass
+class VerificationResult:
+    query: str
+    read_only: bool = True
+    # False when the row limit could not be applied by rewriting the query
+    row_limit_applied: bool = True
+    errors: list = field(default_factory=list)
+
+
+def tokenize(query: str) -> list[Token]:
+    """Split a T-SQL statement into tokens, dropping whitespace and comments"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        if kind in ("whitespace", "comment"):
+            continue
+        tokens.append(Token(kind, match.group(), match.start(), match.end()))
+    return tokens
+
+
+def find_closing(tokens: list[Token], index: int) -> int:
+    """Index of the parenthesis closing the one at index (len(tokens) if unbalanced)"""
+    depth = 0
+    for i in range(index, len(tokens)):
+        if tokens[i].value == "(":
+            depth += 1
+        elif tokens[i].value == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(tokens)
+
+
+def skip_ctes(tokens: list[Token], cte_names: set, cte_columns: set) -> int:
+    """Skip 'WITH name [(columns)] AS (...), ...' and return the index of the main statement"""
+    i = 1
+    while i < len(tokens):
+        if not tokens[i].is_identifier:
+            return i
+        cte_names.add(tokens[i].name)
+        i += 1
+        if i < len(tokens) and tokens[i].value == "(":
+            closing = find_closing(tokens, i)
+            cte_columns.update(t.name for t in tokens[i + 1:closing] if t.is_identifier)
+            i = closing + 1
+        if i < len(tokens) and tokens[i].lower == "as":
+            i += 1
+        if i < len(tokens) and tokens[i].value == "(":
+            i = find_closing(tokens, i) + 1
+        if i < len(tokens) and tokens[i].value == ",":
+            i += 1
+            continue
+        return i
+    return i
+
+
+def check_read_only(tokens: list[Token], result: VerificationResult):
+    statement_start = 0
+    if tokens and tokens[0].lower == "with":
+        statement_start = skip_ctes(tokens, set(), set())
+    first = next((t for t in tokens[statement_start:] if t.value != "("), None)
+    if first is None or first.lower != "select":
+        result.read_only = False
+        result.errors.append("Only SELECT statements are allowed.")
+    for index, token in enumerate(tokens):
+        if token.kind == "word" and (token.lower in FORBIDDEN_KEYWORDS or token.lower.startswith(("xp_", "sp_"))):
+            result.read_only = False
+            result.errors.append(f"'{token.value}' is not allowed in a read-only query.")
+            break
+        if token.value == ";" and any(t.value != ";" for t in tokens[index + 1:]):
+            result.read_only = False
+            result.errors.append("Only one statement can be run at a time.")
+            break
+
+
+def apply_row_limit(query: str, tokens: list[Token], main_index: int, result: VerificationResult) -> str:
+    """Cap the rows of the main SELECT to MAX_ROWS with TOP (or its OFFSET ... FETCH clause)"""
+    depth = 0
+    offset_index = None
+    fetch_index = None
+    for i in range(main_index, len(tokens)):
+        value = tokens[i].value
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+        elif depth == 0 and tokens[i].lower in SET_OPERATORS:
+            # TOP would only limit the first SELECT of the set operation
+            result.row_limit_applied = False
+            return query
+        elif depth == 0 and tokens[i].lower == "offset":
+            offset_index = i
+        elif depth == 0 and tokens[i].lower == "fetch":
+            fetch_index = i
+
+    if fetch_index is not None:
+        # OFFSET x ROWS FETCH NEXT n ROWS ONLY
+        count = tokens[fetch_index + 2] if fetch_index + 2 < len(tokens) else None
+        if count is None or count.kind != "number":
+            result.row_limit_applied = False
+            return query
+        if float(count.value) > MAX_ROWS:
+            return query[:count.start] + str(MAX_ROWS) + query[count.end:]
+        return query
+    if offset_index is not None:
+        # SQL Server rejects TOP together with OFFSET, so complete the clause instead
+        return query + f" FETCH NEXT {MAX_ROWS} ROWS ONLY"
+
+    i = main_index + 1
+    if i < len(tokens) and tokens[i].lower in ("distinct", "all"):
+        i += 1
+    if i < len(tokens) and tokens[i].lower == "top":
+        count = tokens[i + 1] if i + 1 < len(tokens) else None
+        if count is not None and count.value == "(":
+            count = tokens[i + 2] if i + 2 < len(tokens) else None
+        following = [t.lower for t in tokens[i + 2:i + 4]]
+        if count is None or count.kind != "number" or "percent" in following:
+            result.row_limit_applied = False
+            return query
+        if float(count.value) > MAX_ROWS:
+            return query[:count.start] + str(MAX_ROWS) + query[count.end:]
+        return query
+    insert_at = tokens[i - 1].end
+    return query[:insert_at] + f" TOP {MAX_ROWS}" + query[insert_at:]
+
+
+def find_opening(tokens: list[Token], index: int) -> int:
+    """Index of the parenthesis opening the one closed at index (-1 if unbalanced)"""
+    depth = 0
+    for i in range(index, -1, -1):
+        if tokens[i].value == ")":
+            depth += 1
+        elif tokens[i].value == "(":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def is_select_alias(tokens: list[Token], index: int) -> bool:
+    """
+    Whether the identifier at index aliases the select-list expression it directly
+    follows without AS, e.g. SUM([Amount]) [Total], [Customer] "Name" or Region Area
+    """
+    if not tokens[index].is_identifier or tokens[index].lower in SQL_KEYWORDS or index == 0:
+        return False
+    following = tokens[index + 1] if index + 1 < len(tokens) else None
+    if following is not None and following.value != "," and following.lower != "from":
+        return False
+    previous = tokens[index - 1]
+    if previous.value == ")":
+        # TOP (n) [Column] is the first column, not an alias
+        opening = find_opening(tokens, index - 1)
+        return opening > 0 and tokens[opening - 1].lower != "top"
+    if previous.kind in ("number", "string"):
+        return not (index > 1 and tokens[index - 2].lower == "top")
+    return previous.is_identifier and (previous.lower == "end" or previous.lower not in SQL_KEYWORDS)
+
+
+def find_bare_columns(tokens: list[Token]) -> list[int]:
+    """
+    Indexes of the unqualified words used as columns in the select list and in the
+    WHERE, ON, HAVING, GROUP BY and ORDER BY clauses: keywords, function names, qualifiers
+    (x in x.Column) and variables are skipped, as are the table references of FROM/JOIN.
+    """
+    indexes = []
+    clause = None
+    outer_clauses = []
+    for i, token in enumerate(tokens):
+        if token.value == "(":
+            outer_clauses.append(clause)
+            continue
+        if token.value == ")":
+            clause = outer_clauses.pop() if outer_clauses else None
+            continue
+        if token.kind != "word":
+            continue
+        if token.lower in SQL_KEYWORDS:
+            if token.lower in COLUMN_CLAUSES:
+                clause = COLUMN_CLAUSES[token.lower]
+            elif token.lower in CLAUSE_ENDS:
+                clause = None
+            continue
+        if clause is None or token.value.startswith(("@", "#")):
+            continue
+        if i > 0 and tokens[i - 1].value == ".":
+            continue  # qualified, checked with the bracketed identifiers
+        following = tokens[i + 1].value if i + 1 < len(tokens) else None
+        if following in (".", "("):
+            continue
+        if i > 1 and tokens[i - 1].value == "(" and tokens[i - 2].lower in KEYWORD_ARGUMENT_FUNCTIONS:
+            continue
+        indexes.append(i)
+    return indexes
+
+
+def check_columns(tokens: list[Token], view_name: str, catalog_tables: dict, cte_names: set,
+                  cte_columns: set, result: VerificationResult):
+    """
+    Check the column references (bare, bracketed and qualified identifiers) against the
+    columns of the views the query reads, which must be views of the datasource.
+    catalog_tables maps lowercased view names of the datasource to their definitions.
+    """
+    tables = {view_name.lower()}
+    read_tables = set()
+    aliases = set(cte_names) | cte_columns
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1].lower if i > 0 else ""
+        if (previous == "as" and token.is_identifier) or is_select_alias(tokens, i):
+            aliases.add(token.name)
+        if previous in TABLE_KEYWORDS and token.is_identifier:
+            # [dbo].[View] or View, optionally followed by an alias
+            j = i
+            if j + 2 < len(tokens) and tokens[j + 1].value == ".":
+                j += 2
+            table = tokens[j].name
+            if table not in cte_names:
+                if table not in catalog_tables:
+                    result.errors.append(f"View '{tokens[j].value}' does not exist in this datasource.")
+                tables.add(table)
+                read_tables.add(table)
+            alias = tokens[j + 1] if j + 1 < len(tokens) else None
+            if alias is not None and alias.is_identifier and alias.lower not in CLAUSE_KEYWORDS:
+                aliases.add(alias.name)
+    if not read_tables:
+        result.errors.append(f"The query must read from a view of this datasource, e.g. [dbo].[{view_name}].")
+        return
+
+    columns = set()
+    for table in tables:
+        columns.update(c["name"].lower() for c in catalog_tables.get(table, {}).get("columns", []))
+    known = columns | aliases | tables | {"dbo"}
+
+    bare_columns = set(find_bare_columns(tokens))
+    unknown = []
+    for i, token in enumerate(tokens):
+        qualified = i > 0 and tokens[i - 1].value == "."
+        if not (token.kind in ("bracket", "quoted") or (qualified and token.kind == "word") or i in bare_columns):
+            continue
+        if qualified and i > 1 and tokens[i - 2].name == "dbo":
+            continue  # a view name, checked above
+        if token.name not in known and token.value not in unknown:
+            unknown.append(token.value)
+    if unknown:
+        result.errors.append(
+            f"Unknown column(s) {', '.join(unknown)}. These columns exist in [dbo].[{view_name}]: "
+            + " | ".join(c["name"] for c in catalog_tables.get(view_name.lower(), {}).get("columns", []))
+        )
+
+
+def verify_query(query: str, view_name: str, catalog_tables: dict = None) -> VerificationResult:
+    """
+    Verify a T-SQL query without a model call: it must be a single read-only SELECT,
+    its rows are capped to MAX_ROWS and its columns must exist in the schema catalog.
+
+    Args:
+        query (str): The query written by the model
+        view_name (str): The view the query is meant to run on
+        catalog_tables (dict): Lowercased view name -> view definition for the datasource,
+            or None to skip the column check
+
+    Returns:
+        VerificationResult: The (possibly rewritten) query and any errors
+    """
+    query = query.strip().rstrip(";").strip()
+    result = VerificationResult(query=query)
+    tokens = tokenize(query)
+    if not tokens:
+        result.read_only = False
+        result.errors.append("The query is empty.")
+        return result
+
+    check_read_only(tokens, result)
+    if not result.read_only:
+        return result
+
+    cte_names, cte_columns = set(), set()
+    main_index = skip_ctes(tokens, cte_names, cte_columns) if tokens[0].lower == "with" else 0
+
+    if catalog_tables is not None:
+        check_columns(tokens, view_name, catalog_tables, cte_names, cte_columns, result)
+    if result.errors:
+        return result
+
+    if main_index < len(tokens) and tokens[main_index].lower == "select":
+        result.query = apply_row_limit(query, tokens, main_index, result)
+    else:
+        # e.g. a parenthesized statement
+        result.row_limit_applied = False
+    return result
+
+
+def is_literal(tokens: list[Token], index: int) -> bool:
+    """
+    Strings and numbers are literals, except row counts after TOP and FETCH NEXT/FIRST:
+    the row limit rewrite depends on those, so they stay part of the fingerprint.
+    """
+    token = tokens[index]
+    if token.kind == "string":
+        return True
+    if token.kind != "number":
+        return False
+    previous = [t.lower for t in tokens[max(0, index - 2):index]]
+    if previous[-1:] == ["top"] or previous == ["top", "("]:
+        return False
+    return previous[-1:] not in (["next"], ["first"])
+
+
+def fingerprint(query: str) -> tuple[str, list[str]]:
+    """
+    Normalize a query for caching: whitespace, comments and casing are dropped and
+    literals replaced by '?'.
+
+    Returns:
+        tuple: The fingerprint and the literals in order of appearance
+    """
+    tokens = tokenize(query.strip().rstrip(";"))
+    parts, literals = [], []
+    for index, token in enumerate(tokens):
+        if is_literal(tokens, index):
+            parts.append("?")
+            literals.append(token.value)
+        else:
+            parts.append(token.lower)
+    return " ".join(parts), literals
+
+
+def normalize(query: str) -> str:
+    """Normalize whitespace, comments and casing of a query, keeping its literals"""
+    tokens = tokenize(query.strip().rstrip(";"))
+    return " ".join(token.value if token.kind == "string" else token.lower for token in tokens)
+
+
+def split_literals(query: str) -> tuple[list[str], list[str]]:
+    """Split a query into the text around its literals and the literals themselves"""
+    tokens = tokenize(query)
+    texts, literals = [], []
+    position = 0
+    for index, token in enumerate(tokens):
+        if is_literal(tokens, index):
+            texts.append(query[position:token.start])
+            literals.append(token.value)
+            position = token.end
+    texts.append(query[position:])
+    return texts, literals
+
+
+class VerificationCache:
+    """
+    Bounded LRU/TTL cache of verification results, keyed by the datasource, the view,
+    the schema catalog version and the query fingerprint.
+
+    Queries that differ only in whitespace, casing or literals share an entry: the
+    verified query is stored with its literals cut out and filled back in with the
+    literals of the query being verified.
+    """
+
+    def __init__(self, maxsize: int = SQL_VERIFICATION_CACHE_SIZE, ttl: float = SQL_VERIFICATION_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def get_key(datasource: str, view_name: str, schema_version: int, query: str):
+        query_fingerprint, literals = fingerprint(query)
+        return (datasource, view_name.lower(), schema_version, query_fingerprint), literals
+
+    def get(self, datasource: str, view_name: str, schema_version: int, query: str) -> VerificationResult:
+        """Get the cached result for an equivalent query, rebuilt with this query's literals, or None"""
+        key, literals = self.get_key(datasource, view_name, schema_version, query)
+        with self._lock:
+            entry = self._cache.get(key)
+            self._stats["hits" if entry else "misses"] += 1
+        if entry is None:
+            return None
+        result, texts = entry
+        if texts is None:
+            return replace(result, query=query, errors=list(result.errors))
+        query = texts[0] + "".join(literal + text for literal, text in zip(literals, texts[1:]))
+        return replace(result, query=query, errors=list(result.errors))
+
+    def put(self, datasource: str, view_name: str, schema_version: int, query: str, result: VerificationResult):
+        key, literals = self.get_key(datasource, view_name, schema_version, query)
+        texts, result_literals = split_literals(result.query)
+        if result_literals != literals:
+            # e.g. a query rewritten by the model: only cache the verdict of a rejected query
+            if not result.errors:
+                return
+            texts = None
+        with self._lock:
+            self._cache[key] = (result, texts)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._cache)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        return stats
+
+
+_verification_cache = None
+_verification_cache_lock = threading.Lock()
+
+
+def get_verification_cache() -> VerificationCache:
+    """Get the process-wide verification cache"""
+    global _verification_cache
+    with _verification_cache_lock:
+        if _verification_cache is None:
+            _verification_cache = VerificationCache()
+        return _verification_cache
@@ -0,0 +1,129 @@
+from azure.identity import ClientSecretCredential, DefaultAzureCredential
+import os
+import struct
+import threading
+import time
+
+
+# Scope of access tokens for Azure SQL / Fabric SQL endpoints
+SQL_TOKEN_SCOPE = "https://database.windows.net/.default"
+# pyodbc connection attribute taking a pre-acquired access token
+SQL_COPT_SS_ACCESS_TOKEN = 1256
+# Tokens are refreshed in the background once they expire within this margin
+TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# Below this remaining lifetime a token is refreshed before it is handed out
+TOKEN_MIN_VALID_SECONDS = 60
+
+
+class AccessTokenProvider:
+    """
+    Access tokens of one service principal (tenant/client), cached until shortly
+    before they expire.
+
+    A token close to expiry is refreshed in the background while the current one is
+    still handed out, so connections only wait for AAD on the first call or after
+    the token has (nearly) expired. Without a client secret, DefaultAzureCredential
+    is used (e.g. a managed identity).
+    """
+
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str = None, scope: str = SQL_TOKEN_SCOPE,
+                 refresh_margin: float = TOKEN_REFRESH_MARGIN_SECONDS):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        if client_secret:
+            self.credential = ClientSecretCredential(tenant_id, client_id, client_secret)
+        else:
+            self.credential = DefaultAzureCredential()
+        self._token = None
+        self._expires_on = 0.0
+        self._lock = threading.Lock()
+        # Reentrant: get_token holds it while calling refresh
+        self._refresh_lock = threading.RLock()
+        self._background_refresh = False
+        self._stats = {"refreshes": 0, "background_refreshes": 0, "failures": 0, "refresh_ms": 0.0, "max_refresh_ms": 0.0}
+
+    def refresh(self) -> str:
+        """Acquire a new token from AAD"""
+        with self._refresh_lock:
+            start_time = time.monotonic()
+            try:
+                access_token = self.credential.get_token(self.scope)
+            except Exception:
+                with self._lock:
+                    self._stats["failures"] += 1
+                raise
+            refresh_ms = (time.monotonic() - start_time) * 1000
+            with self._lock:
+                self._token = access_token.token
+                self._expires_on = float(access_token.expires_on)
+                self._stats["refreshes"] += 1
+                self._stats["refresh_ms"] += refresh_ms
+                self._stats["max_refresh_ms"] = max(self._stats["max_refresh_ms"], refresh_ms)
+                return self._token
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Background refresh of the access token for client {self.client_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._background_refresh = False
+
+    def get_token(self) -> str:
+        """Get a valid access token, refreshing it if needed"""
+        with self._lock:
+            token = self._token
+            remaining = self._expires_on - time.time()
+            start_refresh = token is not None and TOKEN_MIN_VALID_SECONDS < remaining < self.refresh_margin \
+                and not self._background_refresh
+            if start_refresh:
+                self._background_refresh = True
+                self._stats["background_refreshes"] += 1
+        if token is None or remaining <= TOKEN_MIN_VALID_SECONDS:
+            with self._refresh_lock:
+                # Another thread may have refreshed it while this one waited
+                with self._lock:
+                    if self._token is not None and self._expires_on - time.time() > TOKEN_MIN_VALID_SECONDS:
+                        return self._token
+                return self.refresh()
+        if start_refresh:
+            threading.Thread(target=self._refresh_in_background, name="token-refresh", daemon=True).start()
+        return token
+
+    def get_token_struct(self) -> bytes:
+        """Get the token in the form the ODBC driver expects for SQL_COPT_SS_ACCESS_TOKEN"""
+        token = self.get_token().encode("utf-16-le")
+        return struct.pack(f"<I{len(token)}s", len(token), token)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            expires_in = self._expires_on - time.time() if self._token else None
+        stats["avg_refresh_ms"] = round(stats["refresh_ms"] / stats["refreshes"], 1) if stats["refreshes"] else 0.0
+        stats["refresh_ms"] = round(stats["refresh_ms"], 1)
+        stats["max_refresh_ms"] = round(stats["max_refresh_ms"], 1)
+        stats["expires_in_seconds"] = round(expires_in) if expires_in is not None else None
+        return stats
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(tenant_id: str, client_id: str, client_secret: str = None) -> AccessTokenProvider:
+    """Get (or lazily create) the process-wide token provider of a tenant/client"""
+    key = (tenant_id, client_id)
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = AccessTokenProvider(tenant_id, client_id, client_secret)
+        return _providers[key]
+
+
+def get_token_provider_stats() -> dict:
+    """Get the refresh counts and latencies of every token provider"""
+    with _providers_lock:
+        providers = list(_providers.values())
+    return {f"{provider.tenant_id}/{provider.client_id}": provider.get_stats() for provider in providers}
@@ -0,0 +1,134 @@
+import bisect
+import json
+import threading
+import time
+from .function import Function
+from .circuit_breaker import CircuitOpenError
+
+
+class ToolArgumentError(Exception):
+    """Raised when the arguments of a tool call don't match the tool's parameters"""
+
+
+class ToolRegistry:
+    """
+    Name -> Function map with precomputed tool specs, shared across runs.
+
+    The JSON schemas sent to the model are generated once when the registry is
+    built, arguments are validated once per call, and per-tool call counts and
+    latency histograms are collected for metrics.
+    """
+
+    # Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+    LATENCY_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self, functions: list[Function]):
+        self._functions = {f.name: f for f in functions}
+        self._specs = {f.name: f.to_dict() for f in functions}
+        self._required = {
+            f.name: [p.name for p in f.parameters or [] if p.required]
+            for f in functions
+        }
+        self.tools = [
+            {"type": "function", "function": spec} for spec in self._specs.values()
+        ]
+        self._stats_lock = threading.Lock()
+        self._stats = {name: self._empty_stats() for name in self._functions}
+
+    def _empty_stats(self):
+        return {
+            "calls": 0,
+            "errors": 0,
+            "total_ms": 0.0,
+            "histogram": [0] * (len(self.LATENCY_BUCKETS_MS) + 1),
+        }
+
+    @property
+    def functions(self) -> list[Function]:
+        return list(self._functions.values())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._functions
+
+    def get(self, name: str) -> Function:
+        return self._functions.get(name)
+
+    def get_spec(self, name: str) -> dict:
+        return self._specs.get(name)
+
+    def parse_arguments(self, name: str, raw_arguments: str) -> dict:
+        """
+        Decode and validate the raw JSON arguments of a tool call.
+
+        Raises:
+            ToolArgumentError: If the arguments are not valid for the tool
+        """
+        function = self._functions[name]
+        try:
+            arguments = json.loads(raw_arguments) if raw_arguments else {}
+        except json.JSONDecodeError as e:
+            raise ToolArgumentError(f"Invalid JSON arguments: {e}")
+        if not isinstance(arguments, dict):
+            raise ToolArgumentError("Arguments must be a JSON object")
+
+        if function.parameters is None:
+            if arguments:
+                raise ToolArgumentError("Unexpected parameters")
+            return arguments
+        if not arguments and self._required[name]:
+            raise ToolArgumentError("Missing parameters")
+        for parameter_name in self._required[name]:
+            if parameter_name not in arguments:
+                raise ToolArgumentError(f"Missing parameter {parameter_name}")
+        return arguments
+
+    def invoke(self, name: str, arguments: dict):
+        """
+        Run an already validated tool call, catching exceptions like
+        Function.run_catch_exceptions does.
+
+        Returns:
+            tuple: (response, latency_ms)
+        """
+        function = self._functions[name]
+        error = False
+        start_time = time.perf_counter()
+        try:
+            response = function.function(**arguments)
+        except CircuitOpenError:
+            # A dependency is down: fail the whole request (retryable) instead of the tool call
+            self.record(name, (time.perf_counter() - start_time) * 1000, error=True)
+            raise
+        except Exception as e:
+            error = True
+            response = str(e)
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        self.record(name, latency_ms, error=error)
+        return response, latency_ms
+
+    def record(self, name: str, latency_ms: float, error: bool = False):
+        """Record a call of a tool in its counters and latency histogram"""
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS_MS, latency_ms)
+        with self._stats_lock:
+            stats = self._stats.setdefault(name, self._empty_stats())
+            stats["calls"] += 1
+            stats["total_ms"] += latency_ms
+            stats["histogram"][bucket] += 1
+            if error:
+                stats["errors"] += 1
+
+    def get_stats(self) -> dict:
+        """Get a snapshot of per-tool call counts and latency histograms"""
+        labels = [f"le_{bound}ms" for bound in self.LATENCY_BUCKETS_MS] + ["inf"]
+        with self._stats_lock:
+            return {
+                name: {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["calls"], 1)
+                    if stats["calls"]
+                    else 0.0,
+                    "histogram": dict(zip(labels, stats["histogram"])),
+                }
+                for name, stats in self._stats.items()
+            }
@@ -2,24 +2,35 @@
 import pyodbc
 import os
 from .function import Function, Property
-from .config import FabricConfig 
+from .config import get_datasource_registry
+from .usage import record_usage
+from .rate_limiter import estimate_tokens
+from .load_balancer import get_load_balancer
+from .circuit_breaker import get_circuit_breaker
+from .connection_pool import get_connection_pool
+from .token_provider import SQL_COPT_SS_ACCESS_TOKEN, get_token_provider
+from .schema_catalog import format_schema, get_schema_catalog
+from .sql_verifier import MAX_ROWS, get_verification_cache, verify_query
+from .result_cache import get_result_cache
+from .distinct_values import get_distinct_value_store
+from .value_index import get_value_index
 import chromadb
-import json
-from openai import AzureOpenAI
 import instructor
 from pydantic import BaseModel
+from dataclasses import replace
+
+# Ask the model to verify queries whose row limit the local verifier cannot rewrite
+# (e.g. UNION); otherwise those are capped to MAX_ROWS when the rows are fetched
+SQL_VERIFIER_LLM_FALLBACK = os.getenv("SQL_VERIFIER_LLM_FALLBACK", "false").lower() == "true"
+# Connect with cached AAD access tokens instead of letting the driver authenticate the
+# service principal on every connection
+FABRIC_ACCESS_TOKEN_AUTH = os.getenv("FABRIC_ACCESS_TOKEN_AUTH", "true").lower() == "true"
 
 class VerifiedQuery(BaseModel):
     correctedQuery: str
     read_only: bool
 
 def verifyQuery(query, schema):
-    client = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
-    )       
-
     system_prompt = """
     You are an SQL verification assistant. 
     You are given an SQL query and a schema of a database table. You focus on Fabric SQL databases syntax and semantics.
@@ -35,27 +46,131 @@ def verifyQuery(query, schema):
     {query}
     """.format(schema=schema, query=query)
 
-    client = instructor.from_openai(client)
-
     system_message = {"role": "system", "content": 
                         system_prompt}
     
     
-    response = client.chat.completions.create(
-        model=os.getenv("AZURE_OPENAI_MODEL_GPTMINI"),
-        response_model=VerifiedQuery,
-        messages=[system_message,{"role": "user", "content": prompt}],
-        max_tokens=200,
+    model = os.getenv("AZURE_OPENAI_MODEL_GPTMINI")
+    messages = [system_message, {"role": "user", "content": prompt}]
+    response, completion = get_load_balancer().call(
+        model,
+        lambda client, deployment: instructor.from_openai(client).chat.completions.create_with_completion(
+            model=deployment,
+            response_model=VerifiedQuery,
+            messages=messages,
+            max_tokens=200,
+        ),
+        estimated_tokens=estimate_tokens(messages, completion_tokens=200),
+        get_usage=lambda result: result[1].usage,
     )
+    record_usage("verify_query", model, completion.usage)
 
     return response
 
+def render_schema_catalog():
+    """
+    Renders every view schema in nl2sql/tables into one string, in a stable order
+    (datasource, then view) so it can be part of a cacheable prompt prefix.
+    """
+    return get_schema_catalog().render()
+
+def check_query(datasource, view_name, query, schema):
+    """
+    Verifies a query with the local verifier (and the model fallback, if enabled).
+    Results are cached by query fingerprint and schema version, so repeated queries
+    skip the verification.
+    """
+    catalog = get_schema_catalog()
+    cache = get_verification_cache()
+    schema_version = catalog.version
+    verified_query = cache.get(datasource, view_name, schema_version, query)
+    if verified_query is not None:
+        return verified_query
+
+    catalog_tables = {
+        table["table"].lower(): table
+        for table in catalog.get_tables()
+        if table.get("datasource") == datasource
+    }
+    verified_query = verify_query(query, view_name, catalog_tables)
+    if verified_query.read_only and not verified_query.errors \
+            and not verified_query.row_limit_applied and SQL_VERIFIER_LLM_FALLBACK:
+        llm_verified_query = verifyQuery(query, schema)
+        verified_query = replace(
+            verified_query,
+            query=llm_verified_query.correctedQuery,
+            read_only=llm_verified_query.read_only,
+        )
+    cache.put(datasource, view_name, schema_version, query, verified_query)
+    return verified_query
+
 def get_connection_string(datasource_id):
     """
-    Initializes FabricConfig for the given datasource_id and retrieves the connection string.
+    Retrieves the connection string of the given datasource_id (cached by the datasource registry).
+    """
+    return get_datasource_registry().get_config(datasource_id).connection_string
+
+def is_fabric_failure(error):
+    """Connection failures and timeouts count against Fabric; errors in the query itself don't"""
+    return isinstance(error, pyodbc.Error) and not isinstance(
+        error, (pyodbc.ProgrammingError, pyodbc.DataError, pyodbc.IntegrityError)
+    )
+
+def validate_connection(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+def connect(datasource_id):
+    """
+    Opens a connection to a Fabric datasource, in autocommit mode so it holds no
+    transaction between queries.
+    """
+    if not FABRIC_ACCESS_TOKEN_AUTH:
+        return pyodbc.connect(get_connection_string(datasource_id), autocommit=True)
+    config = get_datasource_registry().get_config(datasource_id)
+    token_provider = get_token_provider(config.tenant_id, config.client_id, config.client_secret)
+    return pyodbc.connect(
+        config.token_connection_string,
+        attrs_before={SQL_COPT_SS_ACCESS_TOKEN: token_provider.get_token_struct()},
+        autocommit=True,
+    )
+
+def get_fabric_pool(datasource):
+    """
+    Gets the connection pool of a Fabric datasource.
+    """
+    return get_connection_pool(datasource, lambda: connect(datasource), validate_connection)
+
+def execute_query(datasource, query, max_rows=None):
+    """
+    Runs a query on a Fabric datasource through the Fabric circuit breaker, on a
+    pooled connection. Returns the column names and the rows (at most max_rows, if given).
+    """
+    with get_circuit_breaker("fabric").guard(is_fabric_failure):
+        # A connection that failed (rather than the query) is not reused
+        with get_fabric_pool(datasource).connection(discard_on=is_fabric_failure) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query)
+                rows = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
+                colnames = [desc[0] for desc in cursor.description]
+                return colnames, rows
+            finally:
+                cursor.close()
+
+def start_value_stores():
+    """
+    Start precomputing the values of the categorical columns and building the value
+    indexes of the searchable ones in the background. Called once at processor startup
+    rather than when the tools are built, so building a tool registry never queries Fabric.
     """
-    config = FabricConfig(datasource_id)
-    return config.connection_string
+    get_distinct_value_store().start(execute_query)
+    get_value_index().start(execute_query)
+
 
 class GetDBSchema(Function):
     def __init__(self):
@@ -81,36 +196,17 @@ class GetDBSchema(Function):
         """
         Formats the schema content into a structured string.
         """
-        schema_info = f"Table Name: {table_data['table']}\n"
-        schema_info += f"Description: {table_data['description']}\n"
-        schema_info += f"Datasource: {table_data['datasource']}\n\nColumns:\n"
-
-        for column in table_data.get("columns", []):
-            col_name = column.get("name", "Unknown")
-            col_desc = column.get("description", "No description available.")
-            col_type = column.get("type", "Unknown type")
-            schema_info += f"- {col_name} ({col_type}): {col_desc}\n"
-
-        return schema_info
+        return format_schema(table_data)
     
     def function(self, view_name, datasource):
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
-        tables_folder = os.path.join(base_dir, "nl2sql/tables")
-        if not os.path.exists(tables_folder):
-            return f"Error: The tables directory '{tables_folder}' does not exist. It's not possible to get the schema."
-        for filename in os.listdir(tables_folder):
-            if filename.endswith(".json"):
-                file_path = os.path.join(tables_folder, filename)
-                try:
-                    with open(file_path, "r", encoding="utf-8") as file:
-                        table_data = json.load(file)
-
-                    # Check if table matches the requested view_name and datasource
-                    if table_data.get("table") == view_name and table_data.get("datasource") == datasource:
-                        return self.format_schema(table_data)
-
-                except json.JSONDecodeError:
-                    return f"Error: Failed to parse JSON file '{filename}'."
+        catalog = get_schema_catalog()
+        if not catalog.exists():
+            return f"Error: The tables directory '{catalog.tables_folder}' does not exist. It's not possible to get the schema."
+        schema = catalog.get_schema(datasource, view_name)
+        if schema is not None:
+            return schema
+        if catalog.errors:
+            return f"Error: Failed to parse JSON file '{next(iter(catalog.errors))}'."
 
         return f"Error: No schema found for view '{view_name}' with datasource '{datasource}'."
     
@@ -142,12 +238,14 @@ class ListViews(Function):
         chroma_db_path = os.path.join(base_dir, "chromadb")
         chroma_client = chromadb.PersistentClient(path=chroma_db_path)
         collection = chroma_client.get_or_create_collection(name="nl2sql-tables")
-        client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
-        )  
-        query_embedding =  client.embeddings.create(input= query_text,model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME")).data[0].embedding
+        embedding_model = os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME")
+        embedding_response = get_load_balancer().call(
+            embedding_model,
+            lambda client, deployment: client.embeddings.create(input=query_text, model=deployment),
+            estimated_tokens=estimate_tokens(query_text),
+        )
+        record_usage("embedding", embedding_model, embedding_response.usage)
+        query_embedding = embedding_response.data[0].embedding
         results = collection.query(
             query_embeddings=[query_embedding],
             n_results=3,
@@ -204,15 +302,26 @@ class FetchDistinctValues(Function):
             ],
         )
 
+    def format_values(self, colnames, rows):
+        result = " | ".join(colnames) + "\n"
+        for row in rows:
+            result += " | ".join(map(str, row)) + "\n"
+        return result
+
     def function(self, datasource, view_name, column_name):
         """
         Retrieves the top 10 most frequent distinct values in `column_name` from the specified dbo view,
         along with a count of how many times each appears.
         """
-        try:
-            conn = pyodbc.connect(get_connection_string(datasource))
-            cursor = conn.cursor()
+        store = get_distinct_value_store()
+        if store.enabled:
+            values = store.get(datasource, view_name, column_name)
+            if values is not None:
+                if not values["rows"]:
+                    return "No rows found."
+                return self.format_values(values["columns"], values["rows"])
 
+        try:
             # T-SQL uses TOP instead of LIMIT
             # We'll group by column_name, order by the count desc, and take top 10
             query = f"""
@@ -228,23 +337,13 @@ class FetchDistinctValues(Function):
             #   GROUP BY ...
             #   ORDER BY qty DESC
 
-            cursor.execute(query)
-            rows = cursor.fetchall()
-
-            # Build column headers from cursor.description
-            colnames = [desc[0] for desc in cursor.description]
-
-            cursor.close()
-            conn.close()
+            colnames, rows = execute_query(datasource, query)
 
             # Format the output
             if not rows:
                 return "No rows found."
 
-            result = " | ".join(colnames) + "\n"
-            for row in rows:
-                result += " | ".join(map(str, row)) + "\n"
-            return result
+            return self.format_values(colnames, rows)
 
         except pyodbc.Error as e:
             # Let's check if the error message indicates invalid column or invalid object
@@ -256,12 +355,7 @@ class FetchDistinctValues(Function):
             if "Invalid column name" in error_msg or "207" in error_msg:
                 # Return existing columns in the view
                 try:
-                    conn2 = pyodbc.connect(get_connection_string(datasource))
-                    cursor2 = conn2.cursor()
-                    cursor2.execute(f"SELECT TOP 1 * FROM [dbo].[{view_name}]")
-                    colnames = [desc[0] for desc in cursor2.description]
-                    cursor2.close()
-                    conn2.close()
+                    colnames, _ = execute_query(datasource, f"SELECT TOP 1 * FROM [dbo].[{view_name}]")
                     return (
                         f"The column '{column_name}' does not exist in [dbo].[{view_name}]. "
                         + "The following columns exist:\n"
@@ -274,6 +368,63 @@ class FetchDistinctValues(Function):
             else:
                 return f"Error fetching distinct values: {e}"
             
+class FetchSimilarValues(Function):
+    def __init__(self):
+        super().__init__(
+            name="fetch_similar_values",
+            description="Fetch the values of a name column (e.g. customer, vendor, department) of a dbo view that best match a loosely typed value",
+            parameters=[
+                Property(
+                    name="datasource",
+                    description="The datasource of the view",
+                    type="string",
+                    required=True,
+                ),
+                Property(
+                    name="view_name",
+                    description="The dbo view name",
+                    type="string",
+                    required=True,
+                ),
+                Property(
+                    name="column_name",
+                    description="The column name to match the value against",
+                    type="string",
+                    required=True,
+                ),
+                Property(
+                    name="value",
+                    description="The value as the user wrote it",
+                    type="string",
+                    required=True,
+                ),
+            ],
+        )
+
+    def function(self, datasource, view_name, column_name, value):
+        """
+        Returns the closest values of `column_name` with their similarity score (0 to 1),
+        from the in-memory value index (no query is run on Fabric).
+        """
+        value_index = get_value_index()
+        matches = value_index.search(datasource, view_name, column_name, value) if value_index.enabled else None
+        if matches is None:
+            indexed_columns = value_index.get_indexed_columns(datasource, view_name) if value_index.enabled else []
+            if column_name.lower() in (column.lower() for column in indexed_columns):
+                return f"The values of '{column_name}' are still being indexed. Use fetch_distinct_values instead."
+            if indexed_columns:
+                return (
+                    f"The column '{column_name}' can't be searched. These columns of [dbo].[{view_name}] can: "
+                    + " | ".join(indexed_columns)
+                )
+            return f"No column of [dbo].[{view_name}] can be searched. Use fetch_distinct_values instead."
+        if not matches:
+            return f"No similar values found for {value} in {column_name} for view {view_name}."
+
+        result = f"{column_name} | similarity_score\n"
+        result += "\n".join(f"{match} | {score}" for match, score in matches)
+        return result
+
 class RunSQLQuery(Function):
     def __init__(self):
         super().__init__(
@@ -304,60 +455,40 @@ class RunSQLQuery(Function):
         """
         Formats the schema content into a structured string.
         """
-        schema_info = f"Table Name: {table_data['table']}\n"
-        schema_info += f"Description: {table_data['description']}\n"
-        schema_info += f"Datasource: {table_data['datasource']}\n\nColumns:\n"
-
-        for column in table_data.get("columns", []):
-            col_name = column.get("name", "Unknown")
-            col_desc = column.get("description", "No description available.")
-            col_type = column.get("type", "Unknown type")
-            schema_info += f"- {col_name} ({col_type}): {col_desc}\n"
-
-        return schema_info
+        return format_schema(table_data)
     def function(self,datasource, view_name, query):
         """
         Executes a SQL query and returns rows.
         """
         try:
-            conn = pyodbc.connect(get_connection_string(datasource))
-            cursor = conn.cursor()
-
             # get schema
-            schema = ""
-            base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
-            tables_folder = os.path.join(base_dir, "nl2sql/tables")
-            if not os.path.exists(tables_folder):
-                return f"Error: The tables directory '{tables_folder}' does not exist. It's not possible to get the schema. The table name is incorrect."
-            for filename in os.listdir(tables_folder):
-                if filename.endswith(".json"):
-                    file_path = os.path.join(tables_folder, filename)
-                    try:
-                        with open(file_path, "r", encoding="utf-8") as file:
-                            table_data = json.load(file)
-
-                        # Check if table matches the requested view_name and datasource
-                        if table_data.get("table") == view_name and table_data.get("datasource") == datasource:
-                            schema = self.format_schema(table_data)
-
-                    except json.JSONDecodeError:
-                        return f"Error: Failed to parse JSON file '{filename}'."
-            if schema == "":
+            catalog = get_schema_catalog()
+            if not catalog.exists():
+                return f"Error: The tables directory '{catalog.tables_folder}' does not exist. It's not possible to get the schema. The table name is incorrect."
+            schema = catalog.get_schema(datasource, view_name)
+            if schema is None:
                 return f"Error: No schema found for view '{view_name}' with datasource '{datasource}'."
 
             # verify query
-            verified_query = verifyQuery(query, schema)
-            print("Corrected Query: ", verified_query.correctedQuery)
+            verified_query = check_query(datasource, view_name, query, schema)
             if verified_query.read_only == False:
                 return "Error: The query is modifying the data. Please make sure the query is read-only."
-            cursor.execute(verified_query.correctedQuery)
-            results = cursor.fetchall()
-            conn.close()
+            if verified_query.errors:
+                return "Error: " + " ".join(verified_query.errors)
+            print("Corrected Query: ", verified_query.query)
+            result_cache = get_result_cache()
+            output = result_cache.get(datasource, verified_query.query)
+            if output is not None:
+                return output
+            generation = result_cache.get_generation(datasource)
+            _, results = execute_query(datasource, verified_query.query, max_rows=MAX_ROWS)
 
             if not results:
-                return "No rows returned."
-            
-            return "\n".join([str(result) for result in results])
+                output = "No rows returned."
+            else:
+                output = "\n".join([str(result) for result in results])
+            result_cache.put(datasource, view_name, verified_query.query, output, generation)
+            return output
 
         except pyodbc.Error as e:
             # For demonstration, handle two typical errors:
@@ -376,10 +507,7 @@ class RunSQLQuery(Function):
             if "Invalid column name" in error_msg or (error_code and "207" in error_code):
                 # Return which columns actually exist
                 try:
-                    conn = pyodbc.connect(get_connection_string(datasource))
-                    cursor = conn.cursor()
-                    cursor.execute(f"SELECT TOP 1 * FROM [dbo].[{view_name}]")
-                    colnames = [desc[0] for desc in cursor.description]
+                    colnames, _ = execute_query(datasource, f"SELECT TOP 1 * FROM [dbo].[{view_name}]")
                     return (
                         f"A column in your query doesn't exist.\n"
                         f"These columns exist in [dbo].[{view_name}]:\n"
@@ -387,8 +515,6 @@ class RunSQLQuery(Function):
                     )
                 except Exception as col_err:
                     return f"Failed to retrieve columns from view {view_name}: {col_err}"
-                finally:
-                    conn.close()
 
             # Return the error message if it's not one of the expected errors
             return f"Error running query: {e}"
@@ -1,8 +1,10 @@
 from .function import Function, Property
+from .usage import record_usage
+from .rate_limiter import estimate_tokens
+from .load_balancer import get_load_balancer
 from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.models import VectorizedQuery
-from openai import AzureOpenAI
 import os
 from dotenv import load_dotenv
 
@@ -24,17 +26,14 @@ class FetchSimilarQueries(Function):
         )
 
     def get_embedding(self, text) -> list:
-        aoai_client = AzureOpenAI(
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
-        )
         embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME")
-        return (
-            aoai_client.embeddings.create(input=text, model=embedding_deployment)
-            .data[0]
-            .embedding
+        response = get_load_balancer().call(
+            embedding_deployment,
+            lambda client, deployment: client.embeddings.create(input=text, model=deployment),
+            estimated_tokens=estimate_tokens(text),
         )
+        record_usage("embedding", embedding_deployment, response.usage)
+        return response.data[0].embedding
 
     def function(self, question):
         search_client = SearchClient(
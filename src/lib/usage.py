@@ -0,0 +1,104 @@
+import contextvars
+import threading
+import time
+
+
+# The ledger of the request being handled. Tool calls run on executor threads, so
+# they must be submitted with a copy of the caller's context (see execute_tool_calls).
+_current_ledger = contextvars.ContextVar("usage_ledger", default=None)
+
+
+class UsageLedger:
+    """
+    Records every model call made while handling one request: assistant runs
+    (including failed and retried ones), chat completions, query verification and
+    embedding calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries = []
+        self.datasources = set()
+
+    def record(self, kind: str, model: str = None, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cached_tokens: int = 0):
+        with self._lock:
+            self.entries.append(
+                {
+                    "kind": kind,
+                    "model": model,
+                    "prompt_tokens": prompt_tokens or 0,
+                    "completion_tokens": completion_tokens or 0,
+                    "cached_tokens": cached_tokens or 0,
+                    "timestamp": time.time(),
+                }
+            )
+
+    def note_datasource(self, datasource: str):
+        """Remember a datasource touched by the request, for per-datasource rollups"""
+        if datasource:
+            with self._lock:
+                self.datasources.add(datasource)
+
+    def totals(self) -> dict:
+        """Get the token totals of the request, overall and broken down by call kind and model"""
+        with self._lock:
+            entries = list(self.entries)
+            datasources = sorted(self.datasources)
+
+        def empty():
+            return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+        totals = empty()
+        by_kind = {}
+        by_model = {}
+        for entry in entries:
+            for bucket in (totals, by_kind.setdefault(entry["kind"], empty()),
+                           by_model.setdefault(entry["model"] or "unknown", empty())):
+                bucket["calls"] += 1
+                bucket["prompt_tokens"] += entry["prompt_tokens"]
+                bucket["completion_tokens"] += entry["completion_tokens"]
+                bucket["cached_tokens"] += entry["cached_tokens"]
+        totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+        totals["by_kind"] = by_kind
+        totals["by_model"] = by_model
+        totals["datasources"] = datasources
+        return totals
+
+
+def start_usage_ledger() -> UsageLedger:
+    """Start a new ledger for the request handled in the current context"""
+    ledger = UsageLedger()
+    _current_ledger.set(ledger)
+    return ledger
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Get the ledger of the current request, or None outside of a request"""
+    return _current_ledger.get()
+
+
+def record_usage(kind: str, model: str, usage):
+    """
+    Record the usage object of a model response in the current request's ledger.
+    Works with chat completion, run and embedding usage objects. Does nothing
+    outside of a request or when the response has no usage.
+    """
+    ledger = _current_ledger.get()
+    if ledger is None or usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    ledger.record(
+        kind,
+        model=model,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0),
+        completion_tokens=getattr(usage, "completion_tokens", 0),
+        cached_tokens=getattr(details, "cached_tokens", 0) if details else 0,
+    )
+
+
+def note_datasource(datasource: str):
+    """Remember a datasource touched by the current request"""
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.note_datasource(datasource)
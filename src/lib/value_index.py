@@ -0,0 +1,155 @@
+from collections import Counter
+from .distinct_values import DistinctValueStore, quote_name
+import os
+import re
+import threading
+import time
+import unicodedata
+
+
+# Distinct values indexed per column at most
+VALUE_INDEX_MAX_VALUES = int(os.getenv("VALUE_INDEX_MAX_VALUES", "50000"))
+# How often the indexes are rebuilt; 0 disables them
+VALUE_INDEX_REFRESH_SECONDS = float(os.getenv("VALUE_INDEX_REFRESH_SECONDS", "3600"))
+# Matches scoring below this are not returned
+VALUE_INDEX_MIN_SCORE = float(os.getenv("VALUE_INDEX_MIN_SCORE", "0.3"))
+
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_value(value: str) -> str:
+    """Lowercase, strip accents and turn punctuation into spaces"""
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(c for c in value if not unicodedata.combining(c)).lower()
+    return NON_ALPHANUMERIC.sub(" ", value).strip()
+
+
+def get_trigrams(value: str) -> set:
+    """Trigrams of each word padded like pg_trgm ("  w", " wo", "wor", "ord", "rd ")"""
+    trigrams = set()
+    for word in normalize_value(value).split():
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def build_distinct_column_query(view_name: str, column_name: str, max_values: int = VALUE_INDEX_MAX_VALUES) -> str:
+    column = quote_name(column_name)
+    return (
+        f"SELECT DISTINCT TOP {max_values} {column} "
+        f"FROM [dbo].{quote_name(view_name)} "
+        f"WHERE {column} IS NOT NULL"
+    )
+
+
+class TrigramIndex:
+    """
+    Inverted trigram index over the distinct values of one column.
+
+    A value scores the mean of its trigram similarity with the searched text (shared /
+    all trigrams, as pg_trgm's similarity) and the share of the searched text's
+    trigrams it contains, so "acme" finds "ACME Corporation Ltd" while closer values
+    still rank first.
+    """
+
+    def __init__(self, values: list):
+        self.values = []
+        self._trigram_counts = []
+        self._postings = {}
+        for value in dict.fromkeys(str(value) for value in values if value is not None):
+            trigrams = get_trigrams(value)
+            if not trigrams:
+                continue
+            value_id = len(self.values)
+            self.values.append(value)
+            self._trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                self._postings.setdefault(trigram, []).append(value_id)
+
+    def __len__(self):
+        return len(self.values)
+
+    def search(self, text: str, limit: int = 10, min_score: float = VALUE_INDEX_MIN_SCORE) -> list[tuple]:
+        """Get up to limit (value, score) pairs, best first"""
+        trigrams = get_trigrams(text)
+        if not trigrams:
+            return []
+        shared = Counter()
+        for trigram in trigrams:
+            postings = self._postings.get(trigram)
+            if postings:
+                shared.update(postings)
+        matches = []
+        for value_id, count in shared.items():
+            similarity = count / (len(trigrams) + self._trigram_counts[value_id] - count)
+            score = (similarity + count / len(trigrams)) / 2
+            if score >= min_score:
+                matches.append((score, value_id))
+        matches.sort(reverse=True)
+        return [(self.values[value_id], round(score, 3)) for score, value_id in matches[:limit]]
+
+
+class ValueIndex(DistinctValueStore):
+    """
+    Trigram indexes over the distinct values of the columns flagged "searchable": true
+    in nl2sql/tables (names users type loosely: customers, vendors, departments...),
+    rebuilt in the background every refresh_seconds. Searches never touch the warehouse.
+    """
+
+    name = "value index"
+    column_flag = "searchable"
+
+    def __init__(self, max_values: int = VALUE_INDEX_MAX_VALUES, refresh_seconds: float = VALUE_INDEX_REFRESH_SECONDS):
+        super().__init__(refresh_seconds=refresh_seconds)
+        self.max_values = max_values
+        self._stats["searches"] = 0
+        self._stats["search_ms"] = 0.0
+
+    def load_column(self, datasource: str, view_name: str, column_name: str) -> TrigramIndex:
+        _, rows = self.fetch(datasource, build_distinct_column_query(view_name, column_name, self.max_values))
+        return TrigramIndex([row[0] for row in rows])
+
+    def search(self, datasource: str, view_name: str, column_name: str, text: str, limit: int = 10) -> list[tuple]:
+        """
+        Get the (value, score) pairs of a column closest to text.
+
+        Returns:
+            list: The matches, or None if the column is not indexed (yet)
+        """
+        index = self.get(datasource, view_name, column_name)
+        if index is None:
+            return None
+        start_time = time.perf_counter()
+        matches = index.search(text, limit)
+        with self._lock:
+            self._stats["searches"] += 1
+            self._stats["search_ms"] += (time.perf_counter() - start_time) * 1000
+        return matches
+
+    def get_indexed_columns(self, datasource: str, view_name: str) -> list[str]:
+        """Get the searchable columns of a view"""
+        return [
+            column_name for column_datasource, column_view, column_name in self.get_columns(datasource)
+            if column_view.lower() == view_name.lower()
+        ]
+
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        with self._lock:
+            stats["values"] = sum(len(index) for index in self._values.values())
+        stats["avg_search_ms"] = round(stats["search_ms"] / stats["searches"], 3) if stats["searches"] else 0.0
+        stats["search_ms"] = round(stats["search_ms"], 1)
+        return stats
+
+
+_value_index = None
+_value_index_lock = threading.Lock()
+
+
+def get_value_index() -> ValueIndex:
+    """Get the process-wide value index"""
+    global _value_index
+    with _value_index_lock:
+        if _value_index is None:
+            _value_index = ValueIndex()
+        return _value_index
@@ -1,33 +1,58 @@
 import os
 from openai import AzureOpenAI
 import sys
+import json
+import hashlib
+import threading
 
 # Add the current directory to the path so lib can be found
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from lib.assistant import AIAssistant
+from lib.assistant import AIAssistant, ASSISTANT_TEMPERATURE
 import argparse
 from lib.tools_fabric import (
     GetDBSchema as FabricGetDBSchema,
     RunSQLQuery as FabricRunSQLQuery,
     FetchDistinctValues as FabricFetchDistinctValues,
+    FetchSimilarValues as FabricFetchSimilarValues,
     ListViews as FabricListViews,
+    render_schema_catalog as fabric_schema_catalog,
 )
 from lib.tools_search import FetchSimilarQueries
+from lib.tool_registry import ToolRegistry
+from lib.chat_engine import ChatCompletionsEngine
+from lib.router import QuestionRouter
+from lib.schema_catalog import get_schema_catalog
+
+
+# Tool registries are built once per database type and reused across runs
+_tool_registries = {}
+_tool_registries_lock = threading.Lock()
+# Chat completions engines are stateless and shared by all requests
+_chat_engines = {}
+_chat_engines_lock = threading.Lock()
+# Question routers are shared by all requests (they hold the routing metrics)
+_question_routers = {}
+_question_routers_lock = threading.Lock()
+# Put the full schema catalog in the chat engine's static (cacheable) prompt prefix
+CHAT_ENGINE_SCHEMA_PREFIX = os.getenv("CHAT_ENGINE_SCHEMA_PREFIX", "true").lower() == "true"
+
+ASSISTANT_NAME = "Insights HQ AI Assistant"
+ASSISTANT_DESCRIPTION = "Insights HQ AI Assistant"
 
 
 class SQLAssistant:
-    def __init__(self, functions, instructions_file_name, assistant_id=None):
-        self.functions = functions
-        self.tools = [
-            {"type": "function", "function": f.to_dict()} for f in self.functions
-        ]
-        self.tools.append({"type": "code_interpreter"})
+    def __init__(self, registry, instructions_file_name, assistant_id=None, load_assistant=True):
+        self.registry = registry
+        self.functions = registry.functions
+        self.tools = registry.tools + [{"type": "code_interpreter"}]
         self.client = self.create_client()
         self.instructions_file_name = instructions_file_name
         self.instructions = self.load_instructions()
         self.model = os.getenv("AZURE_OPENAI_API_DEPLOYMENT")
+        self.fingerprint = compute_assistant_fingerprint(self.get_config())
         self.assistant_id = assistant_id
-        self.assistant = self.create_assistant()
+        # Without load_assistant the instance only manages configuration (fingerprints, updates)
+        self.assistant = self.create_assistant() if load_assistant else None
 
     def create_client(self):
         return AzureOpenAI(
@@ -43,6 +68,26 @@ class SQLAssistant:
         with open(instructions_path) as file:
             return file.read()
 
+    def get_config(self):
+        """Get the assistant configuration that is sent to create/update calls"""
+        return {
+            "name": ASSISTANT_NAME,
+            "description": ASSISTANT_DESCRIPTION,
+            "instructions": self.instructions,
+            "model": self.model,
+            "tools": self.tools,
+            "temperature": ASSISTANT_TEMPERATURE,
+        }
+
+    def update_assistant(self, assistant_id):
+        """
+        Bring an existing assistant in line with the current configuration in place.
+
+        Args:
+            assistant_id (str): The ID of the assistant to update
+        """
+        self.client.beta.assistants.update(assistant_id, **self.get_config())
+
     def create_assistant(self):
         if self.assistant_id:
             # Load existing assistant if ID is provided
@@ -52,7 +97,7 @@ class SQLAssistant:
                 client=self.client,
                 verbose=True,
                 assistant_id=self.assistant_id,
-                functions=self.functions,
+                registry=self.registry,
             )
         else:
             # Create a new assistant
@@ -60,20 +105,64 @@ class SQLAssistant:
             return AIAssistant(
                 client=self.client,
                 verbose=True,
-                name="Insights HQ AI Assistant",
-                description="Insights HQ AI Assistant",
+                name=ASSISTANT_NAME,
+                description=ASSISTANT_DESCRIPTION,
                 instructions=self.instructions,
                 model=self.model,
                 tools=self.tools,
-                functions=self.functions,
+                registry=self.registry,
             )
 
     def chat(self):
         self.assistant.chat()
 
 
+def compute_assistant_fingerprint(config):
+    """
+    Compute a stable fingerprint of an assistant configuration (model, instructions, tools, temperature).
+
+    Args:
+        config (dict): The assistant configuration as returned by SQLAssistant.get_config
+
+    Returns:
+        str: A hex SHA-256 digest that changes whenever the configuration changes
+    """
+    payload = json.dumps(
+        {key: config[key] for key in ("model", "instructions", "tools", "temperature")},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_tool_registry(database_type):
+    """
+    Get the tool registry for the given database type, building it on first use.
+
+    Args:
+        database_type (str): The type of database to use ('fabric', 'postgresql', 'bigquery')
+
+    Returns:
+        ToolRegistry: The shared registry with the tools for that database type
+    """
+    with _tool_registries_lock:
+        if database_type not in _tool_registries:
+            if database_type == "fabric":
+                sql_functions = [
+                    FabricGetDBSchema(),
+                    FabricRunSQLQuery(),
+                    FabricFetchDistinctValues(),
+                    FabricFetchSimilarValues(),
+                    FabricListViews(),       
+                ]
+            else:
+                raise ValueError(f"Unsupported database type: {database_type}")
+            _tool_registries[database_type] = ToolRegistry(sql_functions)
+        return _tool_registries[database_type]
+
+
 # Create a method to initialize the assistant based on the database type
-def initialize_assistant(database_type, assistant_id=None):
+def initialize_assistant(database_type, assistant_id=None, load_assistant=True):
     """
     Initialize a SQLAssistant for the given database type.
     If assistant_id is provided, load the existing assistant instead of creating a new one.
@@ -81,22 +170,88 @@ def initialize_assistant(database_type, assistant_id=None):
     Args:
         database_type (str): The type of database to use ('fabric', 'postgresql', 'bigquery')
         assistant_id (str, optional): The ID of an existing assistant to load
+        load_assistant (bool): If False, don't create or retrieve any assistant; the instance
+            can still compute the configuration fingerprint and update existing assistants
         
     Returns:
         SQLAssistant: An initialized SQLAssistant instance
     """
     if database_type == "fabric":
-        sql_functions = [
-            FabricGetDBSchema(),
-            FabricRunSQLQuery(),
-            FabricFetchDistinctValues(),
-            FabricListViews(),       
-        ]
         instructions_file = "instructions_fabric.jinja2"
     else:
         raise ValueError(f"Unsupported database type: {database_type}")
 
-    return SQLAssistant(sql_functions, instructions_file, assistant_id)
+    return SQLAssistant(get_tool_registry(database_type), instructions_file, assistant_id, load_assistant)
+
+
+def initialize_chat_engine(database_type, model=None, allow_escalation=False):
+    """
+    Get the stateless chat completions engine for the given database type, building it on first use.
+    It runs the same tools as the assistant but needs no assistant, thread or run.
+    
+    Args:
+        database_type (str): The type of database to use ('fabric', 'postgresql', 'bigquery')
+        model (str, optional): Deployment to use instead of AZURE_OPENAI_API_DEPLOYMENT
+        allow_escalation (bool): Let the model hand questions it can't answer back to the caller
+        
+    Returns:
+        ChatCompletionsEngine: The shared engine for that database type, model and escalation setting
+    """
+    # The schema prefix is rendered into the engine, so it is rebuilt when the catalog changes
+    catalog_version = None
+    if CHAT_ENGINE_SCHEMA_PREFIX and database_type == "fabric":
+        catalog = get_schema_catalog()
+        catalog.refresh()
+        catalog_version = catalog.version
+    key = (database_type, model, allow_escalation, catalog_version)
+    with _chat_engines_lock:
+        if key not in _chat_engines:
+            for stale_key in [k for k in _chat_engines if k[:3] == key[:3]]:
+                del _chat_engines[stale_key]
+            manager = initialize_assistant(database_type, load_assistant=False)
+            static_context = None
+            if CHAT_ENGINE_SCHEMA_PREFIX and database_type == "fabric":
+                static_context = fabric_schema_catalog()
+            _chat_engines[key] = ChatCompletionsEngine(
+                model=model or manager.model,
+                instructions=manager.instructions,
+                registry=manager.registry,
+                verbose=True,
+                static_context=static_context,
+                allow_escalation=allow_escalation,
+            )
+        return _chat_engines[key]
+
+
+def initialize_question_router(database_type, model):
+    """
+    Get the question router for the given database type, building it on first use.
+    
+    Args:
+        database_type (str): The type of database to use ('fabric', 'postgresql', 'bigquery')
+        model (str): The cheap deployment used to classify questions and answer chit-chat
+        
+    Returns:
+        QuestionRouter: The shared router for that database type
+    """
+    with _question_routers_lock:
+        if database_type not in _question_routers:
+            manager = initialize_assistant(database_type, load_assistant=False)
+            _question_routers[database_type] = QuestionRouter(
+                model=model,
+                instructions=manager.instructions,
+            )
+        return _question_routers[database_type]
+
+
+def chat_with_engine(engine):
+    user_input = ""
+    while user_input != "bye" and user_input != "exit":
+        user_input = input("\033[32m Please, input your ask (or bye to exit) : ")
+        response = engine.create_response(question=user_input)
+        print(f"\033[33m{response['answer']}")
+        print(f"\033[33m{response['context']}")
+        print(f"\033[33m{response['total_tokens']}")
 
 
 # Main function
@@ -112,10 +267,19 @@ if __name__ == "__main__":
         "--assistant-id",
         help="ID of an existing assistant to load instead of creating a new one",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["assistants", "chat_completions"],
+        default="assistants",
+        help="Use the Assistants API or the stateless chat completions tool loop",
+    )
     args = parser.parse_args()
     
-    sql_assistant = initialize_assistant(
-        args.database, 
-        assistant_id=args.assistant_id
-    )
-    sql_assistant.chat()
\ No newline at end of file
+    if args.engine == "chat_completions":
+        chat_with_engine(initialize_chat_engine(args.database))
+    else:
+        sql_assistant = initialize_assistant(
+            args.database, 
+            assistant_id=args.assistant_id
+        )
+        sql_assistant.chat()
\ No newline at end of file
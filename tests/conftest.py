@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The lib package lives under src/, as for main.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,168 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import openai
+import pytest
+
+from lib.load_balancer import ModelBackend, OpenAILoadBalancer
+
+
+API_VERSION = "2024-05-01-preview"
+
+COMPLETION = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o",
+    "choices": [
+        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}},
+    ],
+    "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+}
+
+
+class StandInServer:
+    """Local HTTP server standing in for an Azure OpenAI endpoint with a fixed answer"""
+
+    def __init__(self, status=200, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.requests += 1
+                if server.status == 200:
+                    body = COMPLETION
+                else:
+                    body = {"error": {"code": str(server.status), "message": "stand-in error"}}
+                payload = json.dumps(body).encode()
+                self.send_response(server.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in server.headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.endpoint = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(status=200, headers=None):
+        server = StandInServer(status, headers)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.close()
+
+
+def make_balancer(*servers):
+    backends = [
+        ModelBackend(name=f"backend{i}", endpoint=server.endpoint, api_key="test",
+                     api_version=API_VERSION, max_retries=0)
+        for i, server in enumerate(servers)
+    ]
+    return OpenAILoadBalancer(backends, eject_seconds=30, max_eject_seconds=300)
+
+
+def complete(balancer):
+    return balancer.call(
+        "gpt-4o",
+        lambda client, deployment: client.chat.completions.create(
+            model=deployment, messages=[{"role": "user", "content": "hi"}]
+        ),
+    )
+
+
+def test_fails_over_and_ejects_overloaded_backend(servers):
+    overloaded = servers(status=429, headers={"Retry-After": "120"})
+    healthy = servers()
+    balancer = make_balancer(overloaded, healthy)
+    # Send the first call to the overloaded backend
+    balancer.backends[1].outstanding = 1
+
+    result = complete(balancer)
+
+    assert result.choices[0].message.content == "ok"
+    assert (overloaded.requests, healthy.requests) == (1, 1)
+    stats = balancer.get_stats()
+    assert stats["backend0"]["ejections"] == 1
+    # Retry-After is longer than the ejection time
+    assert stats["backend0"]["ejected_for_seconds"] > 100
+    assert stats["backend1"]["ejections"] == 0
+
+    # While ejected, calls skip the overloaded backend
+    balancer.backends[1].outstanding = 0
+    for _ in range(3):
+        complete(balancer)
+    assert (overloaded.requests, healthy.requests) == (1, 4)
+
+
+def test_raises_last_error_when_every_backend_fails(servers):
+    first, second = servers(status=503), servers(status=503)
+    balancer = make_balancer(first, second)
+
+    with pytest.raises(openai.InternalServerError):
+        complete(balancer)
+
+    assert (first.requests, second.requests) == (1, 1)
+    assert all(backend.ejected_until > time.time() for backend in balancer.backends)
+
+
+def test_request_errors_neither_fail_over_nor_eject(servers):
+    rejecting, healthy = servers(status=400), servers()
+    balancer = make_balancer(rejecting, healthy)
+    balancer.backends[1].outstanding = 1
+
+    with pytest.raises(openai.BadRequestError):
+        complete(balancer)
+
+    assert (rejecting.requests, healthy.requests) == (1, 0)
+    assert balancer.backends[0].ejected_until == 0.0
+    assert [backend.outstanding for backend in balancer.backends] == [0, 1]
+
+
+def test_ejection_time_doubles_on_consecutive_failures(servers):
+    failing = servers(status=500)
+    balancer = make_balancer(failing)
+
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            complete(balancer)
+
+    backend = balancer.backends[0]
+    assert backend.ejections == 2
+    assert 50 < backend.ejected_until - time.time() <= 60
+
+
+def test_limiter_key_of_an_endpoint_matches_the_balanced_calls():
+    backends = [
+        ModelBackend(name="eastus", endpoint="https://east.openai.azure.com", api_key="test"),
+        ModelBackend(name="local", endpoint="http://127.0.0.1:8081", api_key="test",
+                     deployments={"gpt-4o": "gpt-4o-local"}),
+    ]
+    balancer = OpenAILoadBalancer(backends)
+
+    assert balancer.get_limiter_key("gpt-4o", "https://east.openai.azure.com/openai/") == "eastus/gpt-4o"
+    assert balancer.get_limiter_key("gpt-4o", "http://127.0.0.1:8081/openai/") == "local/gpt-4o-local"
+    # Endpoints outside the balancer keep the bare deployment name
+    assert balancer.get_limiter_key("gpt-4o", "https://other.openai.azure.com/") == "gpt-4o"
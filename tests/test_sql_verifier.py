@@ -0,0 +1,128 @@
+import pytest
+
+from lib.sql_verifier import MAX_ROWS, verify_query
+
+
+CATALOG_TABLES = {
+    "sales": {
+        "table": "Sales",
+        "columns": [{"name": "Region"}, {"name": "Amount"}, {"name": "OrderDate"}, {"name": "Status"}],
+    },
+    "customers": {
+        "table": "Customers",
+        "columns": [{"name": "Region"}, {"name": "Name"}],
+    },
+}
+
+
+def verify(query):
+    return verify_query(query, "Sales", CATALOG_TABLES)
+
+
+def test_inserts_top_into_the_main_select():
+    result = verify("SELECT DISTINCT Region FROM [dbo].[Sales] WHERE Amount > 10;")
+
+    assert result.errors == []
+    assert result.query == f"SELECT DISTINCT TOP {MAX_ROWS} Region FROM [dbo].[Sales] WHERE Amount > 10"
+
+
+def test_inserts_top_after_ctes():
+    result = verify("WITH totals AS (SELECT Region, SUM(Amount) AS Total FROM Sales GROUP BY Region) "
+                    "SELECT Region, Total FROM totals")
+
+    assert result.errors == []
+    assert result.query.endswith(f"SELECT TOP {MAX_ROWS} Region, Total FROM totals")
+
+
+@pytest.mark.parametrize("top, expected", [
+    ("TOP 500", f"TOP {MAX_ROWS}"),
+    ("TOP (500)", f"TOP ({MAX_ROWS})"),
+    ("TOP 10", "TOP 10"),
+])
+def test_caps_top(top, expected):
+    result = verify(f"SELECT {top} Region FROM Sales ORDER BY Amount DESC")
+
+    assert result.query == f"SELECT {expected} Region FROM Sales ORDER BY Amount DESC"
+    assert result.row_limit_applied
+
+
+def test_completes_offset_without_fetch():
+    result = verify("SELECT Region FROM Sales ORDER BY Region OFFSET 100 ROWS")
+
+    assert result.query == f"SELECT Region FROM Sales ORDER BY Region OFFSET 100 ROWS FETCH NEXT {MAX_ROWS} ROWS ONLY"
+
+
+def test_caps_fetch():
+    result = verify("SELECT Region FROM Sales ORDER BY Region OFFSET 0 ROWS FETCH NEXT 1000 ROWS ONLY")
+
+    assert result.query == f"SELECT Region FROM Sales ORDER BY Region OFFSET 0 ROWS FETCH NEXT {MAX_ROWS} ROWS ONLY"
+
+
+def test_leaves_set_operations_unlimited():
+    query = "SELECT Region FROM Sales UNION SELECT Region FROM Customers"
+    result = verify(query)
+
+    assert result.errors == []
+    assert result.query == query
+    assert not result.row_limit_applied
+
+
+@pytest.mark.parametrize("query", [
+    "DELETE FROM Sales",
+    "INSERT INTO Sales (Region) VALUES ('x')",
+    "SELECT Region INTO Copy FROM Sales",
+    "SELECT Region FROM Sales; DROP VIEW Sales",
+    "EXEC sp_who",
+    "WITH x AS (SELECT Region FROM Sales) UPDATE Sales SET Region = 'y'",
+])
+def test_rejects_statements_that_are_not_read_only(query):
+    result = verify(query)
+
+    assert not result.read_only
+    assert result.errors
+
+
+@pytest.mark.parametrize("query, unknown", [
+    ("SELECT Regoin FROM Sales", "Regoin"),
+    ("SELECT [Regoin] FROM Sales", "[Regoin]"),
+    ("SELECT s.Regoin FROM Sales s", "Regoin"),
+    ("SELECT Region FROM Sales WHERE Satus = 'Open'", "Satus"),
+    ("SELECT Region, COUNT(*) FROM Sales GROUP BY Region, Country", "Country"),
+    ("SELECT Region FROM Sales ORDER BY Total", "Total"),
+    ("SELECT Region FROM Sales WHERE Amount IN (SELECT Amount FROM Sales WHERE Bogus = 1)", "Bogus"),
+])
+def test_rejects_unknown_columns(query, unknown):
+    result = verify(query)
+
+    assert len(result.errors) == 1
+    assert result.errors[0].startswith(f"Unknown column(s) {unknown}.")
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT Region, SUM(Amount) AS Total FROM Sales GROUP BY Region ORDER BY Total DESC",
+    "SELECT Region Area, SUM(Amount) [Total] FROM Sales GROUP BY Region ORDER BY Area",
+    "SELECT CASE WHEN Amount > 0 THEN 'y' ELSE 'n' END Positive FROM Sales",
+    "SELECT DATEADD(day, 1, OrderDate), CONVERT(varchar(10), OrderDate, 120) FROM Sales",
+    "SELECT CAST(Amount AS int) FROM Sales WHERE Status IS NOT NULL AND Amount BETWEEN 1 AND 5",
+    "SELECT Region, ROW_NUMBER() OVER (PARTITION BY Region ORDER BY Amount DESC) AS rn FROM Sales",
+    "SELECT s.Region, c.Name FROM Sales s JOIN Customers AS c ON s.Region = c.Region",
+])
+def test_accepts_known_columns_keywords_functions_and_aliases(query):
+    assert verify(query).errors == []
+
+
+def test_rejects_unknown_views():
+    result = verify("SELECT Region FROM Orders")
+
+    assert result.errors == ["View 'Orders' does not exist in this datasource."]
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT @@version",
+    "SELECT 1 AS one",
+    "WITH c AS (SELECT 1 AS one) SELECT one FROM c",
+])
+def test_rejects_queries_that_read_no_view(query):
+    result = verify(query)
+
+    assert result.errors == ["The query must read from a view of this datasource, e.g. [dbo].[Sales]."]